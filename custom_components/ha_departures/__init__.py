@@ -16,6 +16,7 @@ from homeassistant.exceptions import ConfigEntryNotReady
 
 from .const import DOMAIN, STARTUP_MESSAGE
 from .coordinator import DeparturesDataUpdateCoordinator
+from .hub import async_load_cache
 
 _LOGGER: logging.Logger = logging.getLogger(__name__)
 
@@ -33,6 +34,8 @@ class RuntimeData:
 
 async def async_setup(hass: HomeAssistant, config: Config):
     """Set up this integration using YAML is not supported."""
+    await async_load_cache(hass)
+
     return True
 
 
@@ -43,10 +46,15 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry):
 
     coordinator = DeparturesDataUpdateCoordinator(hass, entry)
 
-    await coordinator.async_config_entry_first_refresh()
+    # Serve departures of the last session if available, otherwise wait for
+    # the first response of the server
+    if not await coordinator.async_restore():
+        await coordinator.async_config_entry_first_refresh()
+
+        if not coordinator.last_update_success:
+            raise ConfigEntryNotReady("Failed to get data from server")
 
-    if not coordinator.last_update_success:
-        raise ConfigEntryNotReady("Failed to get data from server")
+    coordinator.async_stagger_refresh()
 
     entry.runtime_data = RuntimeData(coordinator)
 
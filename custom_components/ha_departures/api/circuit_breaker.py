@@ -0,0 +1,137 @@
+"""Circuit breaker for the Motis API endpoints."""
+
+import logging
+import time
+from enum import StrEnum
+
+from aiohttp import ClientError
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(StrEnum):
+    """State of a circuit breaker."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(ClientError):
+    """Request not sent, the circuit breaker of the endpoint is open."""
+
+    def __init__(self, base_url: str, retry_in: float) -> None:
+        """Create the error, `retry_in` seconds are left until the next probe."""
+        super().__init__(
+            f"Circuit breaker of '{base_url}' is open, next probe in {retry_in:.0f}s"
+        )
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Circuit breaker stopping requests to a failing endpoint.
+
+    The circuit opens after `threshold` consecutive failed requests, no
+    requests are sent then. Once `reset_timeout` elapsed it is half-open and
+    a single probe request is let through: the circuit closes if it succeeds,
+    otherwise it opens again with doubled timeout (up to `max_reset_timeout`).
+    """
+
+    def __init__(
+        self, threshold: int, reset_timeout: float, max_reset_timeout: float
+    ) -> None:
+        """Create a closed circuit breaker.
+
+        :param threshold: Consecutive failures opening the circuit
+        :type threshold: int
+        :param reset_timeout: Seconds until the first probe of an open circuit
+        :type reset_timeout: float
+        :param max_reset_timeout: Upper bound of the doubled timeout in seconds
+        :type max_reset_timeout: float
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened = 0
+
+        self._timeout = reset_timeout
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def retry_in(self) -> float:
+        """Return seconds left until an open circuit lets a probe through."""
+        if self.state is not CircuitState.OPEN:
+            return 0.0
+
+        return max(0.0, self._opened_at + self._timeout - time.monotonic())
+
+    @property
+    def ready(self) -> bool:
+        """Return True if `allow` would let a request through."""
+        if self.state is CircuitState.OPEN:
+            return self.retry_in == 0
+
+        return self.state is CircuitState.CLOSED or not self._probing
+
+    def allow(self) -> bool:
+        """Return True if a request may be sent.
+
+        While half-open only the first caller is allowed (the probe), until
+        its result is reported.
+        """
+        if self.state is CircuitState.CLOSED:
+            return True
+
+        if self.state is CircuitState.OPEN:
+            if self.retry_in > 0:
+                return False
+
+            logger.debug("Circuit half-open, sending probe request")
+            self.state = CircuitState.HALF_OPEN
+            self._probing = False
+
+        if self._probing:
+            return False
+
+        self._probing = True
+        return True
+
+    def on_success(self) -> None:
+        """Close the circuit after a request reached the endpoint."""
+        if self.state is not CircuitState.CLOSED:
+            logger.info("Endpoint reachable again, circuit closed")
+
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self._timeout = self.reset_timeout
+        self._probing = False
+
+    def on_failure(self) -> None:
+        """Count a failed request, open the circuit if the threshold is reached."""
+        self.failures += 1
+
+        if self.state is CircuitState.HALF_OPEN:
+            self._timeout = min(self.max_reset_timeout, self._timeout * 2)
+            self._open()
+        elif self.state is CircuitState.CLOSED and self.failures >= self.threshold:
+            self._open()
+
+    def on_cancel(self) -> None:
+        """Let the next caller probe if the probe request was cancelled."""
+        self._probing = False
+
+    def _open(self) -> None:
+        self.state = CircuitState.OPEN
+        self.opened += 1
+        self._opened_at = time.monotonic()
+        self._probing = False
+
+        logger.warning(
+            "Circuit opened after %d failed request(s), next probe in %.0fs",
+            self.failures,
+            self._timeout,
+        )
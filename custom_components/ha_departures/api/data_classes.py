@@ -1,5 +1,6 @@
 """Data classes and enums for API classes."""
 
+import sys
 from dataclasses import dataclass
 from datetime import datetime
 from enum import StrEnum
@@ -8,6 +9,11 @@ from typing import Any
 from custom_components.ha_departures.helper import str_to_datetime
 
 
+def _intern[T](value: T) -> T:
+    """Return interned string, values repeated in many stop times share memory."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 class ApiCommand(StrEnum):
     """API commanStrEnum."""
 
@@ -52,7 +58,7 @@ class TransportMode(StrEnum):
     UNKNOWN = "unknown"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Stop:
     """Data class for a transit stop."""
 
@@ -76,7 +82,7 @@ class Stop:
         return self.id
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class StopTime:
     """Data class for a stop time."""
 
@@ -98,10 +104,10 @@ class StopTime:
         return StopTime(
             mode=TransportMode(data.get("mode", "unknown")),
             real_time=data.get("realTime", False),
-            head_sign=data.get("headsign", "unknown"),
-            short_name=data.get("routeShortName", "unknown"),
-            route_id=data.get("routeId", "unknown"),
-            direction=data.get("directionId", "unknown"),
+            head_sign=_intern(data.get("headsign", "unknown")),
+            short_name=_intern(data.get("routeShortName", "unknown")),
+            route_id=_intern(data.get("routeId", "unknown")),
+            direction=_intern(data.get("directionId", "unknown")),
             arrival_time=data.get("place", {}).get("arrival", ""),
             departure_time=data.get("place", {}).get("departure", ""),
             scheduled_arrival_time=data.get("place", {}).get("scheduledArrival", ""),
@@ -110,7 +116,7 @@ class StopTime:
         )
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Line:
     """Data class for a transit line."""
 
@@ -134,10 +140,10 @@ class Line:
     def from_dict(data: dict[str, Any]) -> "Line":
         """Create a Line object from a dictionary."""
         return Line(
-            route_id=data.get("route_id", "unknown"),
-            direction_id=data.get("direction_id", "unknown"),
-            head_sign=data.get("head_sign", "unknown"),
-            route_short_name=data.get("route_short_name", "unknown"),
+            route_id=_intern(data.get("route_id", "unknown")),
+            direction_id=_intern(data.get("direction_id", "unknown")),
+            head_sign=_intern(data.get("head_sign", "unknown")),
+            route_short_name=_intern(data.get("route_short_name", "unknown")),
             mode=TransportMode(data.get("transport_mode", "unknown")),
         )
 
@@ -154,8 +160,7 @@ class Line:
         )
 
 
-
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Departure:
     """Data class for a departure."""
 
@@ -182,21 +187,50 @@ class Departure:
         alerts = data.get("place", {}).get("alerts", [])
 
         return Departure(
-            route_id=data.get("routeId", "unknown"),
-            direction_id=data.get("directionId", "unknown"),
+            route_id=_intern(data.get("routeId", "unknown")),
+            direction_id=_intern(data.get("directionId", "unknown")),
             trip_id=data.get("tripId", "unknown"),
-            stop_id=data.get("place", {}).get("stopId", "unknown"),
+            stop_id=_intern(data.get("place", {}).get("stopId", "unknown")),
             departure=str_to_datetime(departure_time),
             scheduled_departure=str_to_datetime(scheduled_departure_time),
-            head_sign=data.get("headsign", ""),
+            head_sign=_intern(data.get("headsign", "")),
             real_time=data.get("realTime", False),
             cancelled=data.get("cancelled", False),
             trip_cancelled=data.get("tripCancelled", False),
             alerts=bool(alerts),
-            scheduled_track=data.get("place", {}).get("scheduledTrack"),
-            track=data.get("place", {}).get("track"),
+            scheduled_track=_intern(data.get("place", {}).get("scheduledTrack")),
+            track=_intern(data.get("place", {}).get("track")),
         )
 
+    def to_dict(self) -> dict[str, Any]:
+        """Convert Departure object to dictionary (same format as the API)."""
+        return {
+            "routeId": self.route_id,
+            "directionId": self.direction_id,
+            "tripId": self.trip_id,
+            "headsign": self.head_sign,
+            "realTime": self.real_time,
+            "cancelled": self.cancelled,
+            "tripCancelled": self.trip_cancelled,
+            "place": {
+                "stopId": self.stop_id,
+                "departure": self.departure.isoformat() if self.departure else None,
+                "scheduledDeparture": (
+                    self.scheduled_departure.isoformat()
+                    if self.scheduled_departure
+                    else None
+                ),
+                "alerts": [{}] if self.alerts else [],
+                "scheduledTrack": self.scheduled_track,
+                "track": self.track,
+            },
+        }
+
+    @property
+    def expected_departure(self) -> datetime | None:
+        """Return estimated departure time if available, scheduled otherwise."""
+        return self.departure or self.scheduled_departure
+
     def __hash__(self) -> int:
         """Override hash function for Departure class."""
         return hash(
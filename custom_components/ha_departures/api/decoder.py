@@ -0,0 +1,285 @@
+"""Decoding of Motis API responses."""
+
+import json
+import re
+from collections.abc import Callable, Collection
+from enum import Enum, auto
+from typing import Any, Protocol
+
+from .data_classes import Departure
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+type Decoder = Callable[[bytes], Any]
+
+_STOP_TIMES_START = re.compile(rb'"stopTimes"\s*:\s*\[')
+_SEPARATOR = re.compile(rb"[\s,]*")
+# Possible end of an element: a brace followed by the next element or the end
+_ELEMENT_END = re.compile(rb"\}(?=\s*(?:,\s*\{|\]))")
+
+
+class StreamParser(Protocol):
+    """Parser of a response body received in chunks."""
+
+    def feed(self, chunk: bytes) -> None:
+        """Parse the next chunk of the body."""
+
+    def close(self) -> Any:
+        """Finish parsing after the last chunk, return the result."""
+
+
+class _State(Enum):
+    HEADER = auto()
+    ITEMS = auto()
+    TRAILER = auto()
+
+
+def json_loads(data: bytes) -> Any:
+    """Decode a JSON document, use orjson if installed (shipped with HA)."""
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+class StopTimesFilter:
+    """Filter accepting stop times of the given stops and lines.
+
+    Like the sensors, a stop time belongs to a line (route id, direction id)
+    if its route id ends with the route id of the line. This is resolved once
+    per distinct route.
+
+    With `limit` only the first `limit` trips of a line per stop are accepted
+    (repeated stop times of these trips too), later ones are never shown by
+    a sensor and not worth being parsed.
+
+    The filter counts the stop times it has seen in total and per line. The
+    next page of a response continues with a copy (s. `copy`), so a failed
+    or hedged attempt never adds to the counts of the one used.
+    """
+
+    def __init__(
+        self,
+        stop_ids: Collection[str],
+        line_keys: Collection[tuple[str, str]],
+        limit: int | None = None,
+    ) -> None:
+        """Create a filter.
+
+        :param stop_ids: Stop ids to accept
+        :type stop_ids: Collection[str]
+        :param line_keys: Lines (route id, direction id) to accept
+        :type line_keys: Collection[tuple[str, str]]
+        :param limit: Max number of trips per line and stop, all if not set
+        :type limit: int | None
+        """
+        self.stop_ids = stop_ids
+        self.line_keys = line_keys
+        self.limit = limit
+
+        # Stop times seen and stop times per line (also those beyond limit)
+        self.seen = 0
+        self.matched: dict[tuple[str, str], int] = dict.fromkeys(line_keys, 0)
+
+        self._resolved: dict[tuple[str, str], tuple[tuple[str, str], ...]] = {}
+        self._trips: dict[tuple[str, str, str], set[str]] = {}
+        self._line_trips: dict[tuple[str, str], set[str]] = {
+            key: set() for key in line_keys
+        }
+
+    def __call__(self, stop_time: dict[str, Any]) -> bool:
+        """Return True if the stop time is accepted."""
+        self.seen += 1
+
+        stop_id = stop_time.get("place", {}).get("stopId", "unknown")
+
+        if stop_id not in self.stop_ids:
+            return False
+
+        key = (
+            stop_time.get("routeId", "unknown"),
+            stop_time.get("directionId", "unknown"),
+        )
+
+        if (lines := self._resolved.get(key)) is None:
+            lines = self._resolved[key] = tuple(
+                (route_id, direction_id)
+                for route_id, direction_id in self.line_keys
+                if key[0].endswith(route_id) and key[1] == direction_id
+            )
+
+        for line in lines:
+            self.matched[line] += 1
+
+        if not lines or self.limit is None:
+            return bool(lines)
+
+        trip_id = stop_time.get("tripId", "unknown")
+        accepted = self._trips.setdefault((*key, stop_id), set())
+
+        if trip_id not in accepted:
+            if len(accepted) >= self.limit:
+                return False
+
+            accepted.add(trip_id)
+
+        for line in lines:
+            self._line_trips[line].add(trip_id)
+
+        return True
+
+    def copy(self) -> "StopTimesFilter":
+        """Return a filter continuing with the counts of this one."""
+        other = StopTimesFilter(self.stop_ids, self.line_keys, self.limit)
+        other.seen = self.seen
+        other.matched = dict(self.matched)
+        other._resolved = dict(self._resolved)
+        other._trips = {key: set(trips) for key, trips in self._trips.items()}
+        other._line_trips = {key: set(trips) for key, trips in self._line_trips.items()}
+
+        return other
+
+    def underfilled(self, limit: int | None = None) -> set[tuple[str, str]]:
+        """Return lines with less than `limit` accepted trips (over all stops).
+
+        :param limit: Trips a line needs, limit of the filter if not set
+        :type limit: int | None
+        """
+        if (limit := limit or self.limit) is None:
+            return set()
+
+        return {line for line, trips in self._line_trips.items() if len(trips) < limit}
+
+
+def _decode_element(
+    buffer: bytes, pos: int, decoder: Decoder
+) -> tuple[dict[str, Any], int] | None:
+    """Decode the object starting at `pos`, return it and its end.
+
+    The object ends at the first possible end it can be decoded up to (an
+    object in an array or a string may look like the end too). None is
+    returned if the object is not complete yet.
+    """
+    if buffer[pos] != ord("{"):
+        raise ValueError("Invalid stop times response")
+
+    for match in _ELEMENT_END.finditer(buffer, pos):
+        try:
+            return decoder(buffer[pos : match.end()]), match.end()
+        except ValueError:
+            continue
+
+    return None
+
+
+class StopTimesParser:
+    """Incremental parser of a stop times response body.
+
+    Every complete element of `stopTimes` is decoded on its own (by
+    `decoder`, orjson if installed) and kept as departure only if accepted
+    by `accept`, so the whole document is never held in memory. The other
+    members of the response (e.g. the page cursors) are decoded when the
+    parser is closed.
+    """
+
+    def __init__(
+        self,
+        accept: Callable[[dict[str, Any]], bool] | None = None,
+        decoder: Decoder = json_loads,
+    ) -> None:
+        """Create a parser.
+
+        :param accept: Filter of the stop times to keep, all if not set
+        :type accept: Callable[[dict[str, Any]], bool] | None
+        :param decoder: JSON decoder of the elements and the rest of the body
+        :type decoder: Decoder
+        """
+        self.departures: list[Departure] = []
+        self.skipped = 0
+        self.next_page_cursor: str | None = None
+        self.previous_page_cursor: str | None = None
+
+        self.accept = accept
+        self._decoder = decoder
+        self._state = _State.HEADER
+        self._buffer = b""
+
+        # Response without the elements of "stopTimes"
+        self._rest: list[bytes] = []
+
+    def feed(self, chunk: bytes) -> None:
+        """Parse the next chunk of the body."""
+        self._buffer += chunk
+        self._parse()
+
+    def close(self) -> "StopTimesParser":
+        """Finish parsing after the last chunk.
+
+        :raises ValueError: If the body is not a complete JSON document
+        """
+        if self._state is _State.ITEMS:
+            raise ValueError("Incomplete stop times response")
+
+        document = self._decoder(b"".join(self._rest) + self._buffer)
+        self._rest.clear()
+        self._buffer = b""
+
+        # Not streamed if "stopTimes" was not found (e.g. null)
+        for stop_time in document.get("stopTimes") or []:
+            self._add(stop_time)
+
+        self.next_page_cursor = document.get("nextPageCursor")
+        self.previous_page_cursor = document.get("previousPageCursor")
+
+        return self
+
+    def _parse(self) -> None:
+        if self._state is _State.HEADER:
+            self._parse_header()
+
+        if self._state is _State.ITEMS:
+            self._parse_items()
+
+        if self._state is _State.TRAILER:
+            self._rest.append(self._buffer)
+            self._buffer = b""
+
+    def _parse_header(self) -> None:
+        if (match := _STOP_TIMES_START.search(self._buffer)) is None:
+            return
+
+        self._rest.append(self._buffer[: match.end()])
+        self._buffer = self._buffer[match.end() :]
+        self._state = _State.ITEMS
+
+    def _parse_items(self) -> None:
+        buffer = self._buffer
+        pos = 0
+
+        while True:
+            pos = _SEPARATOR.match(buffer, pos).end()
+
+            if pos == len(buffer):
+                break
+
+            if buffer[pos] == ord("]"):
+                self._state = _State.TRAILER
+                break
+
+            if (element := _decode_element(buffer, pos, self._decoder)) is None:
+                # Element not complete yet, wait for the next chunk
+                break
+
+            stop_time, pos = element
+            self._add(stop_time)
+
+        self._buffer = buffer[pos:]
+
+    def _add(self, stop_time: dict[str, Any]) -> None:
+        if self.accept is None or self.accept(stop_time):
+            self.departures.append(Departure.from_dict(stop_time))
+        else:
+            self.skipped += 1
@@ -0,0 +1,180 @@
+"""Columnar container of departures for bulk filtering and selection."""
+
+from collections.abc import Collection, Iterable, Sequence
+from datetime import datetime
+from enum import IntFlag
+from typing import Any
+
+from .data_classes import Departure
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+class DepartureFlag(IntFlag):
+    """Bit flags of a departure stored in `DepartureBatch.flags`."""
+
+    CANCELLED = 1
+    TRIP_CANCELLED = 2
+    REAL_TIME = 4
+    ALERTS = 8
+
+
+class DepartureBatch:
+    """Departures stored as parallel arrays, one element per departure.
+
+    Route, direction, trip and stop ids, head signs and tracks are stored as
+    codes of `strings` (None included), departure times as epoch seconds (NaN
+    if not set) and the boolean attributes as `DepartureFlag` bits. Filtering,
+    grouping and selection run on the arrays and return row numbers, the
+    `Departure` objects of the rows are only looked up for the result.
+
+    Building a batch costs more than filtering the departures one by one, it
+    pays off only for many departures shared by several subscribers of a hub
+    (s. `DEPARTURE_BATCH_MIN_ROWS`).
+    Requires numpy (shipped with Home Assistant), see `available()`.
+    """
+
+    __slots__ = (
+        "departure",
+        "direction",
+        "flags",
+        "head_sign",
+        "objects",
+        "route",
+        "scheduled_departure",
+        "scheduled_track",
+        "stop",
+        "strings",
+        "track",
+        "trip",
+    )
+
+    def __init__(self, departures: Sequence[Departure]) -> None:
+        """Create a batch of `departures` (order is preserved)."""
+        codes: dict[str | None, int] = {}
+        # Parsed timestamps are shared by departures (see str_to_datetime)
+        epochs: dict[int, float] = {}
+
+        def code(value: str | None) -> int:
+            if (result := codes.get(value)) is None:
+                result = codes[value] = len(codes)
+            return result
+
+        def epoch(value: datetime | None) -> float:
+            if value is None:
+                return np.nan
+            if (result := epochs.get(id(value))) is None:
+                result = epochs[id(value)] = value.timestamp()
+            return result
+
+        def column(values: Iterable[Any], dtype: Any) -> Any:
+            return np.fromiter(values, dtype, len(departures))
+
+        self.objects: Sequence[Departure] = departures
+        self.strings: dict[str | None, int] = codes
+        self.route = column((code(d.route_id) for d in departures), np.int32)
+        self.direction = column((code(d.direction_id) for d in departures), np.int32)
+        self.trip = column((code(d.trip_id) for d in departures), np.int32)
+        self.stop = column((code(d.stop_id) for d in departures), np.int32)
+        self.head_sign = column((code(d.head_sign) for d in departures), np.int32)
+        self.scheduled_track = column(
+            (code(d.scheduled_track) for d in departures), np.int32
+        )
+        self.track = column((code(d.track) for d in departures), np.int32)
+        self.flags = column(
+            (
+                d.cancelled | d.trip_cancelled << 1 | d.real_time << 2 | d.alerts << 3
+                for d in departures
+            ),
+            np.uint8,
+        )
+        self.departure = column((epoch(d.departure) for d in departures), np.float64)
+        self.scheduled_departure = column(
+            (epoch(d.scheduled_departure) for d in departures), np.float64
+        )
+
+    @staticmethod
+    def available() -> bool:
+        """Return True if numpy is installed."""
+        return np is not None
+
+    def __len__(self) -> int:
+        """Return count of departures."""
+        return len(self.objects)
+
+    def _codes(self, values: Iterable[str]) -> list[int]:
+        return [self.strings[v] for v in values if v in self.strings]
+
+    def departures(self, rows: Iterable[int]) -> list[Departure]:
+        """Return the departures of the given row numbers."""
+        return [self.objects[i] for i in rows]
+
+    def at_stops(self, stop_ids: Collection[str]) -> Any:
+        """Return row numbers of departures at the given stops."""
+        return np.flatnonzero(np.isin(self.stop, self._codes(stop_ids)))
+
+    def unique(self, rows: Any) -> Any:
+        """Return `rows` without duplicates, first occurrences in order.
+
+        Departures are equal if all their fields are, like the equality of
+        `Departure` used by `unique_departures`.
+        """
+        if not len(rows):
+            return rows
+
+        keys = (
+            # Bit pattern of the times, so NaN (not set) equals NaN
+            self.departure[rows].view(np.int64),
+            self.scheduled_departure[rows].view(np.int64),
+            self.stop[rows],
+            self.trip[rows],
+            self.direction[rows],
+            self.route[rows],
+            self.head_sign[rows],
+            self.scheduled_track[rows],
+            self.track[rows],
+            self.flags[rows],
+        )
+        # Stable sort, the first occurrence of equal rows comes first
+        order = np.lexsort(keys)
+        duplicate = np.ones(len(rows) - 1, dtype=bool)
+
+        for key in keys:
+            ordered = key[order]
+            duplicate &= ordered[1:] == ordered[:-1]
+
+        return rows[np.sort(order[np.concatenate(([True], ~duplicate))])]
+
+    def group(
+        self, rows: Any, line_keys: Iterable[tuple[str, str]], limit: int
+    ) -> dict[tuple[str, str], Any]:
+        """Return the first `limit` rows of every line (route id, direction id).
+
+        Like `index_departures`, a departure belongs to a line if its route
+        id ends with the route id of the line.
+        """
+        routes = {
+            route: self.objects[rows[i]].route_id
+            for route, i in zip(
+                *np.unique(self.route[rows], return_index=True), strict=True
+            )
+        }
+        result: dict[tuple[str, str], Any] = {}
+
+        for route_id, direction_id in line_keys:
+            codes = [c for c, r in routes.items() if r.endswith(route_id)]
+            direction = self.strings.get(direction_id, -1)
+            mask = np.isin(self.route[rows], codes) & (
+                self.direction[rows] == direction
+            )
+            # The response is ordered by departure, the first rows are the top k
+            result[route_id, direction_id] = rows[mask][:limit]
+
+        return result
+
+    def has_flag(self, rows: Any, flag: DepartureFlag) -> Any:
+        """Return mask of the rows having all bits of `flag` set."""
+        return (self.flags[rows] & flag) == flag
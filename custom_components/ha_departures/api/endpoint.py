@@ -0,0 +1,91 @@
+"""Motis API endpoints and their health."""
+
+from collections import deque
+
+from custom_components.ha_departures.const import ENDPOINT_MIN_SUCCESS_RATE
+
+from .circuit_breaker import CircuitBreaker, CircuitState
+from .latency import LatencyTracker
+from .rate_limiter import TokenBucket
+
+
+class Endpoint:
+    """A Motis API server and the state of the requests sent to it.
+
+    Endpoints are ranked by their `score`, the expected time of a successful
+    request derived from the median latency and the share of recently failed
+    requests.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        limiter: TokenBucket,
+        breaker: CircuitBreaker,
+        latency: LatencyTracker,
+        samples: int,
+    ) -> None:
+        """Create an endpoint.
+
+        :param base_url: API base URL of the server
+        :type base_url: str
+        :param limiter: Rate limiter of the server
+        :type limiter: TokenBucket
+        :param breaker: Circuit breaker of the server
+        :type breaker: CircuitBreaker
+        :param latency: Latencies of successful requests to the server
+        :type latency: LatencyTracker
+        :param samples: Number of recent request outcomes kept
+        :type samples: int
+        """
+        self.base_url = base_url
+        self.limiter = limiter
+        self.breaker = breaker
+        self.latency = latency
+
+        self.requests = 0
+        self.failures = 0
+
+        self._outcomes: deque[bool] = deque(maxlen=samples)
+
+    def __repr__(self) -> str:
+        """Return representation for logging."""
+        return f"Endpoint({self.base_url!r}, {self.breaker.state.value})"
+
+    @property
+    def available(self) -> bool:
+        """Return True if the circuit breaker of the endpoint is closed."""
+        return self.breaker.state is CircuitState.CLOSED
+
+    @property
+    def error_rate(self) -> float:
+        """Return share of failed requests of the recent ones."""
+        if not self._outcomes:
+            return 0.0
+
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    @property
+    def score(self) -> float:
+        """Return expected seconds of a successful request, lower is better.
+
+        Endpoints with too few latencies to rank score 0, so they are tried
+        before the known ones until their latency is known.
+        """
+        if (latency := self.latency.percentile(0.5)) is None:
+            return 0.0
+
+        return latency / max(1 - self.error_rate, ENDPOINT_MIN_SUCCESS_RATE)
+
+    def on_success(self) -> None:
+        """Count a request answered by the server."""
+        self.requests += 1
+        self._outcomes.append(True)
+        self.breaker.on_success()
+
+    def on_failure(self) -> None:
+        """Count a failed request (network error, timeout or server error)."""
+        self.requests += 1
+        self.failures += 1
+        self._outcomes.append(False)
+        self.breaker.on_failure()
@@ -0,0 +1,40 @@
+"""Latency statistics of requests to the Motis API."""
+
+import math
+from collections import deque
+
+
+class LatencyTracker:
+    """Latencies of the most recent successful requests."""
+
+    def __init__(self, samples: int, min_samples: int) -> None:
+        """Create a tracker.
+
+        :param samples: Number of recent latencies kept
+        :type samples: int
+        :param min_samples: Latencies needed before percentiles are returned
+        :type min_samples: int
+        """
+        self.min_samples = min_samples
+
+        self._latencies: deque[float] = deque(maxlen=samples)
+
+    def __len__(self) -> int:
+        """Return count of kept latencies."""
+        return len(self._latencies)
+
+    def record(self, seconds: float) -> None:
+        """Record the latency of a successful request."""
+        self._latencies.append(seconds)
+
+    def percentile(self, share: float) -> float | None:
+        """Return latency not exceeded by `share` (e.g. 0.95) of the requests.
+
+        None is returned until `min_samples` latencies were recorded.
+        """
+        if len(self._latencies) < self.min_samples:
+            return None
+
+        ordered = sorted(self._latencies)
+
+        return ordered[max(1, min(len(ordered), math.ceil(share * len(ordered)))) - 1]
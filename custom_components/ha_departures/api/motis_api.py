@@ -2,44 +2,206 @@
 
 import asyncio
 import logging
+import random
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable, Sequence
+from http import HTTPStatus
 from typing import Any
 
 from aiohttp import (
     ClientError,
+    ClientResponse,
     ClientResponseError,
     ClientSession,
     ClientSSLError,
     ClientTimeout,
+    TCPConnector,
+    hdrs,
 )
 
 from custom_components.ha_departures.const import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    CIRCUIT_RESET_TIMEOUT_MAX,
     GITHUB_REPO_URL,
+    REQUEST_BACKOFF_BASE,
+    REQUEST_BACKOFF_MAX,
+    REQUEST_BURST,
+    REQUEST_CHUNK_SIZE,
+    REQUEST_CONNECTION_LIMIT,
+    REQUEST_DNS_CACHE_TTL,
     REQUEST_HEADER_JSON,
+    REQUEST_HEDGE_MIN_DELAY,
+    REQUEST_HEDGE_PERCENTILE,
+    REQUEST_LATENCY_MIN_SAMPLES,
+    REQUEST_LATENCY_SAMPLES,
+    REQUEST_RATE,
+    REQUEST_RATE_MIN,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
     VERSION,
 )
 
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
 from .data_classes import ApiCommand
+from .decoder import Decoder, StreamParser, json_loads
+from .endpoint import Endpoint
+from .latency import LatencyTracker
+from .rate_limiter import TokenBucket, parse_retry_after
+from .response_cache import UNCHANGED, ResponseCache, content_hash
+from .single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
 TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
 
 
+class DeadlineExceededError(TimeoutError):
+    """Request not sent, the deadline expired while it was waiting."""
+
+
+# Rate limiters shared by all clients of the same base URL
+_LIMITERS: dict[str, TokenBucket] = {}
+
+
+def get_limiter(
+    base_url: str, rate: float = REQUEST_RATE, burst: int = REQUEST_BURST
+) -> TokenBucket:
+    """Return the rate limiter of a base URL, create it if not existing yet."""
+    if base_url not in _LIMITERS:
+        _LIMITERS[base_url] = TokenBucket(rate, burst, REQUEST_RATE_MIN)
+
+    return _LIMITERS[base_url]
+
+
+# Requests in flight shared by all clients of the same base URL
+_SINGLE_FLIGHTS: dict[str, SingleFlight] = {}
+
+
+def get_single_flight(base_url: str) -> SingleFlight:
+    """Return the in-flight requests of a base URL, create them if not existing yet."""
+    if base_url not in _SINGLE_FLIGHTS:
+        _SINGLE_FLIGHTS[base_url] = SingleFlight()
+
+    return _SINGLE_FLIGHTS[base_url]
+
+
+# Endpoints (incl. circuit breaker and latencies) shared by all clients of
+# the same base URL
+_ENDPOINTS: dict[str, Endpoint] = {}
+
+
+def get_endpoint(
+    base_url: str, rate: float = REQUEST_RATE, burst: int = REQUEST_BURST
+) -> Endpoint:
+    """Return the endpoint of a base URL, create it if not existing yet."""
+    if base_url not in _ENDPOINTS:
+        _ENDPOINTS[base_url] = Endpoint(
+            base_url,
+            get_limiter(base_url, rate, burst),
+            CircuitBreaker(
+                CIRCUIT_FAILURE_THRESHOLD,
+                CIRCUIT_RESET_TIMEOUT,
+                CIRCUIT_RESET_TIMEOUT_MAX,
+            ),
+            LatencyTracker(REQUEST_LATENCY_SAMPLES, REQUEST_LATENCY_MIN_SAMPLES),
+            REQUEST_LATENCY_SAMPLES,
+        )
+
+    return _ENDPOINTS[base_url]
+
+
+def request_key(
+    command: ApiCommand, params: dict[str, str] | None
+) -> tuple[str, tuple[tuple[str, str], ...]]:
+    """Return a key identifying identical requests."""
+    return (
+        command.value,
+        tuple(sorted((k, str(v)) for k, v in (params or {}).items())),
+    )
+
+
 class MotisApi:
     """Client for the Motis API."""
 
-    def __init__(self, base_url: str, session: ClientSession | None = None) -> None:
+    def __init__(
+        self,
+        base_url: str | Sequence[str],
+        session: ClientSession | None = None,
+        rate: float = REQUEST_RATE,
+        burst: int = REQUEST_BURST,
+        decoder: Decoder = json_loads,
+    ) -> None:
         """Create an API instance.
 
-        :param base_url: API base URL
-        :type base_url: str
-        :param session: Client session to use for requests
+        :param base_url: API base URL, or base URLs of several servers providing
+            the same data (s. `set_endpoints`)
+        :type base_url: str | Sequence[str]
+        :param session: Client session to use for requests, if not set an own
+            session is created on first request and reused until `close`
         :type session: ClientSession | None
+        :param rate: Max requests per second to a base URL (shared by all clients)
+        :type rate: float
+        :param burst: Max requests sent at once to a base URL
+        :type burst: int
+        :param decoder: Decoder of JSON response bodies
+        :type decoder: Decoder
         """
         logger.debug("Initializing MotisApi with base_url: %s", base_url)
 
-        self.base_url = base_url
         self.session = session
+        self._owns_session = session is None
+        self._rate = rate
+        self._burst = burst
+        self.responses = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+        self.hedged = 0
+        self.decoder = decoder
+
+        self.set_endpoints([base_url] if isinstance(base_url, str) else base_url)
+
+    @property
+    def available(self) -> bool:
+        """Return True if the circuit breaker of any endpoint is closed."""
+        return any(endpoint.available for endpoint in self.endpoints)
+
+    def set_endpoints(self, base_urls: Sequence[str]) -> None:
+        """Set the servers requests are sent to.
+
+        All servers must provide the same data (e.g. a self-hosted Motis and
+        the public one). Every request is sent to the endpoint with the best
+        score, if it fails to the next one (s. `get`).
+        """
+        if not base_urls:
+            raise ValueError("At least one base URL is required")
+
+        self.endpoints = [
+            get_endpoint(base_url, self._rate, self._burst)
+            for base_url in dict.fromkeys(base_urls)
+        ]
+        self.base_url = self.endpoints[0].base_url
+        self.single_flight = get_single_flight(self.base_url)
+
+        logger.debug("Using endpoints: %s", self.endpoints)
+
+    async def close(self) -> None:
+        """Close the client session if created by this instance."""
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def __get_session(self) -> ClientSession:
+        if self.session is None or self.session.closed:
+            logger.debug("Creating client session for %s", self.base_url)
+
+            # Keep connections alive and cache DNS lookups between requests
+            self.session = ClientSession(
+                connector=TCPConnector(
+                    limit=REQUEST_CONNECTION_LIMIT, ttl_dns_cache=REQUEST_DNS_CACHE_TTL
+                )
+            )
+            self._owns_session = True
+
+        return self.session
 
     def __get_headers(self) -> dict[str, str]:
         return {
@@ -53,8 +215,14 @@ class MotisApi:
         session: ClientSession,
         headers: dict[str, str],
         timeout: ClientTimeout,
+        *,
         params: dict[str, str] | None = None,
-    ):
+        parser: Callable[[], StreamParser] | None = None,
+        key: Hashable | None = None,
+    ) -> Any:
+        if key is not None:
+            headers = {**headers, **self.responses.headers(key)}
+
         logger.debug("Sending GET request to URL: %s with params: %s", url, params)
         logger.debug("Request headers: %s", headers)
         logger.debug("Request timeout: %s", timeout)
@@ -63,7 +231,61 @@ class MotisApi:
             url, params=params, headers=headers, timeout=timeout
         ) as response:
             response.raise_for_status()
-            return await response.json()
+
+            if key is not None:
+                return await self.__read_if_changed(response, key, parser)
+
+            if parser is None:
+                return await response.read()
+
+            # Parse the body while receiving it, every attempt starts over
+            stream = parser()
+
+            await _feed_in_executor(
+                stream, response.content.iter_chunked(REQUEST_CHUNK_SIZE)
+            )
+
+            return await asyncio.get_running_loop().run_in_executor(None, stream.close)
+
+    async def __read_if_changed(
+        self,
+        response: ClientResponse,
+        key: Hashable,
+        parser: Callable[[], StreamParser] | None,
+    ) -> Any:
+        if response.status == HTTPStatus.NOT_MODIFIED:
+            self.responses.on_not_modified()
+            return UNCHANGED
+
+        # The body is hashed while parsed, the parser is discarded if unchanged
+        digest = content_hash()
+        chunks: list[bytes] = []
+
+        if parser is None:
+            async for chunk in response.content.iter_chunked(REQUEST_CHUNK_SIZE):
+                digest.update(chunk)
+                chunks.append(chunk)
+        else:
+            stream = parser()
+            await _feed_in_executor(
+                stream,
+                response.content.iter_chunked(REQUEST_CHUNK_SIZE),
+                digest.update,
+            )
+
+        if self.responses.is_unchanged(key, digest.digest()):
+            return UNCHANGED
+
+        if parser is None:
+            result = b"".join(chunks)
+        else:
+            result = await asyncio.get_running_loop().run_in_executor(
+                None, stream.close
+            )
+
+        self.responses.store(key, response.headers.get(hdrs.ETAG), digest.digest())
+
+        return result
 
     async def get(
         self,
@@ -71,9 +293,44 @@ class MotisApi:
         params: dict[str, str] | None = None,
         timeout: int = 10,
         retry: int = 0,
+        *,
+        parser: Callable[[], StreamParser] | None = None,
+        conditional: bool = False,
+        deadline: float | None = None,
+        hedge: bool = False,
     ) -> Any:
         """Get data from the Motis API.
 
+        Identical requests (same command and parameters) already in flight are
+        not sent again, the caller receives the result of the running request.
+        The returned data is shared between these callers and must not be
+        modified.
+
+        With `parser` the body is parsed while it is received by a parser
+        created per attempt (in the executor, the event loop only receives
+        the chunks), the result of its `close` is returned. These requests
+        are not coalesced.
+
+        With `conditional` `UNCHANGED` is returned if the response equals the
+        last one of the same request (server answered 304 to the ETag sent
+        as `If-None-Match` or the body has the same hash), the body is not
+        decoded then (a parser is discarded before it is closed).
+
+        Failed attempts are retried after a jittered, exponential backoff or
+        the `Retry-After` sent by the server. With `deadline` no attempt or
+        wait exceeds it. With `hedge` a second request is sent if the first
+        one takes longer than the 95th percentile of the recent latencies,
+        the first response is used.
+
+        Requests failing repeatedly (network errors, timeouts, transient HTTP
+        errors or undecodable bodies) open the circuit breaker of the
+        endpoint, no requests are sent to it until a probe request succeeds
+        (s. `CircuitBreaker`).
+
+        The request is sent to the endpoint with the best score. If it fails,
+        it is sent to the next available endpoint right away (retries are
+        left to the last one).
+
         :param command: Command to execute
         :type command: ApiCommand
         :param params: Parameters for the request
@@ -82,53 +339,380 @@ class MotisApi:
         :type timeout: int
         :param retry: Number of retries to attempt in case of failure. Default is 0 retries.
         :type retry: int
-        :return: Data from the API
+        :param parser: Factory of a parser of the streamed body
+        :type parser: Callable[[], StreamParser] | None
+        :param conditional: Return `UNCHANGED` for an unchanged response
+        :type conditional: bool
+        :param deadline: `time.monotonic()` value all attempts must finish by
+        :type deadline: float | None
+        :param hedge: Send a hedged request if the response is late
+        :type hedge: bool
+        :return: Data from the API or `UNCHANGED`
         :rtype: Any
 
         :raises ClientResponseError: If an HTTP error occurs
         :raises ClientError: If a network error occurs
         :raises ClientSSLError: If an SSL error occurs
+        :raises TimeoutError: If the deadline expired
+        :raises DeadlineExceededError: If the deadline expired before the
+            request was sent (not counted as failure of the endpoint)
+        :raises CircuitOpenError: If the circuit breakers of all endpoints are open
 
         """
-        url = f"{self.base_url}/{command.value}"
+        if parser is not None:
+            return await self.__get(
+                command,
+                params,
+                timeout,
+                retry,
+                parser=parser,
+                conditional=conditional,
+                deadline=deadline,
+                hedge=hedge,
+            )
+
+        return await self.single_flight.do(
+            (*request_key(command, params), conditional),
+            lambda: self.__get(
+                command,
+                params,
+                timeout,
+                retry,
+                conditional=conditional,
+                deadline=deadline,
+                hedge=hedge,
+            ),
+        )
+
+    async def __get(
+        self,
+        command: ApiCommand,
+        params: dict[str, str] | None,
+        timeout: int,
+        retry: int,
+        *,
+        parser: Callable[[], StreamParser] | None = None,
+        conditional: bool = False,
+        deadline: float | None = None,
+        hedge: bool = False,
+    ) -> Any:
+        # Endpoints with closed circuit first, the fastest first
+        endpoints = sorted(self.endpoints, key=lambda e: (not e.available, e.score))
+        error: Exception | None = None
+
+        for index, endpoint in enumerate(endpoints):
+            if not endpoint.breaker.allow():
+                continue
+
+            fallback = any(e.breaker.ready for e in endpoints[index + 1 :])
+
+            try:
+                result = await self.__get_with_retry(
+                    endpoint,
+                    command,
+                    params,
+                    timeout,
+                    0 if fallback else retry,
+                    parser=parser,
+                    conditional=conditional,
+                    deadline=deadline,
+                    hedge=hedge,
+                )
+            except ClientResponseError as e:
+                # The endpoint answered, only transient errors count as failure
+                if e.status in TRANSIENT_STATUS_CODES:
+                    endpoint.on_failure()
+                else:
+                    endpoint.on_success()
+
+                if not _can_fail_over(fallback, deadline):
+                    raise
+                error = e
+            except (asyncio.CancelledError, DeadlineExceededError):
+                # Not the fault of the endpoint, let the next caller probe
+                endpoint.breaker.on_cancel()
+                raise
+            except Exception as e:
+                # Network errors, timeouts and undecodable bodies (e.g. the HTML
+                # page of a proxy), always reported to release a probe
+                endpoint.on_failure()
+
+                if not _can_fail_over(fallback, deadline):
+                    raise
+                error = e
+            else:
+                endpoint.on_success()
+                return result
+
+            logger.info(
+                "Request to '%s' failed, trying next endpoint", endpoint.base_url
+            )
+
+        # A concurrent request took the probe of the remaining endpoints
+        if error is not None:
+            raise error
+
+        soonest = min(endpoints, key=lambda e: e.breaker.retry_in)
+
+        raise CircuitOpenError(soonest.base_url, soonest.breaker.retry_in)
+
+    async def __get_with_retry(
+        self,
+        endpoint: Endpoint,
+        command: ApiCommand,
+        params: dict[str, str] | None,
+        timeout: int,
+        retry: int,
+        *,
+        parser: Callable[[], StreamParser] | None,
+        conditional: bool,
+        deadline: float | None,
+        hedge: bool,
+    ) -> Any:
+        url = f"{endpoint.base_url}/{command.value}"
+        key = request_key(command, params) if conditional else None
         headers = self.__get_headers()
 
         _timeout = ClientTimeout(total=timeout)
 
+        if key is not None:
+            self.responses.on_request()
+
+        sent = 0
+
+        async def send() -> Any:
+            nonlocal sent
+
+            await endpoint.limiter.acquire()
+
+            # The timeout of an expired deadline is raised at the next await
+            if deadline is not None and deadline <= time.monotonic():
+                raise TimeoutError
+
+            sent += 1
+
+            return await self.__send(
+                endpoint, url, headers, _timeout, params=params, parser=parser, key=key
+            )
+
         for attempt in range(retry + 1):
             try:
-                if self.session:
-                    return await self.__send_get_request(
-                        url, self.session, headers, _timeout, params
-                    )
-
-                async with ClientSession() as session:
-                    return await self.__send_get_request(
-                        url, session, headers, _timeout, params
-                    )
+                # No attempt (incl. waiting for the limiter) exceeds the deadline
+                async with asyncio.timeout(_remaining(deadline)):
+                    if hedge and (delay := _hedge_delay(endpoint)) is not None:
+                        result = await self.__send_hedged(send, delay)
+                    else:
+                        result = await send()
             except ClientResponseError as e:
-                if attempt < retry and e.status in TRANSIENT_STATUS_CODES:
-                    wait = 5 * (2 ** attempt)  # 5s, 10s, 20s
-                    logger.debug(
-                        "Retrying request to '%s' in %ds (attempt %d of %d)",
-                        url, wait, attempt + 1, retry,
+                retry_after = parse_retry_after(
+                    e.headers.get(hdrs.RETRY_AFTER) if e.headers else None
+                )
+
+                if e.status == HTTPStatus.TOO_MANY_REQUESTS or retry_after is not None:
+                    endpoint.limiter.on_throttled(retry_after)
+
+                if (
+                    attempt < retry
+                    and e.status in TRANSIENT_STATUS_CODES
+                    and (wait := _retry_wait(attempt, retry_after, deadline))
+                    is not None
+                ):
+                    await self.__wait_for_retry(
+                        url, attempt, retry, wait, paused=retry_after is not None
                     )
-                    await asyncio.sleep(wait)
                 else:
-                    logger.error("Request to '%s' failed after %d attempt(s): %s", url, retry + 1, str(e))
+                    self.__log_failure(url, attempt, e)
                     raise
-            except (ClientError, ClientSSLError) as e:
-                if attempt < retry:
-                    wait = 5 * (2 ** attempt)  # 5s, 10s, 20s
-                    logger.debug(
-                        "Retrying request to '%s' in %ds (attempt %d of %d)",
-                        url, wait, attempt + 1, retry,
-                    )
-                    await asyncio.sleep(wait)
+            except (ClientError, ClientSSLError, TimeoutError) as e:
+                if (
+                    attempt < retry
+                    and (wait := _retry_wait(attempt, None, deadline)) is not None
+                ):
+                    await self.__wait_for_retry(url, attempt, retry, wait)
+                elif isinstance(e, TimeoutError) and not sent:
+                    raise DeadlineExceededError(
+                        f"Deadline expired before request to '{url}' was sent"
+                    ) from e
                 else:
-                    logger.error("Request to '%s' failed after %d attempt(s): %s", url, retry + 1, str(e))
+                    self.__log_failure(url, attempt, e)
                     raise
+            else:
+                endpoint.limiter.on_success()
+                if parser or result is UNCHANGED:
+                    return result
+
+                return self.decoder(result)
 
         return (
             None  # This line is unreachable but added to satisfy function return type
         )
+
+    async def __send(
+        self,
+        endpoint: Endpoint,
+        url: str,
+        headers: dict[str, str],
+        timeout: ClientTimeout,
+        *,
+        params: dict[str, str] | None,
+        parser: Callable[[], StreamParser] | None,
+        key: Hashable | None,
+    ) -> Any:
+        started = time.monotonic()
+        result = await self.__send_get_request(
+            url,
+            self.__get_session(),
+            headers,
+            timeout,
+            params=params,
+            parser=parser,
+            key=key,
+        )
+        endpoint.latency.record(time.monotonic() - started)
+
+        return result
+
+    async def __send_hedged(
+        self, send: Callable[[], Awaitable[Any]], delay: float
+    ) -> Any:
+        """Send a second request if the first one is slower than `delay`.
+
+        The result of the first successful request is returned, the other one
+        is cancelled. Of requests finished at once a changed result is preferred
+        to `UNCHANGED`.
+        """
+        tasks: set[asyncio.Future[Any]] = {asyncio.ensure_future(send())}
+        started = set(tasks)
+
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+
+            if not done:
+                logger.debug("No response after %.2fs, sending hedged request", delay)
+                self.hedged += 1
+                tasks.add(asyncio.ensure_future(send()))
+                started |= tasks
+
+            while True:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                # Retrieve exceptions of all done requests, none is left unretrieved
+                if succeeded := [task for task in done if task.exception() is None]:
+                    # Done together, the later one compared its body against the
+                    # hash stored by the earlier one
+                    results = [task.result() for task in succeeded]
+
+                    return next((r for r in results if r is not UNCHANGED), results[0])
+
+                if not tasks:
+                    return done.pop().result()
+        finally:
+            for task in started:
+                task.cancel()
+
+    def __log_failure(self, url: str, attempt: int, error: BaseException) -> None:
+        logger.error(
+            "Request to '%s' failed after %d attempt(s): %s",
+            url,
+            attempt + 1,
+            str(error) or type(error).__name__,
+        )
+
+    async def __wait_for_retry(
+        self, url: str, attempt: int, retry: int, wait: float, *, paused: bool = False
+    ) -> None:
+        logger.debug(
+            "Retrying request to '%s' in %.1fs (attempt %d of %d)",
+            url,
+            wait,
+            attempt + 1,
+            retry,
+        )
+
+        # The limiter pauses all requests until "Retry-After" elapsed
+        if not paused:
+            await asyncio.sleep(wait)
+
+
+async def _feed_in_executor(
+    stream: StreamParser,
+    chunks: AsyncIterator[bytes],
+    on_chunk: Callable[[bytes], None] | None = None,
+) -> None:
+    """Feed the chunks to `stream` in the executor while they are received.
+
+    One job parses at a time, chunks received meanwhile are fed at once by
+    the next one. A parser error is raised with the next chunk at the latest.
+    """
+    loop = asyncio.get_running_loop()
+    job: asyncio.Future[None] | None = None
+    pending: list[bytes] = []
+
+    try:
+        async for chunk in chunks:
+            if on_chunk is not None:
+                on_chunk(chunk)
+
+            pending.append(chunk)
+
+            if job is None or job.done():
+                if job is not None:
+                    job.result()
+
+                job = loop.run_in_executor(None, stream.feed, b"".join(pending))
+                pending = []
+
+        if job is not None:
+            await job
+
+        if pending:
+            await loop.run_in_executor(None, stream.feed, b"".join(pending))
+    finally:
+        # An aborted attempt (e.g. a hedged one) leaves its parser running
+        if job is not None and not job.done():
+            job.add_done_callback(_discard_result)
+
+
+def _discard_result(future: asyncio.Future[Any]) -> None:
+    """Retrieve the result of a future nobody waits for."""
+    if not future.cancelled():
+        future.exception()
+
+
+def _remaining(deadline: float | None) -> float | None:
+    """Return seconds left until `deadline` (of `time.monotonic`)."""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _can_fail_over(fallback: bool, deadline: float | None) -> bool:
+    """Return True if a failed request can be sent to the next endpoint."""
+    return fallback and (deadline is None or deadline > time.monotonic())
+
+
+def _hedge_delay(endpoint: Endpoint) -> float | None:
+    """Return seconds to wait for a response before sending a hedged request."""
+    if (latency := endpoint.latency.percentile(REQUEST_HEDGE_PERCENTILE)) is None:
+        return None
+
+    return max(latency, REQUEST_HEDGE_MIN_DELAY)
+
+
+def _retry_wait(
+    attempt: int, retry_after: float | None, deadline: float | None
+) -> float | None:
+    """Return seconds to wait before the next attempt.
+
+    The server's `Retry-After` is respected, otherwise the backoff doubles
+    with every attempt (with jitter, so clients don't retry in lockstep).
+    None is returned if the next attempt would start after `deadline`.
+    """
+    if retry_after is None:
+        backoff = min(REQUEST_BACKOFF_MAX, REQUEST_BACKOFF_BASE * 2**attempt)
+        retry_after = backoff * random.uniform(0.5, 1)
+
+    if (remaining := _remaining(deadline)) is not None and retry_after >= remaining:
+        return None
+
+    return retry_after
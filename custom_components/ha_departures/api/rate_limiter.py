@@ -0,0 +1,107 @@
+"""Client side rate limiter for the Motis API."""
+
+import asyncio
+import logging
+import time
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket limiter with adaptive rate.
+
+    Every request takes one token, tokens are refilled with `rate` tokens per
+    second up to `burst` tokens. The rate is halved whenever the server
+    throttles requests and increased step by step on success again (AIMD),
+    a `Retry-After` sent by the server pauses all requests until it elapsed.
+    """
+
+    def __init__(
+        self, rate: float, burst: int, min_rate: float, max_rate: float | None = None
+    ) -> None:
+        """Create a limiter.
+
+        :param rate: Initial rate in requests per second
+        :type rate: float
+        :param burst: Max number of requests sent at once
+        :type burst: int
+        :param min_rate: Lower bound of the rate in requests per second
+        :type min_rate: float
+        :param max_rate: Upper bound of the rate, initial rate if not set
+        :type max_rate: float | None
+        """
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+
+        self.throttled = 0
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self._updated)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Wait until a request may be sent."""
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+
+            if now < self._paused_until:
+                wait = self._paused_until - now
+            elif self._tokens >= 1:
+                self._tokens -= 1
+                return
+            else:
+                wait = (1 - self._tokens) / self.rate
+
+            logger.debug("Rate limit reached, waiting %.2fs", wait)
+            await asyncio.sleep(wait)
+
+    def on_success(self) -> None:
+        """Increase the rate after a successful request."""
+        self.rate = min(self.max_rate, self.rate + self.min_rate)
+
+    def on_throttled(self, retry_after: float | None = None) -> None:
+        """Decrease the rate after the server throttled a request.
+
+        :param retry_after: Seconds to pause all requests, if sent by server
+        :type retry_after: float | None
+        """
+        self.throttled += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+        logger.debug(
+            "Server throttled request, rate decreased to %.2f/s (retry after: %s)",
+            self.rate,
+            retry_after,
+        )
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Return seconds to wait given by a `Retry-After` header.
+
+    The header contains either seconds or a HTTP date.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        logger.debug("Invalid Retry-After header: %s", value)
+        return None
@@ -0,0 +1,83 @@
+"""Detection of unchanged Motis API responses."""
+
+import hashlib
+from collections.abc import Hashable
+from enum import Enum, auto
+from typing import Final
+
+from aiohttp import hdrs
+
+from custom_components.ha_departures.helper import TTLCache
+
+
+class Unchanged(Enum):
+    """Marker type of `UNCHANGED`."""
+
+    RESPONSE = auto()
+
+
+# Result of a conditional request whose response did not change
+UNCHANGED: Final = Unchanged.RESPONSE
+
+
+def content_hash() -> hashlib.blake2b:
+    """Return a new hash object for response bodies."""
+    return hashlib.blake2b(digest_size=16)
+
+
+class ResponseCache:
+    """ETag and content hash of the last response per request.
+
+    A conditional request sends the ETag of the last response (if the server
+    sent one) as `If-None-Match`. The response did not change if the server
+    answers with 304 or if its body has the same hash as the last one.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """Create an empty cache holding at most `maxsize` requests."""
+        self.requests = 0
+        self.not_modified = 0
+        self.unchanged = 0
+
+        self._entries = TTLCache(maxsize, ttl)
+
+    @property
+    def hits(self) -> int:
+        """Return count of conditional requests with unchanged response."""
+        return self.not_modified + self.unchanged
+
+    @property
+    def hit_rate(self) -> float:
+        """Return share of conditional requests with unchanged response."""
+        return self.hits / self.requests if self.requests else 0.0
+
+    def on_request(self) -> None:
+        """Count a conditional request."""
+        self.requests += 1
+
+    def headers(self, key: Hashable) -> dict[str, str]:
+        """Return headers of a conditional request."""
+        if (entry := self._entries.get(key)) is None or entry[0] is None:
+            return {}
+
+        return {hdrs.IF_NONE_MATCH: entry[0]}
+
+    def on_not_modified(self) -> None:
+        """Count a request answered with 304 by the server."""
+        self.not_modified += 1
+
+    def is_unchanged(self, key: Hashable, digest: bytes) -> bool:
+        """Return True if `digest` equals the hash of the last response."""
+        if (entry := self._entries.get(key)) is None or entry[1] != digest:
+            return False
+
+        self.unchanged += 1
+        return True
+
+    def forget(self, key: Hashable) -> None:
+        """Forget the last response of a request."""
+        self._entries.pop(key)
+
+    def store(self, key: Hashable, etag: str | None, digest: bytes) -> None:
+        """Store ETag and hash of a response."""
+        self._entries.set(key, (etag, digest))
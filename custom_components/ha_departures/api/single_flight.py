@@ -0,0 +1,63 @@
+"""Coalescing of identical in-flight requests to the Motis API."""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Run only one call per key at a time.
+
+    Callers requesting a key already in flight wait for the running call and
+    receive its result (or exception) instead of starting a new one. The
+    result object is shared, callers must not modify it.
+    """
+
+    def __init__(self) -> None:
+        """Create an empty group."""
+        self.calls = 0
+        self.coalesced = 0
+
+        self._in_flight: dict[Hashable, asyncio.Future[Any]] = {}
+
+    @property
+    def in_flight(self) -> int:
+        """Return count of calls currently running."""
+        return len(self._in_flight)
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Return result of `call`, share it with concurrent callers of `key`.
+
+        :param key: Key identifying identical calls
+        :type key: Hashable
+        :param call: Factory of the awaitable to run if `key` is not in flight
+        :type call: Callable[[], Awaitable[Any]]
+        :return: Result of the (shared) call
+        :rtype: Any
+        """
+        self.calls += 1
+
+        future = self._in_flight.get(key)
+
+        # Calls of another (e.g. stopped) event loop can not be joined
+        if future is not None and future.get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+            logger.debug("Joining request in flight: %s", key)
+        else:
+            future = asyncio.ensure_future(call())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+
+        # A cancelled caller must not cancel the call shared with others
+        return await asyncio.shield(future)
+
+    def _done(self, key: Hashable, future: asyncio.Future[Any]) -> None:
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+        # Mark exception as retrieved if all callers were cancelled meanwhile
+        if not future.cancelled():
+            future.exception()
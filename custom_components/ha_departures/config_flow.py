@@ -1,27 +1,34 @@
 """Adds config flow for Public Transport Departures."""
 
+import asyncio
 import logging
 from typing import Any
+from urllib.parse import urlparse
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from aiohttp import ClientError, ClientResponseError
 from homeassistant import config_entries
 from homeassistant.const import CONF_LATITUDE, CONF_LONGITUDE
-from homeassistant.core import callback
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.selector import (
     LocationSelector,
     SelectOptionDict,
     SelectSelector,
     SelectSelectorConfig,
     SelectSelectorMode,
+    TextSelector,
+    TextSelectorConfig,
+    TextSelectorType,
 )
 
 from .api.data_classes import ApiCommand, Line, Stop, TransportMode
 from .api.motis_api import MotisApi
 from .const import (
+    CONF_API_URL,
     CONF_AVAILABLE_LINES,
     CONF_ERROR_CONNECTION_FAILED,
+    CONF_ERROR_INVALID_API_URL,
     CONF_ERROR_INVALID_RESPONSE,
     CONF_ERROR_NO_CHANGES_OPTIONS,
     CONF_ERROR_NO_LINE_SELECTED,
@@ -32,11 +39,14 @@ from .const import (
     CONF_STOP_COORD,
     CONF_STOP_IDS,
     CONF_STOP_NAME,
+    DISCOVERY_COORD_PRECISION,
     DOMAIN,
     REQUEST_API_URL,
+    REQUEST_CONCURRENCY,
     VERSION,
 )
-from .helper import bounding_box
+from .helper import TTLCache, bounding_box
+from .hub import async_get_client, async_get_domain_data, entry_api_urls
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -56,6 +66,21 @@ async def _send_api_request(api: MotisApi, command, params):
     raise ValueError(error)
 
 
+def _parse_api_urls(urls: list[str]) -> list[str] | None:
+    """Return API base URLs without trailing slash, None if one is invalid."""
+    result: list[str] = []
+
+    for url in filter(None, (x.strip().rstrip("/") for x in urls)):
+        parsed = urlparse(url)
+
+        if parsed.scheme not in ("http", "https") or not parsed.netloc:
+            return None
+
+        result.append(url)
+
+    return result or [REQUEST_API_URL]
+
+
 def _extract_lines_from_stop_times(
     stop_times_data: dict[str, Any], unique: bool = True
 ) -> list[Line]:
@@ -76,14 +101,21 @@ def _extract_lines_from_stop_times(
     return list(set(lines)) if unique else lines
 
 
-async def _fetch_lines(stop_ids: list[str | Stop], unique: bool = True) -> list[Line]:
-    """Fetch lines for given stop ids."""
-
-    lines: list[Line] = []
+async def _fetch_stop_lines(
+    api: MotisApi,
+    requests: asyncio.Semaphore,
+    cache: TTLCache,
+    stop_id: str | Stop,
+    unique: bool,
+) -> list[Line]:
+    """Fetch lines of one stop, return no lines if the request failed."""
+    key = (str(stop_id).removesuffix("_G"), unique)
 
-    api = MotisApi(base_url=REQUEST_API_URL)
+    if (lines := cache.get(key)) is not None:
+        _LOGGER.debug("Using cached lines for stop: %s", stop_id)
+        return lines
 
-    for stop_id in stop_ids:
+    async with requests:
         _LOGGER.debug("Fetching stop times for stop: %s", stop_id)
 
         try:
@@ -91,18 +123,52 @@ async def _fetch_lines(stop_ids: list[str | Stop], unique: bool = True) -> list[
                 api,
                 ApiCommand.STOP_TIMES,
                 {
-                    "stopId": str(stop_id).removesuffix("_G"),
+                    "stopId": key[0],
                     "n": str(1000),
                 },
             )
-
-            lines.extend(_extract_lines_from_stop_times(stop_times, unique=unique))
         except ValueError as err:
             _LOGGER.error(
                 "Error fetching stop times for stop %s: %s, continuing with next stop if available",
                 stop_id,
                 err,
             )
+            return []
+
+    lines = _extract_lines_from_stop_times(stop_times, unique=unique)
+    cache.set(key, lines)
+
+    return lines
+
+
+async def _fetch_lines(
+    hass: HomeAssistant,
+    stop_ids: list[str | Stop],
+    unique: bool = True,
+    api_urls: tuple[str, ...] = (REQUEST_API_URL,),
+) -> list[Line]:
+    """Fetch lines for given stop ids from the given API endpoints.
+
+    The stops are requested in parallel (at most `REQUEST_CONCURRENCY` at
+    once), a failed request only drops the lines of its stop. Lines of stops
+    requested within `DISCOVERY_CACHE_TTL` are taken from the cache.
+    """
+
+    lines: list[Line] = []
+
+    domain_data = async_get_domain_data(hass)
+    client = async_get_client(hass, api_urls)
+    requests = asyncio.Semaphore(REQUEST_CONCURRENCY)
+
+    for stop_lines in asyncio.as_completed(
+        [
+            _fetch_stop_lines(
+                client, requests, domain_data.lines_cache, stop_id, unique
+            )
+            for stop_id in stop_ids
+        ]
+    ):
+        lines.extend(await stop_lines)
 
     return list(set(lines)) if unique else lines
 
@@ -122,7 +188,6 @@ class DeparturesFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
         self._lines: list[Line] = []
         self._data: dict[str, Any] = {}
         self._options: dict[str, Any] = {}
-        self._api = MotisApi(base_url=REQUEST_API_URL)
 
         _LOGGER.debug(" Start CONFIGURATION flow ".center(60, "="))
         _LOGGER.debug(">> ha-departures version: %s", VERSION)
@@ -146,18 +211,26 @@ class DeparturesFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             radius = location.get("radius", 1000)
 
             box = bounding_box(latitude, longitude, radius)
+            domain_data = async_get_domain_data(self.hass)
+            key = (
+                round(latitude, DISCOVERY_COORD_PRECISION),
+                round(longitude, DISCOVERY_COORD_PRECISION),
+                radius,
+            )
 
-            try:
-                data = await _send_api_request(
-                    self._api,
-                    ApiCommand.STOPS,
-                    {
-                        "max": f"{box[0][0]},{box[0][1]}",
-                        "min": f"{box[1][0]},{box[1][1]}",
-                    },
-                )
-            except ValueError as err:
-                _errors[CONF_LOCATION] = str(err)
+            if (data := domain_data.stops_cache.get(key)) is None:
+                try:
+                    data = await _send_api_request(
+                        domain_data.client,
+                        ApiCommand.STOPS,
+                        {
+                            "max": f"{box[0][0]},{box[0][1]}",
+                            "min": f"{box[1][0]},{box[1][1]}",
+                        },
+                    )
+                    domain_data.stops_cache.set(key, data)
+                except ValueError as err:
+                    _errors[CONF_LOCATION] = str(err)
 
             if not _errors:
                 self._all_stops = [Stop.from_dict(item) for item in data]
@@ -289,7 +362,7 @@ class DeparturesFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
 
                 return await self.async_step_hubname()
 
-        self._lines = await _fetch_lines(self._selected_stops, unique=True)
+        self._lines = await _fetch_lines(self.hass, self._selected_stops, unique=True)
 
         line_list: list[SelectOptionDict] = [
             SelectOptionDict(
@@ -373,16 +446,25 @@ class DeparturesOptionsFlowHandler(config_entries.OptionsFlow):
         self._lines_available: list[Line] = [
             Line.from_dict(x) for x in config_entry.data.get(CONF_AVAILABLE_LINES, [])
         ]
+        self._api_urls: list[str] = config_entry.options.get(
+            CONF_API_URL, [REQUEST_API_URL]
+        )
 
         _LOGGER.debug("Start configuration")
 
     async def async_step_init(self, user_input=None):
         """Handle a flow initialized by the user."""
+        _errors: dict[str, str] = {}
 
         _LOGGER.debug(' Start "step_init" '.center(60, "-"))
         _LOGGER.debug(">> user input: %s", user_input)
 
-        if user_input is not None:
+        if (
+            user_input is not None
+            and (api_urls := _parse_api_urls(user_input.get(CONF_API_URL, []))) is None
+        ):
+            _errors[CONF_API_URL] = CONF_ERROR_INVALID_API_URL
+        elif user_input is not None:
             lines_user_choose = user_input.get(CONF_LINES, [])
 
             lines_new_state: list[Line] = []
@@ -402,7 +484,7 @@ class DeparturesOptionsFlowHandler(config_entries.OptionsFlow):
                     )
                 )
 
-            if lines_new_state == self._lines_selected:
+            if lines_new_state == self._lines_selected and api_urls == self._api_urls:
                 _LOGGER.debug("No changes on entry configuration detected")
                 return self.async_abort(reason=CONF_ERROR_NO_CHANGES_OPTIONS)
 
@@ -410,11 +492,15 @@ class DeparturesOptionsFlowHandler(config_entries.OptionsFlow):
                 title="",
                 data={
                     CONF_LINES: [x.to_dict() for x in lines_new_state],
+                    CONF_API_URL: api_urls,
                 },
             )
 
         self._lines_available = await _fetch_lines(
-            self.config_entry.data.get(CONF_STOP_IDS, []), unique=True
+            self.hass,
+            self.config_entry.data.get(CONF_STOP_IDS, []),
+            unique=True,
+            api_urls=entry_api_urls(self.config_entry),
         )
 
         _LOGGER.debug("Updating config entry data with (new) available lines")
@@ -472,7 +558,11 @@ class DeparturesOptionsFlowHandler(config_entries.OptionsFlow):
                             sort=True,
                             mode=SelectSelectorMode.DROPDOWN,
                         ),
-                    )
+                    ),
+                    vol.Optional(CONF_API_URL, default=self._api_urls): TextSelector(
+                        TextSelectorConfig(type=TextSelectorType.URL, multiple=True)
+                    ),
                 }
             ),
+            errors=_errors,
         )
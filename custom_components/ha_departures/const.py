@@ -16,9 +16,50 @@ REQUEST_API_URL: Final = "https://api.transitous.org/api"
 REQUEST_HEADER_JSON: Final = "application/json"
 REQUEST_TIMEOUT: Final = 10  # seconds
 REQUEST_RETRIES: Final = 3  # number of retries for failed requests
-REQUEST_TIMES_PER_LINE_COUNT: Final = 100  # number of departure times to fetch per line
+REQUEST_BACKOFF_BASE: Final = 5  # seconds, wait before the first retry (with jitter)
+REQUEST_BACKOFF_MAX: Final = 20  # seconds, max wait between retries
+REQUEST_DEADLINE_SHARE: Final = 0.5  # share of the update interval a refresh may take
+REQUEST_LATENCY_SAMPLES: Final = 50  # recent request latencies kept
+REQUEST_LATENCY_MIN_SAMPLES: Final = 10  # latencies needed before hedging requests
+REQUEST_HEDGE_PERCENTILE: Final = 0.95  # send a hedged request if slower than this
+REQUEST_HEDGE_MIN_DELAY: Final = 1.0  # seconds, min delay of a hedged request
+ENDPOINT_MIN_SUCCESS_RATE: Final = 0.05  # lower bound of the success rate in scores
+CIRCUIT_FAILURE_THRESHOLD: Final = 3  # consecutive failed requests opening the circuit
+CIRCUIT_RESET_TIMEOUT: Final = 60  # seconds, until an open circuit is probed
+CIRCUIT_RESET_TIMEOUT_MAX: Final = 600  # seconds, doubled after every failed probe
+REQUEST_RATE: Final = 2.0  # max requests per second per API base URL
+REQUEST_RATE_MIN: Final = 0.1  # requests per second, lower bound when throttled
+REQUEST_BURST: Final = 10  # max requests sent at once per API base URL
+REQUEST_CONNECTION_LIMIT: Final = 10  # max open connections of an own client session
+REQUEST_DNS_CACHE_TTL: Final = 300  # seconds
+REQUEST_CHUNK_SIZE: Final = 64 * 1024  # bytes of a streamed response parsed at once
+REQUEST_TIMES_PER_LINE_COUNT: Final = (
+    100  # max number of departure times to fetch per line
+)
+REQUEST_WINDOW_MARGIN: Final = 1.5  # stop times requested beyond the learned need
+RESPONSE_CACHE_SIZE: Final = 64  # max number of requests whose last response is known
+RESPONSE_CACHE_TTL: Final = 3600  # seconds
+REQUEST_MAX_PAGES: Final = 3  # max pages of stop times fetched per refresh
+REFRESH_NEAR_TERM_DEPARTURES: Final = 3  # departures per line of an incremental refresh
+REFRESH_TAIL_FACTOR: Final = 2  # sensor limits per line kept by a full fetch
 UPDATE_INTERVAL: Final = 60  # seconds
+UPDATE_JITTER: Final = 5  # seconds, random delay of the first refresh
+REQUEST_CONCURRENCY: Final = 4  # max number of stop times requests in flight
+UPDATE_INTERVAL_MIN: Final = 30  # seconds, next departure imminent and in real-time
+UPDATE_INTERVAL_MAX: Final = 900  # seconds, no departures or next one far out
+IMMINENT_DEPARTURE_WINDOW: Final = 600  # seconds, departures closer are imminent
 RADIUS_FOR_STOPS_REQUEST = 250  # meters
+DATETIME_CACHE_SIZE: Final = 4096  # parsed timestamps kept in memory
+
+# Storage of the last received departures (warm start after restart)
+STORAGE_KEY: Final = f"{DOMAIN}.departures"
+STORAGE_VERSION: Final = 1
+STORAGE_SAVE_DELAY: Final = 300  # seconds
+
+# Cache of stops and lines found by config and options flow
+DISCOVERY_CACHE_SIZE: Final = 64  # max number of cached queries per kind
+DISCOVERY_CACHE_TTL: Final = 3600  # seconds
+DISCOVERY_COORD_PRECISION: Final = 4  # decimals of coordinates in cache keys (~11m)
 
 # Configuration and options
 CONF_LOCATION: Final = "location"
@@ -35,6 +76,7 @@ CONF_ERROR_NO_LINE_SELECTED: Final = "no_line_selected"
 CONF_ERROR_NO_CHANGES_OPTIONS: Final = "no_changes_configured"
 CONF_ERROR_INVALID_RESPONSE: Final = "invalid_api_response"
 CONF_ERROR_CONNECTION_FAILED: Final = "connection_failed"
+CONF_ERROR_INVALID_API_URL: Final = "invalid_api_url"
 
 # Sensor attributes
 ATTR_LINE_NAME: Final = "line_name"
@@ -51,8 +93,12 @@ ATTR_HEAD_SIGN: Final = "head_sign"
 ATTR_DEPARTURE_ALERTS: Final = "alerts"
 ATTR_SCHEDULED_TRACK: Final = "scheduled_track"
 ATTR_TRACK: Final = "track"
+ATTR_STALE: Final = "stale"
 
 DEPARTURES_PER_SENSOR_LIMIT: Final = 10  # max number of departures per sensor
+DEPARTURE_BATCH_MIN_SUBSCRIBERS: Final = 4  # hub subscribers sharing a columnar batch
+DEPARTURE_BATCH_MIN_ROWS: Final = 10_000  # stop times of a hub worth a columnar batch
+COUNTDOWN_INTERVAL: Final = 1  # seconds, countdown sensors are advanced locally
 
 
 STARTUP_MESSAGE = f"""
@@ -1,31 +1,39 @@
 """DataUpdateCoordinator for ha_departures integration."""
 
 import logging
-from datetime import timedelta
+from collections.abc import Collection, Container, Iterable
+from datetime import datetime, timedelta
 
-from aiohttp import ClientResponseError
+from aiohttp import ClientError
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util import dt as dt_util
 
-from .api.data_classes import ApiCommand, Departure
-from .api.motis_api import MotisApi
+from .api.data_classes import Departure, Line
+from .api.departure_batch import DepartureBatch
 from .const import (
     CONF_LINES,
     CONF_STOP_COORD,
     CONF_STOP_IDS,
+    DEPARTURE_BATCH_MIN_ROWS,
+    DEPARTURE_BATCH_MIN_SUBSCRIBERS,
+    DEPARTURES_PER_SENSOR_LIMIT,
     DOMAIN,
+    IMMINENT_DEPARTURE_WINDOW,
     RADIUS_FOR_STOPS_REQUEST,
-    REQUEST_API_URL,
-    REQUEST_RETRIES,
-    REQUEST_TIMEOUT,
-    REQUEST_TIMES_PER_LINE_COUNT,
     UPDATE_INTERVAL,
+    UPDATE_INTERVAL_MAX,
+    UPDATE_INTERVAL_MIN,
+    UPDATE_JITTER,
 )
+from .helper import stagger_offset
+from .hub import StopTimesHub, async_get_hub, entry_api_urls, normalize_stop_id
 
 _LOGGER: logging.Logger = logging.getLogger(__name__)
 
+type DepartureIndex = dict[tuple[str, str], list[Departure]]
+
 
 class DeparturesDataUpdateCoordinator(DataUpdateCoordinator[list[Departure]]):
     """Class to manage fetching data from the API."""
@@ -42,17 +50,42 @@ class DeparturesDataUpdateCoordinator(DataUpdateCoordinator[list[Departure]]):
             name=DOMAIN,
             config_entry=config_entry,
             update_interval=timedelta(seconds=UPDATE_INTERVAL),
+            # Listeners are not notified if the departures did not change
+            always_update=False,
         )
 
         _LOGGER.debug("Initializing DeparturesDataUpdateCoordinator")
 
         self._stop_ids: list[str] = config_entry.data.get(CONF_STOP_IDS, [])
+        self._stop_ids_normalized: set[str] = {
+            normalize_stop_id(s) for s in self._stop_ids
+        }
         self._stop_coord: tuple = config_entry.data.get(CONF_STOP_COORD, ())
         self._hub_name: str = config_entry.title
         self._lines_count: int = len(config_entry.options.get(CONF_LINES, []))
+        self._line_keys: set[tuple[str, str]] = {
+            (line.route_id, line.direction_id)
+            for line in map(Line.from_dict, config_entry.options.get(CONF_LINES, []))
+        }
         self._data: list[Departure] = []
+        self._index: DepartureIndex = {}
+        # Departures of the hub the data was processed from
+        self._source: list[Departure] | None = None
+
+        # Count of sensor state writes skipped because nothing changed
+        self.suppressed_writes: int = 0
+        # Departures are served from cache while the API is unavailable
+        self.stale: bool = False
 
-        self._client = MotisApi(REQUEST_API_URL, async_get_clientsession(hass))
+        # Config entries watching the same stop (with the same API endpoints)
+        # share one hub, so the stop times are fetched only once per refresh
+        self._hub = async_get_hub(
+            hass,
+            self._stop_ids[0],
+            RADIUS_FOR_STOPS_REQUEST,
+            entry_api_urls(config_entry),
+        )
+        config_entry.async_on_unload(self._hub.async_subscribe(self))
 
     @property
     def stop_coord(self) -> tuple:
@@ -79,6 +112,16 @@ class DeparturesDataUpdateCoordinator(DataUpdateCoordinator[list[Departure]]):
         """Set count of lines belong to this config enttry."""
         self._lines_count = new_count
 
+    @property
+    def hub(self) -> StopTimesHub:
+        """Return the stop times hub this coordinator is subscribed to."""
+        return self._hub
+
+    @property
+    def line_keys(self) -> set[tuple[str, str]]:
+        """Return (route id, direction id) of lines belong to this config entry."""
+        return self._line_keys
+
     async def _async_update_data(self) -> list[Departure]:
         """Perform data fetching."""
 
@@ -86,51 +129,241 @@ class DeparturesDataUpdateCoordinator(DataUpdateCoordinator[list[Departure]]):
 
         try:
             self._data = await self.__fetch_data()
-        except ClientResponseError as e:
-            _LOGGER.info("Error fetching data from API. Error: %s", e)
-            raise UpdateFailed(e) from e
+        except (ClientError, TimeoutError) as e:
+            # While the circuit breaker of the API is open, the departures of
+            # the last successful fetch are served as long as upcoming
+            if self._hub.api_available or not (
+                departures := self._hub.stale_departures()
+            ):
+                _LOGGER.info("Error fetching data from API. Error: %s", e)
+                raise UpdateFailed(e) from e
+
+            _LOGGER.info(
+                "API unavailable (%s), serving %s cached departures",
+                e,
+                len(departures),
+            )
+
+            self._data = await self.__async_process_data(departures)
+            self.__set_stale(True)
+        else:
+            self.__set_stale(False)
 
         return self._data
 
-    async def __fetch_data(self) -> list[Departure]:
-        """Fetch data from endpoint."""
-        COMMAND = ApiCommand.STOP_TIMES
+    def __set_stale(self, stale: bool) -> None:
+        if stale == self.stale:
+            return
 
-        # Take only first stop_id and use "radius" parameter
-        # to decrease amount of requests to the server
-        stop_id = self._stop_ids[0].removesuffix("_G")
+        self.stale = stale
 
-        PARAMS = {
-            "stopId": stop_id,
-            "n": str(REQUEST_TIMES_PER_LINE_COUNT * self.lines),
-            "radius": str(RADIUS_FOR_STOPS_REQUEST),
-        }
+        # Listeners are notified even if the departures did not change
+        self.async_update_listeners()
+
+    def departures_for(self, route_id: str, direction_id: str) -> list[Departure]:
+        """Return upcoming departures of a line belong to this config entry.
 
-        _LOGGER.debug(
-            "Fetching stop times for stop_id: %s with params: %s", stop_id, PARAMS
+        The list is limited to `DEPARTURES_PER_SENSOR_LIMIT` departures.
+        """
+        return self._index.get((route_id, direction_id), [])
+
+    @callback
+    def async_stagger_refresh(self) -> None:
+        """Schedule the first refresh with an offset unique to the config entry.
+
+        Spreads the refreshes of all config entries over the update interval,
+        so they don't run in bursts after startup.
+        """
+        offset = stagger_offset(
+            self.config_entry.entry_id, UPDATE_INTERVAL, UPDATE_JITTER
         )
 
-        times = await self._client.get(
-            COMMAND, params=PARAMS, retry=REQUEST_RETRIES, timeout=REQUEST_TIMEOUT
+        _LOGGER.debug("First refresh of '%s' in %.1fs", self._hub_name, offset)
+
+        self.update_interval = timedelta(seconds=offset)
+
+    async def async_restore(self) -> bool:
+        """Serve upcoming departures stored by the last session.
+
+        Return True if there is at least one upcoming departure.
+        """
+        if not (departures := self._hub.async_restore()):
+            return False
+
+        _LOGGER.debug("Serving %s departures of last session", len(departures))
+
+        self._data = await self.__async_process_data(departures)
+        self.async_set_updated_data(self._data)
+
+        return True
+
+    async def async_set_hub_data(self, departures: list[Departure]) -> None:
+        """Apply departures fetched by the hub on behalf of another config entry."""
+        self.stale = False
+        self._data = await self.__async_process_data(departures)
+        self.async_set_updated_data(self._data)
+
+    async def __fetch_data(self) -> list[Departure]:
+        """Fetch data from the shared stop times hub."""
+        departures = await self._hub.async_get_departures(
+            self, self.update_interval or timedelta(seconds=UPDATE_INTERVAL)
+        )
+
+        # The hub returns the same list if the response did not change
+        if departures is self._source:
+            self.__schedule_next_update()
+            return self._data
+
+        return await self.__async_process_data(departures)
+
+    async def __async_process_data(
+        self, all_departures: list[Departure]
+    ) -> list[Departure]:
+        self._source = all_departures
+        departures, self._index = await self.hass.async_add_executor_job(
+            self._process_data, all_departures
         )
 
-        _LOGGER.debug(
-            "Received %s stop times for stop_id: %s",
-            len(times.get("stopTimes", [])),
-            stop_id,
+        self.__schedule_next_update()
+
+        return departures
+
+    def __schedule_next_update(self) -> None:
+        self.update_interval = next_update_interval(
+            [d for group in self._index.values() for d in group], dt_util.now()
         )
 
-        return await self.hass.async_add_executor_job(self._process_data, times)
+        _LOGGER.debug("Next update in %s", self.update_interval)
 
-    def _process_data(self, api_response: dict) -> list[Departure]:
+    def _process_data(
+        self, all_departures: list[Departure]
+    ) -> tuple[list[Departure], DepartureIndex]:
         """Process data in a separate thread to avoid blocking the event loop."""
-        departures = []
-        stop_ids_normalized = {s.removesuffix("_G") for s in self.stop_ids}
+        # Columnar processing pays off only if the batch is built once for
+        # several subscribers of the hub, and only for many stop times (the
+        # operations alone are slower than the list for a few hundred)
+        if (
+            self._hub.subscribers >= DEPARTURE_BATCH_MIN_SUBSCRIBERS
+            and len(all_departures) >= DEPARTURE_BATCH_MIN_ROWS
+            and (batch := self._hub.batch(all_departures)) is not None
+        ):
+            return process_batch(
+                batch,
+                self._stop_ids_normalized,
+                self._line_keys,
+                DEPARTURES_PER_SENSOR_LIMIT,
+            )
+
+        departures = unique_departures(all_departures, self._stop_ids_normalized)
 
-        for stop_time in api_response.get("stopTimes", []):
-            departure = Departure.from_dict(stop_time)
+        return departures, index_departures(
+            departures, self._line_keys, DEPARTURES_PER_SENSOR_LIMIT
+        )
 
-            if departure not in departures and departure.stop_id in stop_ids_normalized:
-                departures.append(departure)
 
-        return departures
+def unique_departures(
+    departures: Iterable[Departure], stop_ids: Container[str]
+) -> list[Departure]:
+    """Return departures at the given stops without duplicates.
+
+    Duplicates are detected with a set (based on `Departure.__hash__`), the
+    order of the departures is preserved.
+    """
+    seen: set[Departure] = set()
+    result: list[Departure] = []
+
+    for departure in departures:
+        if departure.stop_id not in stop_ids or departure in seen:
+            continue
+
+        seen.add(departure)
+        result.append(departure)
+
+    return result
+
+
+def index_departures(
+    departures: Iterable[Departure], line_keys: Iterable[tuple[str, str]], limit: int
+) -> DepartureIndex:
+    """Group departures by configured line (route id, direction id).
+
+    Route ids of older config entries may miss a prefix (e.g. "de-DELFI_"),
+    so a departure belongs to a line if its route id ends with the route id
+    of the line. This is resolved once per distinct route of the departures.
+    Every group keeps the order of `departures` and holds at most `limit`
+    departures.
+    """
+    index: DepartureIndex = {key: [] for key in line_keys}
+    resolved: dict[tuple[str, str], list[list[Departure]]] = {}
+
+    for departure in departures:
+        key = (departure.route_id, departure.direction_id)
+        groups = resolved.get(key)
+
+        if groups is None:
+            groups = resolved[key] = [
+                group
+                for (route_id, direction_id), group in index.items()
+                if departure.route_id.endswith(route_id)
+                and departure.direction_id == direction_id
+            ]
+
+        for group in groups:
+            if len(group) < limit:
+                group.append(departure)
+
+    return index
+
+
+def process_batch(
+    batch: DepartureBatch,
+    stop_ids: Collection[str],
+    line_keys: Iterable[tuple[str, str]],
+    limit: int,
+) -> tuple[list[Departure], DepartureIndex]:
+    """Return the result of `unique_departures` and `index_departures`.
+
+    Same as calling both functions, but the departures are filtered, grouped
+    and limited on the columns of `batch`.
+    """
+    rows = batch.unique(batch.at_stops(stop_ids))
+
+    return batch.departures(rows), {
+        key: batch.departures(group)
+        for key, group in batch.group(rows, line_keys, limit).items()
+    }
+
+
+def next_update_interval(departures: Iterable[Departure], now: datetime) -> timedelta:
+    """Return the update interval matching the upcoming departures.
+
+    - no upcoming departure (e.g. overnight): `UPDATE_INTERVAL_MAX`
+    - a departure is imminent and in real-time: `UPDATE_INTERVAL_MIN`
+    - departures are imminent, but only scheduled: `UPDATE_INTERVAL`
+    - next departure far out: half of the time left until it becomes
+      imminent, bounded by `UPDATE_INTERVAL` and `UPDATE_INTERVAL_MAX`
+    """
+    seconds_left: list[tuple[float, Departure]] = [
+        ((time - now).total_seconds(), d)
+        for d in departures
+        if not d.cancelled and (time := d.expected_departure) is not None and time > now
+    ]
+
+    if not seconds_left:
+        return timedelta(seconds=UPDATE_INTERVAL_MAX)
+
+    imminent = [
+        d for seconds, d in seconds_left if seconds <= IMMINENT_DEPARTURE_WINDOW
+    ]
+
+    if any(d.real_time for d in imminent):
+        return timedelta(seconds=UPDATE_INTERVAL_MIN)
+
+    if imminent:
+        return timedelta(seconds=UPDATE_INTERVAL)
+
+    seconds = (
+        min(seconds for seconds, _ in seconds_left) - IMMINENT_DEPARTURE_WINDOW
+    ) / 2
+
+    return timedelta(seconds=min(max(seconds, UPDATE_INTERVAL), UPDATE_INTERVAL_MAX))
@@ -0,0 +1,63 @@
+"""Diagnostics support for Public Transport Departures."""
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import CONF_STOP_COORD
+from .coordinator import DeparturesDataUpdateCoordinator
+
+TO_REDACT = {CONF_STOP_COORD}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    coordinator: DeparturesDataUpdateCoordinator = entry.runtime_data.coordinator
+    client = coordinator.hub.client
+
+    return {
+        "entry": {
+            "data": async_redact_data(entry.data, TO_REDACT),
+            "options": dict(entry.options),
+        },
+        "coordinator": {
+            "last_update_success": coordinator.last_update_success,
+            "update_interval": str(coordinator.update_interval),
+            "departures": len(coordinator.data or []),
+            "suppressed_writes": coordinator.suppressed_writes,
+            "stale": coordinator.stale,
+        },
+        "hub": {
+            "stop_id": coordinator.hub.key[0],
+            "radius": coordinator.hub.key[1],
+            "subscribers": coordinator.hub.subscribers,
+            "lines": coordinator.hub.lines,
+            "api_urls": list(coordinator.hub.key[2]),
+        },
+        "api": {
+            "requests": client.single_flight.calls,
+            "coalesced": client.single_flight.coalesced,
+            "conditional_requests": client.responses.requests,
+            "not_modified": client.responses.not_modified,
+            "unchanged": client.responses.unchanged,
+            "unchanged_rate": round(client.responses.hit_rate, 3),
+        },
+        "endpoints": [
+            {
+                "url": endpoint.base_url,
+                "rate": endpoint.limiter.rate,
+                "throttled": endpoint.limiter.throttled,
+                "requests": endpoint.requests,
+                "failures": endpoint.failures,
+                "error_rate": round(endpoint.error_rate, 3),
+                "latency_median": endpoint.latency.percentile(0.5),
+                "circuit": endpoint.breaker.state.value,
+                "circuit_opened": endpoint.breaker.opened,
+            }
+            for endpoint in client.endpoints
+        ],
+    }
@@ -2,16 +2,28 @@
 
 import logging
 import math
-from datetime import datetime
+import random
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import Hashable
+from datetime import datetime, tzinfo
+from functools import lru_cache
+from typing import Any
 
 from homeassistant.util import dt as dt_util
 
+from .const import DATETIME_CACHE_SIZE
+
 _LOGGER = logging.getLogger(__name__)
 
 
 def str_to_datetime(date: str) -> datetime | None:
     """Convert a time string to a (local) datetime object.
 
+    Results are memoized per time zone, departures of many lines share the
+    same timestamps.
+
     Args:
         date (str): The date/time string in ISO 8601 format.
 
@@ -22,7 +34,16 @@ def str_to_datetime(date: str) -> datetime | None:
     if not date:
         return None
 
+    return _str_to_datetime(date, dt_util.DEFAULT_TIME_ZONE)
+
+
+@lru_cache(maxsize=DATETIME_CACHE_SIZE)
+def _str_to_datetime(date: str, time_zone: tzinfo) -> datetime | None:
     try:
+        # Fast path for the UTC timestamps sent by Motis (YYYY-MM-DDTHH:MM:SSZ)
+        if len(date) == 20 and date[10] == "T" and date[19] == "Z":
+            return datetime.fromisoformat(date).astimezone(time_zone)
+
         dt = dt_util.parse_datetime(date)
 
         return dt_util.as_local(dt) if dt else None
@@ -43,3 +64,61 @@ def bounding_box(lat, lon, radius_m):
     lower_right = (lat - delta_lat, lon + delta_lon)
 
     return upper_left, lower_right
+
+
+def stagger_offset(key: str, interval: float, jitter: float = 0) -> float:
+    """Return an offset in seconds to spread periodic tasks over an interval.
+
+    The offset is derived from the key, so it is stable between restarts and
+    evenly distributed over `interval`. A random jitter of up to `jitter`
+    seconds is added.
+    """
+    offset = zlib.crc32(key.encode()) % 1000 / 1000 * interval
+
+    return offset + random.uniform(0, jitter)
+
+
+class TTLCache:
+    """Least recently used cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """Create an empty cache holding at most `maxsize` entries."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return count of cached entries (incl. expired ones)."""
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any | None:
+        """Return cached value of `key`, None if missing or expired."""
+        if (entry := self._data.get(key)) is None or entry[0] < time.monotonic():
+            self._data.pop(key, None)
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Cache `value`, evict the least recently used entry if full."""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Remove the entry of `key` if existing."""
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._data.clear()
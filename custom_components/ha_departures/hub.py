@@ -0,0 +1,639 @@
+"""Shared stop times hub for ha_departures integration."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import partial
+from typing import TYPE_CHECKING, Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
+
+from .api.data_classes import ApiCommand, Departure
+from .api.decoder import StopTimesFilter, StopTimesParser
+from .api.departure_batch import DepartureBatch
+from .api.motis_api import MotisApi, request_key
+from .api.response_cache import UNCHANGED
+from .const import (
+    CONF_API_URL,
+    DEPARTURES_PER_SENSOR_LIMIT,
+    DISCOVERY_CACHE_SIZE,
+    DISCOVERY_CACHE_TTL,
+    DOMAIN,
+    REFRESH_NEAR_TERM_DEPARTURES,
+    REFRESH_TAIL_FACTOR,
+    REQUEST_API_URL,
+    REQUEST_CONCURRENCY,
+    REQUEST_DEADLINE_SHARE,
+    REQUEST_MAX_PAGES,
+    REQUEST_RETRIES,
+    REQUEST_TIMEOUT,
+    REQUEST_TIMES_PER_LINE_COUNT,
+    REQUEST_WINDOW_MARGIN,
+    STORAGE_KEY,
+    STORAGE_SAVE_DELAY,
+    STORAGE_VERSION,
+    UPDATE_INTERVAL_MIN,
+)
+from .helper import TTLCache
+
+if TYPE_CHECKING:
+    from .coordinator import DeparturesDataUpdateCoordinator
+
+_LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# Stop times request of a hub: size, limit per line, stop ids and lines
+type _Request = tuple[int, int | None, set[str], set[tuple[str, str]]]
+
+
+@dataclass
+class DomainData:
+    """Data class for integration wide data stored in hass.data."""
+
+    client: MotisApi
+    store: Store[dict[str, list[dict[str, Any]]]]
+    hubs: dict[tuple[str, int, tuple[str, ...]], StopTimesHub] = field(
+        default_factory=dict
+    )
+    # Clients of API endpoints configured by config entries (by base URLs)
+    clients: dict[tuple[str, ...], MotisApi] = field(default_factory=dict)
+    cache: dict[str, list[Departure]] = field(default_factory=dict)
+    requests: asyncio.Semaphore = field(
+        default_factory=lambda: asyncio.Semaphore(REQUEST_CONCURRENCY)
+    )
+    stops_cache: TTLCache = field(
+        default_factory=lambda: TTLCache(DISCOVERY_CACHE_SIZE, DISCOVERY_CACHE_TTL)
+    )
+    lines_cache: TTLCache = field(
+        default_factory=lambda: TTLCache(DISCOVERY_CACHE_SIZE, DISCOVERY_CACHE_TTL)
+    )
+
+    @callback
+    def async_save_cache(self) -> None:
+        """Schedule saving of the cached departures."""
+        self.store.async_delay_save(self._cache_to_store, STORAGE_SAVE_DELAY)
+
+    @callback
+    def _cache_to_store(self) -> dict[str, list[dict[str, Any]]]:
+        now = dt_util.now()
+
+        return {
+            key: [d.to_dict() for d in upcoming_departures(departures, now)]
+            for key, departures in self.cache.items()
+            if upcoming_departures(departures, now)
+        }
+
+
+@callback
+def async_get_domain_data(hass: HomeAssistant) -> DomainData:
+    """Return integration wide data, create it on first access."""
+    if DOMAIN not in hass.data:
+        hass.data[DOMAIN] = DomainData(
+            client=MotisApi(REQUEST_API_URL, async_get_clientsession(hass)),
+            store=Store(hass, STORAGE_VERSION, STORAGE_KEY),
+        )
+
+    return hass.data[DOMAIN]
+
+
+async def async_load_cache(hass: HomeAssistant) -> None:
+    """Load departures stored by the last session."""
+    domain_data = async_get_domain_data(hass)
+
+    if not (stored := await domain_data.store.async_load()):
+        return
+
+    domain_data.cache = {
+        key: [Departure.from_dict(x) for x in departures]
+        for key, departures in stored.items()
+    }
+
+    _LOGGER.debug("Restored departures of %s stop(s)", len(domain_data.cache))
+
+
+def entry_api_urls(entry: ConfigEntry) -> tuple[str, ...]:
+    """Return API base URLs configured by a config entry.
+
+    The public API is used if the entry does not configure URLs. The URLs
+    keep the order they were configured in, duplicates are removed.
+    """
+    return tuple(dict.fromkeys(entry.options.get(CONF_API_URL) or [REQUEST_API_URL]))
+
+
+@callback
+def async_get_client(hass: HomeAssistant, api_urls: tuple[str, ...]) -> MotisApi:
+    """Return the client of the given API base URLs, create it if not existing yet.
+
+    Config entries with the same URLs share one client, the client of the
+    public API is also used for discovery. Circuit breakers, latencies and
+    rate limits are kept per base URL over all clients (s. `get_endpoint`).
+    """
+    domain_data = async_get_domain_data(hass)
+
+    if api_urls == (REQUEST_API_URL,):
+        return domain_data.client
+
+    if api_urls not in domain_data.clients:
+        _LOGGER.debug("Creating client for API endpoints %s", api_urls)
+        domain_data.clients[api_urls] = MotisApi(
+            api_urls, async_get_clientsession(hass)
+        )
+
+    return domain_data.clients[api_urls]
+
+
+@callback
+def async_get_hub(
+    hass: HomeAssistant,
+    stop_id: str,
+    radius: int,
+    api_urls: tuple[str, ...] = (REQUEST_API_URL,),
+) -> StopTimesHub:
+    """Return the hub for the given stop, create it if not existing yet.
+
+    Only config entries using the same API endpoints share a hub, so every
+    entry requests the servers it configured only.
+    """
+    domain_data = async_get_domain_data(hass)
+    key = (normalize_stop_id(stop_id), radius, api_urls)
+
+    if key not in domain_data.hubs:
+        _LOGGER.debug(
+            "Creating stop times hub for stop %s (radius=%sm, endpoints=%s)", *key
+        )
+        domain_data.hubs[key] = StopTimesHub(
+            hass, async_get_client(hass, api_urls), *key
+        )
+
+    return domain_data.hubs[key]
+
+
+def normalize_stop_id(stop_id: str) -> str:
+    """Return stop id without the group suffix."""
+    return str(stop_id).removesuffix("_G")
+
+
+def merge_departures(
+    cached: list[Departure], fresh: list[Departure], now: datetime
+) -> list[Departure]:
+    """Merge near-term departures into the cached ones.
+
+    Departures are keyed by trip and stop, fresh ones replace cached ones.
+    Cached departures missing in `fresh` are kept only if they leave at or
+    after the last fresh departure (the server may cut the window between
+    departures of the same time), earlier ones were removed by the server.
+    So `fresh` must hold all departures of the window, not only the first
+    ones of every line. Departed ones are dropped, the result is ordered by
+    expected departure.
+    """
+    fresh = upcoming_departures(fresh, now)
+
+    if not fresh:
+        return upcoming_departures(cached, now)
+
+    boundary = max(d.expected_departure for d in fresh)
+    merged = {
+        (d.trip_id, d.stop_id): d
+        for d in upcoming_departures(cached, now)
+        if d.expected_departure >= boundary
+    }
+    merged.update(((d.trip_id, d.stop_id), d) for d in fresh)
+
+    return sorted(merged.values(), key=lambda d: d.expected_departure)
+
+
+def upcoming_departures(departures: list[Departure], now: datetime) -> list[Departure]:
+    """Return departures which did not depart yet."""
+    return [
+        d
+        for d in departures
+        if (departure_time := d.expected_departure) is not None and departure_time > now
+    ]
+
+
+class StopTimesHub:
+    """Fetch stop times for one stop and share them between config entries.
+
+    All config entries watching the same stop (same normalized stop id and
+    radius) with the same API endpoints subscribe to one hub. The subscriber
+    whose refresh is due first triggers the request, all others receive the
+    parsed departures from it.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        client: MotisApi,
+        stop_id: str,
+        radius: int,
+        api_urls: tuple[str, ...] = (REQUEST_API_URL,),
+    ) -> None:
+        """Initialize."""
+        self._hass = hass
+        self._client = client
+        self._stop_id = stop_id
+        self._radius = radius
+        self._api_urls = api_urls
+
+        self._subscribers: set[DeparturesDataUpdateCoordinator] = set()
+        self._waiting: set[DeparturesDataUpdateCoordinator] = set()
+        self._departures: list[Departure] = []
+        self._last_update: float | None = None
+        # Stop ids and lines the last fetched departures were filtered by
+        self._fetched_for: tuple[set[str], set[tuple[str, str]]] = (set(), set())
+        self._fetch_task: asyncio.Task[list[Departure]] | None = None
+        self._batch: DepartureBatch | None = None
+        # Stop times per departure of a line, learned to size the request
+        self._rows_per_departure: dict[tuple[str, str], float | None] = {}
+        # Request (size, limit, stop ids, lines) the departures were fetched by
+        self._applied: _Request | None = None
+
+    @property
+    def key(self) -> tuple[str, int, tuple[str, ...]]:
+        """Return hub key (normalized stop id, radius and API base URLs)."""
+        return (self._stop_id, self._radius, self._api_urls)
+
+    @property
+    def client(self) -> MotisApi:
+        """Return the client of the API endpoints of the hub."""
+        return self._client
+
+    @property
+    def subscribers(self) -> int:
+        """Return count of subscribed coordinators."""
+        return len(self._subscribers)
+
+    @property
+    def lines(self) -> int:
+        """Return count of distinct lines over all subscribers."""
+        return len(self._tracked()[1])
+
+    @property
+    def api_available(self) -> bool:
+        """Return True if the circuit breaker of any API endpoint is closed."""
+        return self._client.available
+
+    def stale_departures(self) -> list[Departure]:
+        """Return still upcoming departures of the last successful fetch."""
+        return upcoming_departures(self._departures, dt_util.now())
+
+    def batch(self, departures: list[Departure]) -> DepartureBatch | None:
+        """Return departures as columnar batch, shared by all subscribers.
+
+        The batch is built once per list of departures (by the first caller,
+        in the executor), None is returned if numpy is not installed.
+        """
+        if not DepartureBatch.available():
+            return None
+
+        if (batch := self._batch) is None or batch.objects is not departures:
+            batch = self._batch = DepartureBatch(departures)
+
+        return batch
+
+    def _tracked(self) -> tuple[set[str], set[tuple[str, str]]]:
+        """Return stop ids and lines over all subscribers."""
+        stop_ids: set[str] = set()
+        line_keys: set[tuple[str, str]] = set()
+
+        for coordinator in self._subscribers:
+            stop_ids.update(normalize_stop_id(s) for s in coordinator.stop_ids)
+            line_keys |= coordinator.line_keys
+
+        return stop_ids, line_keys
+
+    @callback
+    def async_restore(self) -> list[Departure]:
+        """Return still upcoming departures stored by the last session."""
+        cached = async_get_domain_data(self._hass).cache.get(self._cache_key, [])
+        departures = upcoming_departures(cached, dt_util.now())
+
+        if departures and not self._departures:
+            self._departures = departures
+
+        return departures
+
+    @property
+    def _cache_key(self) -> str:
+        return f"{self._stop_id}_{self._radius}"
+
+    @callback
+    def async_subscribe(
+        self, coordinator: DeparturesDataUpdateCoordinator
+    ) -> CALLBACK_TYPE:
+        """Subscribe a coordinator, return a callback to unsubscribe it."""
+        self._subscribers.add(coordinator)
+
+        @callback
+        def _async_unsubscribe() -> None:
+            self._subscribers.discard(coordinator)
+
+            if not self._subscribers:
+                _LOGGER.debug("Removing stop times hub for stop %s", self._stop_id)
+                domain_data = async_get_domain_data(self._hass)
+                domain_data.hubs.pop(self.key, None)
+
+                # The client of own endpoints is dropped with its last hub
+                if all(h.client is not self._client for h in domain_data.hubs.values()):
+                    domain_data.clients.pop(self._api_urls, None)
+
+        return _async_unsubscribe
+
+    async def async_get_departures(
+        self, coordinator: DeparturesDataUpdateCoordinator, max_age: timedelta
+    ) -> list[Departure]:
+        """Return departures, fetch them only if shared data is too old.
+
+        Data fetched less than half of `max_age` ago is returned as is, unless
+        it misses stops or lines of the caller (e.g. subscribed after the
+        fetch). If a request is already in flight, the caller waits for its
+        result.
+        """
+        # A task started eagerly may be done before it was stored (e.g. the
+        # request was rejected by the circuit breaker)
+        fetching = self._fetch_task is not None and not self._fetch_task.done()
+
+        if not fetching and self._is_fresh(max_age) and self._covers(coordinator):
+            _LOGGER.debug("Using shared departures for stop %s", self._stop_id)
+            return self._departures
+
+        self._waiting.add(coordinator)
+
+        try:
+            if not fetching:
+                self._fetch_task = self._hass.async_create_task(
+                    self._async_fetch(max_age),
+                    f"{DOMAIN} stop times {self._stop_id}",
+                )
+
+            return await asyncio.shield(self._fetch_task)
+        finally:
+            self._waiting.discard(coordinator)
+
+    def _is_fresh(self, max_age: timedelta) -> bool:
+        if self._last_update is None:
+            return False
+
+        return time.monotonic() - self._last_update < max_age.total_seconds() / 2
+
+    def _covers(self, coordinator: DeparturesDataUpdateCoordinator) -> bool:
+        stop_ids, line_keys = self._fetched_for
+
+        return coordinator.line_keys <= line_keys and all(
+            normalize_stop_id(s) in stop_ids for s in coordinator.stop_ids
+        )
+
+    def _window_size(self, line_keys: set[tuple[str, str]], departures: int) -> int:
+        """Return count of stop times to request for `departures` per line.
+
+        Based on the stop times per departure of each line learned by the last
+        full fetch, with a margin. Until every line is learned
+        `REQUEST_TIMES_PER_LINE_COUNT` per line are requested, which is also
+        the maximum. Lines without departures in the last full fetch (e.g.
+        not running at this time of day) do not enlarge the request, if no
+        line has departures the stop times of one line are requested.
+        """
+        maximum = REQUEST_TIMES_PER_LINE_COUNT * len(line_keys)
+
+        if any(key not in self._rows_per_departure for key in line_keys):
+            return maximum
+
+        rates = [
+            rate
+            for key in line_keys
+            if (rate := self._rows_per_departure[key]) is not None
+        ]
+
+        if not rates:
+            return min(REQUEST_TIMES_PER_LINE_COUNT, maximum)
+
+        size = math.ceil(max(rates) * departures * REQUEST_WINDOW_MARGIN)
+
+        return min(max(size, departures), maximum)
+
+    def _learn(self, accept: StopTimesFilter) -> None:
+        """Store stop times per departure of every line seen by `accept`.
+
+        None is stored for a line without departures.
+        """
+        for key, matched in accept.matched.items():
+            self._rows_per_departure[key] = accept.seen / matched if matched else None
+
+    def _is_incremental(
+        self,
+        stop_ids: set[str],
+        line_keys: set[tuple[str, str]],
+        upcoming: list[Departure],
+    ) -> bool:
+        """Return True if refreshing the near-term departures is sufficient.
+
+        The tail of the last full fetch must still hold enough departures to
+        fill every sensor, with the same stops and lines tracked. Lines
+        without departures in the last full fetch are not waited for.
+        """
+        if self._fetched_for != (stop_ids, line_keys):
+            return False
+
+        if any(key not in self._rows_per_departure for key in line_keys):
+            return False
+
+        line_keys = {
+            key for key in line_keys if self._rows_per_departure[key] is not None
+        }
+
+        if not line_keys:
+            return False
+
+        counts = dict.fromkeys(line_keys, 0)
+        resolved: dict[tuple[str, str], list[tuple[str, str]]] = {}
+
+        for departure in upcoming:
+            key = (departure.route_id, departure.direction_id)
+
+            if (lines := resolved.get(key)) is None:
+                lines = resolved[key] = [
+                    (route_id, direction_id)
+                    for route_id, direction_id in line_keys
+                    if key[0].endswith(route_id) and key[1] == direction_id
+                ]
+
+            for line in lines:
+                counts[line] += 1
+
+        return min(counts.values()) >= DEPARTURES_PER_SENSOR_LIMIT
+
+    async def _async_fetch(self, max_age: timedelta) -> list[Departure]:
+        # All requests and retries of the refresh must be done before the
+        # next refresh of the caller is due (the first one may be staggered)
+        interval = max(max_age.total_seconds(), UPDATE_INTERVAL_MIN)
+        deadline = time.monotonic() + interval * REQUEST_DEADLINE_SHARE
+
+        try:
+            stop_ids, line_keys = self._tracked()
+            now = dt_util.now()
+            upcoming = upcoming_departures(self._departures, now)
+
+            # Refresh only the near-term departures (real-time updates) while
+            # the tail of the last full fetch is not consumed yet. A full fetch
+            # keeps more departures than shown to have a tail to consume.
+            if incremental := self._is_incremental(stop_ids, line_keys, upcoming):
+                size = self._window_size(line_keys, REFRESH_NEAR_TERM_DEPARTURES)
+                # Not limited per line, the window must be complete up to its
+                # last departure to be merged (s. `merge_departures`)
+                limit = None
+                pages = 1
+            else:
+                limit = DEPARTURES_PER_SENSOR_LIMIT * REFRESH_TAIL_FACTOR
+                size = self._window_size(line_keys, limit)
+                pages = REQUEST_MAX_PAGES
+
+            # Skip an unchanged response of the same request as last time
+            request = (size, limit, stop_ids, line_keys)
+
+            try:
+                result = await self._async_fetch_pages(
+                    StopTimesFilter(stop_ids, line_keys, limit),
+                    size,
+                    pages,
+                    conditional=request == self._applied,
+                    deadline=deadline,
+                )
+                self._last_update = time.monotonic()
+
+                if result is None:
+                    _LOGGER.debug("Stop times for stop_id: %s unchanged", self._stop_id)
+                    return self._departures
+
+                fetched, accept = result
+
+                _LOGGER.debug(
+                    "Received %s stop times for stop_id: %s (%s of other "
+                    "stops/lines, incremental: %s)",
+                    len(fetched),
+                    self._stop_id,
+                    accept.seen - len(fetched),
+                    incremental,
+                )
+
+                if incremental:
+                    self._departures = merge_departures(upcoming, fetched, now)
+                else:
+                    self._learn(accept)
+                    self._departures = fetched
+
+                self._fetched_for = (stop_ids, line_keys)
+                self._applied = request
+            except BaseException:
+                # The first page was remembered when received, it must not be
+                # skipped as unchanged next time if it was never applied (e.g.
+                # a later page failed or the deadline expired)
+                self._client.responses.forget(self._request_key(size))
+                raise
+        finally:
+            self._fetch_task = None
+
+        domain_data = async_get_domain_data(self._hass)
+        domain_data.cache[self._cache_key] = self._departures
+        domain_data.async_save_cache()
+
+        for coordinator in self._subscribers - self._waiting:
+            self._hass.async_create_task(
+                coordinator.async_set_hub_data(self._departures)
+            )
+
+        return self._departures
+
+    def _params(self, size: int) -> dict[str, str]:
+        """Return parameters of the first page of `size` stop times."""
+        return {
+            "stopId": self._stop_id,
+            "n": str(size),
+            "radius": str(self._radius),
+        }
+
+    def _request_key(self, size: int) -> tuple[str, tuple[tuple[str, str], ...]]:
+        """Return key of the first page in the response cache of the client."""
+        return request_key(ApiCommand.STOP_TIMES, self._params(size))
+
+    def _parser(self, accept: StopTimesFilter) -> StopTimesParser:
+        """Return a parser of one attempt, filtering by a copy of `accept`."""
+        return StopTimesParser(accept.copy(), self._client.decoder)
+
+    async def _async_fetch_pages(
+        self,
+        accept: StopTimesFilter,
+        size: int,
+        pages: int,
+        *,
+        conditional: bool,
+        deadline: float,
+    ) -> tuple[list[Departure], StopTimesFilter] | None:
+        """Fetch up to `pages` pages of `size` stop times accepted by `accept`.
+
+        The next page is requested only while a line is underfilled that had
+        stop times on the last page (a line not running at this time would
+        request all pages on every refresh otherwise). Every
+        attempt (retries and hedged requests) filters with its own copy of
+        the filter, the departures and the filter of the attempt used are
+        returned. With `conditional` None is returned if the first page did
+        not change since the last request (the following ones are expected
+        unchanged too), otherwise the last response is forgotten.
+        """
+        params = self._params(size)
+        departures: list[Departure] = []
+
+        if not conditional:
+            self._client.responses.forget(self._request_key(size))
+
+        for page in range(pages):
+            _LOGGER.debug(
+                "Fetching stop times for stop_id: %s with params: %s",
+                self._stop_id,
+                params,
+            )
+
+            matched = accept.matched
+
+            # Limit requests in flight over all hubs. The stop times are parsed
+            # while received, those of other stops and lines or beyond the
+            # limit are dropped before turned into departures.
+            async with async_get_domain_data(self._hass).requests:
+                result: StopTimesParser = await self._client.get(
+                    ApiCommand.STOP_TIMES,
+                    params=params,
+                    retry=REQUEST_RETRIES,
+                    timeout=REQUEST_TIMEOUT,
+                    parser=partial(self._parser, accept),
+                    conditional=page == 0,
+                    deadline=deadline,
+                    hedge=True,
+                )
+
+            if result is UNCHANGED:
+                return None
+
+            accept = result.accept
+            departures.extend(result.departures)
+            underfilled = {
+                key
+                for key in accept.underfilled(DEPARTURES_PER_SENSOR_LIMIT)
+                if accept.matched[key] > matched[key]
+            }
+
+            if not underfilled or not result.next_page_cursor or page + 1 == pages:
+                break
+
+            _LOGGER.debug(
+                "Lines %s underfilled, fetching next page", sorted(underfilled)
+            )
+            params = {**params, "pageCursor": result.next_page_cursor}
+
+        return departures, accept
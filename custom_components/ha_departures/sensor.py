@@ -1,14 +1,17 @@
 """Sensor platform for Public Transport Departures."""
 
 import logging
+from datetime import datetime, timedelta
 
 from homeassistant import config_entries, core
-from homeassistant.components.sensor import SensorEntity
-from homeassistant.const import ATTR_LATITUDE, ATTR_LONGITUDE
+from homeassistant.components.sensor import SensorDeviceClass, SensorEntity
+from homeassistant.const import ATTR_LATITUDE, ATTR_LONGITUDE, UnitOfTime
+from homeassistant.helpers.event import async_track_time_interval
 from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.util import dt as dt_util
 from slugify import slugify
 
-from .api.data_classes import Line, TransportMode
+from .api.data_classes import Departure, Line, TransportMode
 from .const import (
     ATTR_DEPARTURE_ALERTS,
     ATTR_DEPARTURE_CANCELLED,
@@ -20,12 +23,13 @@ from .const import (
     ATTR_PLANNED_DEPARTURE_TIME,
     ATTR_PROVIDER_URL,
     ATTR_SCHEDULED_TRACK,
+    ATTR_STALE,
     ATTR_TIMES,
     ATTR_TRACK,
     ATTR_TRANSPORT_TYPE,
     ATTR_TRIP_ID,
     CONF_LINES,
-    DEPARTURES_PER_SENSOR_LIMIT,
+    COUNTDOWN_INTERVAL,
     PROVIDER_URL,
 )
 from .coordinator import DeparturesDataUpdateCoordinator
@@ -43,14 +47,14 @@ async def async_setup_entry(
 
     async_add_entities(
         [
-            DeparturesSensor(
+            sensor_class(
                 hass,
                 coordinator,
                 line,
             )
             for line in entry.options.get(CONF_LINES, [])
+            for sensor_class in (DeparturesSensor, DeparturesCountdownSensor)
         ],
-        update_before_add=True,
     )
 
 
@@ -83,6 +87,7 @@ class DeparturesSensor(
         self._times = []
         self._value = None
         self._trip_info = {}
+        self._fingerprint: tuple | None = None
 
         self._attr_name = (
             f"{coordinator.hub_name}-{self._route_name}-{self._destination}"
@@ -102,6 +107,7 @@ class DeparturesSensor(
                 coordinator.stop_coord[1] if coordinator.stop_coord else None
             ),
             ATTR_TIMES: self._times,
+            ATTR_STALE: False,
         }
 
         _LOGGER.debug('ha-departures sensor "%s" created', self.unique_id)
@@ -112,6 +118,12 @@ class DeparturesSensor(
         _LOGGER.debug(">> Direction ID: %s", self._direction_id)
         _LOGGER.debug(">> Stop IDs: %s", coordinator.stop_ids)
 
+    async def async_added_to_hass(self) -> None:
+        """Show the departures already known by the coordinator."""
+        await super().async_added_to_hass()
+
+        self._handle_coordinator_update()
+
     @property
     def native_value(self):
         """Return value of this sensor."""
@@ -165,27 +177,46 @@ class DeparturesSensor(
         _LOGGER.debug(">> Route ID: %s", self._route_id)
         _LOGGER.debug(">> Direction ID: %s", self._direction_id)
 
-        departures = list(
-            filter(
-                lambda d: (
-                    d.route_id.endswith(self._route_id)
-                    and d.direction_id == self._direction_id
-                ),
-                self.coordinator.data,
-            )
-        )
+        departures = self.coordinator.departures_for(self._route_id, self._direction_id)
 
         _LOGGER.debug("> Departures found: %s", len(departures))
 
+        # Every field rendered into the attributes
+        fingerprint = (
+            self.available,
+            self.coordinator.stale,
+            tuple(
+                (
+                    d.scheduled_departure,
+                    d.departure,
+                    d.trip_id,
+                    d.cancelled,
+                    d.head_sign,
+                    d.alerts,
+                    d.scheduled_track,
+                    d.track,
+                )
+                for d in departures
+            ),
+        )
+
+        if fingerprint == self._fingerprint:
+            self.coordinator.suppressed_writes += 1
+            _LOGGER.debug("<< Departures not changed, skip sensor update")
+
+            return
+
+        self._fingerprint = fingerprint
+
+        self._attr_extra_state_attributes[ATTR_STALE] = self.coordinator.stale
+
         if not departures:
             self._attr_extra_state_attributes.update({ATTR_TIMES: []})
-            self.async_write_ha_state()
             self._value = None
+            self.async_write_ha_state()
 
             return
 
-        departures = departures[:DEPARTURES_PER_SENSOR_LIMIT]
-
         for departure in departures:
             _LOGGER.debug(
                 "> Departure: Planned: %s | Estimated: %s",
@@ -216,3 +247,108 @@ class DeparturesSensor(
         self.async_write_ha_state()
 
         _LOGGER.debug("<< Sensor updated")
+
+
+class DeparturesCountdownSensor(DeparturesSensor):
+    """ha_departures countdown Sensor class.
+
+    Shows the minutes until the next departure of a line. The countdown is
+    advanced locally from the cached departures, departed entries are dropped
+    and the next one is promoted without waiting for the coordinator.
+    """
+
+    _attr_device_class = SensorDeviceClass.DURATION
+    _attr_native_unit_of_measurement = UnitOfTime.MINUTES
+    _attr_entity_registry_enabled_default = False
+
+    def __init__(
+        self,
+        hass: core.HomeAssistant,
+        coordinator: DeparturesDataUpdateCoordinator,
+        line: dict,
+    ) -> None:
+        """Initialize the sensor."""
+        super().__init__(hass, coordinator, line)
+
+        self._attr_name = f"{self._attr_name}-countdown"
+        self._attr_unique_id = f"{self._attr_unique_id}-countdown"
+
+        self._attr_extra_state_attributes.pop(ATTR_TIMES)
+        self._attr_extra_state_attributes.update(
+            {
+                ATTR_PLANNED_DEPARTURE_TIME: None,
+                ATTR_ESTIMATED_DEPARTURE_TIME: None,
+                ATTR_TRIP_ID: None,
+            }
+        )
+
+        self._departures: list[Departure] = []
+        self._countdown: tuple | None = None
+
+    async def async_added_to_hass(self) -> None:
+        """Start the local countdown when added to hass."""
+        await super().async_added_to_hass()
+
+        self.async_on_remove(
+            async_track_time_interval(
+                self.hass,
+                self._async_countdown,
+                timedelta(seconds=COUNTDOWN_INTERVAL),
+            )
+        )
+
+    @core.callback
+    def _handle_coordinator_update(self) -> None:
+        """Handle updated data from the coordinator."""
+        # Departures of a full fetch keep the order of the server, a delayed
+        # one must not hide (and keep from departing) an earlier one
+        self._departures = sorted(
+            (
+                d
+                for d in self.coordinator.departures_for(
+                    self._route_id, self._direction_id
+                )
+                if not d.cancelled and d.expected_departure
+            ),
+            key=lambda d: d.expected_departure,
+        )
+
+        self._async_countdown()
+
+    @core.callback
+    def _async_countdown(self, now: datetime | None = None) -> None:
+        """Advance the countdown, write state only if the shown value changed."""
+        now = now or dt_util.now()
+
+        while self._departures and self._departures[0].expected_departure <= now:
+            departed = self._departures.pop(0)
+            _LOGGER.debug("> Departure %s departed", departed.trip_id)
+
+        departure = self._departures[0] if self._departures else None
+        value = (
+            int((departure.expected_departure - now).total_seconds() // 60)
+            if departure
+            else None
+        )
+
+        countdown = (self.available, self.coordinator.stale, value, departure)
+
+        if countdown == self._countdown:
+            return
+
+        self._countdown = countdown
+        self._value = value
+        self._attr_extra_state_attributes.update(
+            {
+                ATTR_PLANNED_DEPARTURE_TIME: (
+                    departure.scheduled_departure if departure else None
+                ),
+                ATTR_ESTIMATED_DEPARTURE_TIME: departure.departure
+                if departure
+                else None,
+                ATTR_TRIP_ID: departure.trip_id if departure else None,
+                ATTR_STALE: self.coordinator.stale,
+            }
+        )
+
+        self.async_write_ha_state()
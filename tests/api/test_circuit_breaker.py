@@ -0,0 +1,100 @@
+"""Tests for the circuit breaker of the Motis API."""
+
+import pytest
+
+from custom_components.ha_departures.api import circuit_breaker
+from custom_components.ha_departures.api.circuit_breaker import (
+    CircuitBreaker,
+    CircuitState,
+)
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):  # noqa: D103
+    clock = _Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return clock
+
+
+def _open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.threshold):
+        assert breaker.allow()
+        breaker.on_failure()
+
+
+def test_opens_after_threshold(clock):  # noqa: D103
+    breaker = CircuitBreaker(threshold=3, reset_timeout=60, max_reset_timeout=600)
+
+    breaker.on_failure()
+    breaker.on_failure()
+    assert breaker.state is CircuitState.CLOSED
+
+    breaker.on_failure()
+    assert breaker.state is CircuitState.OPEN
+    assert breaker.opened == 1
+    assert not breaker.allow()
+    assert breaker.retry_in == 60
+
+
+def test_success_resets_failures(clock):  # noqa: D103
+    breaker = CircuitBreaker(threshold=2, reset_timeout=60, max_reset_timeout=600)
+
+    breaker.on_failure()
+    breaker.on_success()
+    breaker.on_failure()
+
+    assert breaker.state is CircuitState.CLOSED
+
+
+def test_half_open_single_probe(clock):  # noqa: D103
+    breaker = CircuitBreaker(threshold=1, reset_timeout=60, max_reset_timeout=600)
+    _open_breaker(breaker)
+
+    clock.now += 60
+
+    assert breaker.allow()
+    assert breaker.state is CircuitState.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.on_success()
+
+    assert breaker.state is CircuitState.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_doubles_timeout(clock):  # noqa: D103
+    breaker = CircuitBreaker(threshold=1, reset_timeout=60, max_reset_timeout=100)
+    _open_breaker(breaker)
+
+    for timeout in (120, 100):
+        clock.now += breaker.retry_in
+        assert breaker.allow()
+
+        breaker.on_failure()
+
+        assert breaker.state is CircuitState.OPEN
+        assert breaker.retry_in == min(timeout, 100)
+
+    breaker.on_success()
+    _open_breaker(breaker)
+
+    assert breaker.retry_in == 60
+
+
+def test_cancelled_probe(clock):  # noqa: D103
+    breaker = CircuitBreaker(threshold=1, reset_timeout=60, max_reset_timeout=600)
+    _open_breaker(breaker)
+    clock.now += 60
+
+    assert breaker.allow()
+    breaker.on_cancel()
+
+    assert breaker.allow()
@@ -0,0 +1,339 @@
+"""Tests for decoding of Motis API responses."""
+
+import json
+import logging
+import timeit
+import tracemalloc
+
+import pytest
+
+from custom_components.ha_departures.api import decoder
+from custom_components.ha_departures.api.data_classes import Departure
+from custom_components.ha_departures.api.decoder import (
+    StopTimesFilter,
+    StopTimesParser,
+    json_loads,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _stop_times_body(count: int) -> bytes:
+    """Return a stop times response body shaped like a Motis response."""
+    return json.dumps(
+        {
+            "stopTimes": [
+                {
+                    "place": {
+                        "name": "Hauptbahnhof",
+                        "stopId": f"de-DELFI_de:09564:510:{i % 8}",
+                        "lat": 49.4459,
+                        "lon": 11.0822,
+                        "level": 0.0,
+                        "arrival": f"2024-06-01T10:{i % 60:02d}:00Z",
+                        "departure": f"2024-06-01T10:{i % 60:02d}:30Z",
+                        "scheduledArrival": f"2024-06-01T10:{i % 60:02d}:00Z",
+                        "scheduledDeparture": f"2024-06-01T10:{i % 60:02d}:00Z",
+                        "scheduledTrack": str(i % 8),
+                        "track": str(i % 8),
+                        "vertexType": "TRANSIT",
+                        "alerts": [],
+                    },
+                    "mode": "BUS",
+                    "realTime": True,
+                    "headsign": "Fürth Hardhöhe",
+                    "agencyId": "VAG",
+                    "agencyName": "VAG Verkehrs-Aktiengesellschaft Nürnberg",
+                    "agencyUrl": "https://www.vag.de",
+                    "routeColor": "0064AA",
+                    "routeTextColor": "FFFFFF",
+                    "tripId": f"20240601_10:00_de-DELFI_{i}",
+                    "routeId": f"de-DELFI_{i % 20}",
+                    "directionId": str(i % 2),
+                    "routeShortName": str(i % 20),
+                    "routeLongName": "",
+                    "tripShortName": str(i),
+                    "displayName": str(i % 20),
+                    "pickupDropoffType": "NORMAL",
+                    "cancelled": False,
+                    "tripCancelled": False,
+                    "source": "DELFI.gtfs.zip/stop_times.txt:1",
+                }
+                for i in range(count)
+            ],
+            "previousPageCursor": "EARLIER|1717236000",
+            "nextPageCursor": "LATER|1717239600",
+        }
+    ).encode()
+
+
+def _departures(body: bytes) -> list[Departure]:
+    """Return departures of the whole decoded body."""
+    return [Departure.from_dict(x) for x in json_loads(body)["stopTimes"]]
+
+
+def _parse_stream(body: bytes, chunk_size: int, accept=None) -> StopTimesParser:
+    parser = StopTimesParser(accept)
+
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i : i + chunk_size])
+
+    return parser.close()
+
+
+def _peak_memory(func, *args) -> int:
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_json_loads_without_orjson(monkeypatch):
+    """The standard library is used if orjson is not installed."""
+    monkeypatch.setattr(decoder, "orjson", None)
+
+    assert json_loads(b'{"stopTimes": []}') == {"stopTimes": []}
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("count", [100, 1_000, 5_000])
+def test_json_loads_benchmark(count):
+    """Benchmark: parse time and peak memory of the decoders.
+
+    The default decoder (orjson if installed) must not be slower than the
+    standard library, peak memory must not grow faster than the payload.
+    """
+    body = _stop_times_body(count)
+
+    time_json = min(timeit.repeat(lambda: json.loads(body), number=3, repeat=3))
+    time_default = min(timeit.repeat(lambda: json_loads(body), number=3, repeat=3))
+    peak = _peak_memory(_departures, body)
+
+    _LOGGER.info(
+        "%s stop times (%s KiB): json %.1fms, default %.1fms, peak %s KiB",
+        count,
+        len(body) // 1024,
+        time_json / 3 * 1000,
+        time_default / 3 * 1000,
+        peak // 1024,
+    )
+
+    assert time_default <= time_json * 1.5
+    assert peak < len(body) * 10
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096, 1 << 20])
+def test_stop_times_parser_chunks(chunk_size):
+    """The result does not depend on how the body is split into chunks."""
+    body = _stop_times_body(20)
+
+    parser = _parse_stream(body, chunk_size)
+
+    assert parser.departures == _departures(body)
+    assert parser.departures[1].route_id == "de-DELFI_1"
+    assert parser.departures[1].track == "1"
+    assert parser.departures[0].head_sign == "Fürth Hardhöhe"
+    assert parser.next_page_cursor == "LATER|1717239600"
+    assert parser.previous_page_cursor == "EARLIER|1717236000"
+
+
+def test_stop_times_parser_cursor_before_stop_times():
+    """Members in front of the stop times are decoded too."""
+    body = b'{"nextPageCursor": "LATER|1", "stopTimes": [{"routeId": "1"}]}'
+
+    parser = _parse_stream(body, 5)
+
+    assert parser.next_page_cursor == "LATER|1"
+    assert [d.route_id for d in parser.departures] == ["1"]
+
+
+def test_stop_times_parser_decoder():
+    """Elements and the rest of the body are decoded by the given decoder."""
+    decoded = []
+
+    def decode(data: bytes):
+        decoded.append(data)
+        return json.loads(data)
+
+    parser = StopTimesParser(decoder=decode)
+    parser.feed(b'{"stopTimes": [{"routeId": "1"}, {"routeId": "2"}]}')
+    parser.close()
+
+    assert [d.route_id for d in parser.departures] == ["1", "2"]
+    assert decoded == [b'{"routeId": "1"}', b'{"routeId": "2"}', b'{"stopTimes": []}']
+
+
+def test_stop_times_parser_nested_objects():
+    """Braces in strings and nested objects do not end an element early."""
+    stop_time = {
+        "headsign": 'Nord }, {"x": 1}] \\" \u00fc',
+        "routeId": "1",
+        "place": {"alerts": [{"text": "a"}, {"text": "b", "nested": {}}]},
+    }
+    body = json.dumps({"stopTimes": [stop_time, {}]}).encode()
+
+    parser = _parse_stream(body, 1)
+
+    assert parser.departures == [
+        Departure.from_dict(stop_time),
+        Departure.from_dict({}),
+    ]
+    assert parser.departures[0].alerts
+
+
+def test_stop_times_parser_invalid_element():
+    """Elements of stop times must be objects."""
+    with pytest.raises(ValueError):
+        StopTimesParser().feed(b'{"stopTimes": [1]}')
+
+
+@pytest.mark.parametrize("body", [b"{}", b'{"stopTimes": null}', b'{"stopTimes": []}'])
+def test_stop_times_parser_without_stop_times(body):
+    """A response without stop times returns no departures."""
+    assert _parse_stream(body, 3).departures == []
+
+
+def test_stop_times_parser_incomplete():
+    """A truncated body raises a ValueError."""
+    body = _stop_times_body(5)
+
+    with pytest.raises(ValueError):
+        _parse_stream(body[: len(body) // 2], 64)
+
+
+def test_StopTimesFilter():
+    """Only stop times of the given stops and lines are accepted."""
+    accept = StopTimesFilter({"de-DELFI_de:09564:510:1"}, {("1", "1"), ("2", "0")})
+
+    parser = _parse_stream(_stop_times_body(160), 4096, accept)
+
+    assert {(d.stop_id, d.route_id, d.direction_id) for d in parser.departures} == {
+        ("de-DELFI_de:09564:510:1", "de-DELFI_1", "1"),
+    }
+    assert len(parser.departures) + parser.skipped == 160
+
+
+def test_stop_times_filter_limit():
+    """At most `limit` trips of a line per stop are accepted."""
+    stop_times = json.loads(_stop_times_body(400))["stopTimes"]
+    stop_ids = {f"de-DELFI_de:09564:510:{i}" for i in range(8)}
+    line_keys = {(str(i), str(i % 2)) for i in range(20)}
+    accept = StopTimesFilter(stop_ids, line_keys, limit=2)
+
+    accepted = [x for x in stop_times if accept(x)]
+
+    # Every route serves 2 stops (period of 40 rows): 20 lines x 2 stops x 2 trips
+    assert len(accepted) == 80
+    assert accepted == [x for x in stop_times if int(x["tripShortName"]) < 80]
+
+
+def test_stop_times_filter_limit_keeps_repeated_trips():
+    """Repeated stop times of an accepted trip are accepted too."""
+    stop_time = json.loads(_stop_times_body(1))["stopTimes"][0]
+    accept = StopTimesFilter({stop_time["place"]["stopId"]}, {("0", "0")}, limit=1)
+
+    assert accept(stop_time)
+    assert accept(stop_time)
+    assert not accept({**stop_time, "tripId": "other"})
+
+
+def test_stop_times_filter_counts_lines():
+    """Stop times are counted in total and per line, also beyond the limit."""
+    stop_times = json.loads(_stop_times_body(400))["stopTimes"]
+    stop_ids = {f"de-DELFI_de:09564:510:{i}" for i in range(8)}
+    accept = StopTimesFilter(stop_ids, {("11", "1"), ("12", "0"), ("11", "0")}, limit=2)
+
+    for stop_time in stop_times:
+        accept(stop_time)
+
+    assert accept.seen == 400
+    assert accept.matched == {("11", "1"): 20, ("12", "0"): 20, ("11", "0"): 0}
+
+
+def test_stop_times_filter_underfilled():
+    """Lines with less than `limit` trips over all stops are underfilled."""
+    stop_times = json.loads(_stop_times_body(40))["stopTimes"]
+    stop_ids = {f"de-DELFI_de:09564:510:{i}" for i in range(8)}
+    accept = StopTimesFilter(stop_ids, {("11", "1"), ("12", "0")}, limit=2)
+
+    for stop_time in stop_times[:32]:
+        accept(stop_time)
+
+    # Route 11 served twice (rows 11 and 31), route 12 only once (row 12)
+    assert accept.underfilled() == {("12", "0")}
+    assert StopTimesFilter(stop_ids, {("11", "1")}).underfilled() == set()
+
+
+def test_stop_times_filter_copy():
+    """A copy continues with the counts, but does not add to the original."""
+    stop_times = json.loads(_stop_times_body(40))["stopTimes"]
+    stop_ids = {f"de-DELFI_de:09564:510:{i}" for i in range(8)}
+    accept = StopTimesFilter(stop_ids, {("11", "1")}, limit=2)
+
+    for stop_time in stop_times[:20]:
+        accept(stop_time)
+
+    copy = accept.copy()
+    for stop_time in stop_times[20:]:
+        copy(stop_time)
+
+    assert (accept.seen, accept.matched) == (20, {("11", "1"): 1})
+    assert (copy.seen, copy.matched) == (40, {("11", "1"): 2})
+    assert accept.underfilled() == {("11", "1")}
+    assert copy.underfilled() == set()
+
+
+@pytest.mark.benchmark
+def test_stop_times_parser_limit_benchmark():
+    """Benchmark: with a limit parse time depends on the shown departures.
+
+    All 5,000 stop times belong to tracked lines, only 10 per line and stop
+    are turned into departures.
+    """
+    body = _stop_times_body(5_000)
+    stop_ids = {f"de-DELFI_de:09564:510:{i}" for i in range(8)}
+    line_keys = {(str(i), str(i % 2)) for i in range(20)}
+
+    def parse(limit):
+        return _parse_stream(
+            body, 64 * 1024, StopTimesFilter(stop_ids, line_keys, limit)
+        )
+
+    assert len(parse(10).departures) == 400
+    assert len(parse(None).departures) == 5_000
+
+    time_limited = min(timeit.repeat(lambda: parse(10), number=1, repeat=3))
+    time_unlimited = min(timeit.repeat(lambda: parse(None), number=1, repeat=3))
+
+    _LOGGER.info(
+        "5000 stop times: limited %.1fms, unlimited %.1fms",
+        time_limited * 1000,
+        time_unlimited * 1000,
+    )
+
+    assert time_limited < time_unlimited
+
+
+@pytest.mark.parametrize("count", [1_000, 5_000])
+def test_stop_times_parser_memory_benchmark(count):
+    """Benchmark: peak memory of the streaming parser is bounded by the chunk.
+
+    Decoding the whole body holds all stop times at once, streaming only the
+    current chunk and the accepted departures.
+    """
+    body = _stop_times_body(count)
+    accept = StopTimesFilter({"de-DELFI_de:09564:510:1"}, {("1", "1")})
+
+    peak_full = _peak_memory(_departures, body)
+    peak_stream = _peak_memory(_parse_stream, body, 64 * 1024, accept)
+
+    _LOGGER.info(
+        "%s stop times: peak full %s KiB, peak streamed %s KiB",
+        count,
+        peak_full // 1024,
+        peak_stream // 1024,
+    )
+
+    assert peak_stream < peak_full / 4
@@ -1,7 +1,11 @@
 """Tests for the Departure data class."""
 
+import dataclasses
+import json
+import tracemalloc
 from datetime import datetime
 
+import pytest
 from homeassistant.util import dt as dt_util
 
 from custom_components.ha_departures.api.data_classes import Departure
@@ -262,3 +266,137 @@ def test_hash_usable_as_dict_key():
     mapping = {dep: "value"}
 
     assert mapping[dep] == "value"
+
+
+# ---------------------------------------------------------------------------
+# to_dict
+# ---------------------------------------------------------------------------
+
+
+def test_to_dict_round_trip():
+    """from_dict(to_dict()) ergibt wieder dieselbe Departure."""
+    data = {
+        **FULL_DICT,
+        "place": {**FULL_DICT["place"], "alerts": [ALERT_STUB], "track": "2"},
+    }
+    dep = Departure.from_dict(data)
+
+    assert Departure.from_dict(dep.to_dict()) == dep
+
+
+def test_to_dict_round_trip_missing_times():
+    """Fehlende Abfahrtszeiten bleiben beim Round-Trip None."""
+    dep = Departure.from_dict({})
+
+    assert Departure.from_dict(dep.to_dict()) == dep
+
+
+# ---------------------------------------------------------------------------
+# Speicherbedarf
+# ---------------------------------------------------------------------------
+
+
+@dataclasses.dataclass
+class _PlainDeparture:
+    """Departure wie vor slots/frozen und ohne Interning (Vergleichsbasis)."""
+
+    route_id: str
+    direction_id: str
+    trip_id: str
+    stop_id: str
+    departure: datetime | None
+    head_sign: str
+    scheduled_departure: datetime | None
+    real_time: bool
+    cancelled: bool = False
+    trip_cancelled: bool = False
+    alerts: bool = False
+    scheduled_track: str | None = None
+    track: str | None = None
+
+    @staticmethod
+    def from_departure(data: dict, departure: Departure) -> "_PlainDeparture":
+        """Übernimmt die Strings unverändert aus dem decodierten JSON."""
+        place = data["place"]
+
+        return _PlainDeparture(
+            route_id=data["routeId"],
+            direction_id=data["directionId"],
+            trip_id=data["tripId"],
+            stop_id=place["stopId"],
+            departure=departure.departure,
+            head_sign=data["headsign"],
+            scheduled_departure=departure.scheduled_departure,
+            real_time=data["realTime"],
+            scheduled_track=place["scheduledTrack"],
+            track=place["track"],
+        )
+
+
+def _hub_payload(hub: int, count: int) -> bytes:
+    """Antwort einer Haltestelle mit wenigen Linien und vielen Abfahrten."""
+    return json.dumps(
+        [
+            {
+                "routeId": f"de-DELFI_{hub}-{i % 6}",
+                "directionId": str(i % 2),
+                "tripId": f"{hub}-{i}",
+                "headsign": f"Ziel {i % 12}",
+                "realTime": True,
+                "place": {
+                    "stopId": f"de:09564:{hub}:{i % 4}",
+                    "departure": f"2024-06-01T{10 + i // 60 % 12}:{i % 60:02d}:00Z",
+                    "scheduledDeparture": f"2024-06-01T{10 + i // 60 % 12}:{i % 60:02d}:00Z",
+                    "scheduledTrack": str(i % 4),
+                    "track": str(i % 4),
+                },
+            }
+            for i in range(count)
+        ]
+    ).encode()
+
+
+def _retained_bytes(payloads: list[bytes], build) -> int:
+    """Speicher, den die erzeugten Objekte nach Freigabe des JSON belegen."""
+    tracemalloc.start()
+    try:
+        objects = [build(item) for payload in payloads for item in json.loads(payload)]
+        return tracemalloc.get_traced_memory()[0] // len(objects)
+    finally:
+        tracemalloc.stop()
+
+
+def test_departure_is_slotted_and_frozen():
+    """Departure hat kein __dict__ und ist unveränderlich."""
+    dep = Departure.from_dict(FULL_DICT)
+
+    assert not hasattr(dep, "__dict__")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        dep.route_id = "other"
+
+
+def test_from_dict_interns_repeated_strings():
+    """Wiederholte Strings verschiedener Abfahrten sind dasselbe Objekt."""
+    first, second = (
+        Departure.from_dict(x) for x in json.loads(json.dumps([FULL_DICT] * 2))
+    )
+
+    assert first.route_id is second.route_id
+    assert first.head_sign is second.head_sign
+    assert first.stop_id is second.stop_id
+
+
+def test_departure_memory_benchmark():
+    """Benchmark: Bytes pro Abfahrt für 40 Hubs mit je 200 Abfahrten.
+
+    Datetimes sind in beiden Varianten enthalten, die Einsparung kommt aus
+    slots und Interning. Gefordert sind mindestens 25% weniger Speicher.
+    """
+    payloads = [_hub_payload(hub, 200) for hub in range(40)]
+
+    plain = _retained_bytes(
+        payloads, lambda x: _PlainDeparture.from_departure(x, Departure.from_dict(x))
+    )
+    slotted = _retained_bytes(payloads, Departure.from_dict)
+
+    assert slotted < plain * 0.75, f"{plain} -> {slotted} bytes per departure"
@@ -0,0 +1,145 @@
+"""Tests for the columnar departure batch."""
+
+import dataclasses
+
+import numpy as np
+
+from custom_components.ha_departures.api.data_classes import Departure
+from custom_components.ha_departures.api.departure_batch import (
+    DepartureBatch,
+    DepartureFlag,
+)
+from custom_components.ha_departures.coordinator import unique_departures
+
+
+def _departure(
+    route_id: str, trip_id: str, stop_id: str = "stop-0", minute: int = 0, **kwargs
+) -> Departure:
+    """Return a departure of `route_id` leaving at 10:`minute`."""
+    return Departure.from_dict(
+        {
+            "routeId": route_id,
+            "directionId": "0",
+            "tripId": trip_id,
+            "place": {
+                "stopId": stop_id,
+                "departure": f"2024-06-01T10:{minute:02d}:00Z",
+                "scheduledDeparture": f"2024-06-01T10:{minute:02d}:00Z",
+            },
+            **kwargs,
+        }
+    )
+
+
+def test_columns():
+    """Every departure becomes one element of each column."""
+    departures = [
+        _departure("route-1", "trip-1", realTime=True),
+        _departure("route-2", "trip-2", minute=5, cancelled=True),
+    ]
+
+    batch = DepartureBatch(departures)
+
+    assert len(batch) == 2
+    assert batch.route[0] == batch.strings["route-1"]
+    assert batch.trip[1] == batch.strings["trip-2"]
+    assert batch.direction[0] == batch.direction[1]
+    assert list(batch.departure) == [d.departure.timestamp() for d in departures]
+    assert batch.flags[0] == DepartureFlag.REAL_TIME
+    assert batch.flags[1] == DepartureFlag.CANCELLED
+
+
+def test_missing_time_is_nan():
+    """Departures without time get NaN."""
+    batch = DepartureBatch([Departure.from_dict({"routeId": "route-1"})])
+
+    assert np.isnan(batch.departure[0])
+    assert np.isnan(batch.scheduled_departure[0])
+
+
+def test_empty():
+    """An empty batch returns empty results."""
+    batch = DepartureBatch([])
+
+    rows = batch.unique(batch.at_stops({"stop-0"}))
+
+    assert batch.departures(rows) == []
+    assert list(batch.group(rows, {("route-1", "0")}, 10)[("route-1", "0")]) == []
+
+
+def test_at_stops():
+    """Only rows of the given stops are returned, unknown stops match nothing."""
+    batch = DepartureBatch(
+        [_departure("route-1", f"trip-{i}", f"stop-{i % 3}") for i in range(9)]
+    )
+
+    assert list(batch.at_stops({"stop-1", "stop-9"})) == [1, 4, 7]
+    assert list(batch.at_stops({"stop-9"})) == []
+
+
+def test_unique_keeps_first_occurrence():
+    """Duplicates are removed, the order of first occurrences is kept."""
+    departures = [
+        _departure("route-1", "trip-2", minute=2),
+        _departure("route-1", "trip-1", minute=1),
+        _departure("route-1", "trip-2", minute=2),
+        # Same trip, other departure time (delayed)
+        _departure("route-1", "trip-1", minute=3),
+        Departure.from_dict({"routeId": "route-1"}),
+        Departure.from_dict({"routeId": "route-1"}),
+    ]
+    batch = DepartureBatch(departures)
+
+    rows = batch.unique(np.arange(len(batch)))
+
+    assert list(rows) == [0, 1, 3, 4]
+
+
+def test_unique_compares_all_fields():
+    """Departures differing in any field are kept, as by `unique_departures`."""
+    first = _departure("route-1", "trip-1")
+    departures = [
+        first,
+        dataclasses.replace(first, track="2"),
+        dataclasses.replace(first, cancelled=True),
+        dataclasses.replace(first, head_sign="Umleitung"),
+        dataclasses.replace(first, cancelled=True),
+    ]
+    batch = DepartureBatch(departures)
+
+    rows = batch.unique(np.arange(len(batch)))
+
+    assert list(rows) == [0, 1, 2, 3]
+    assert batch.departures(rows) == unique_departures(departures, {"stop-0"})
+
+
+def test_group_suffix_match_and_limit():
+    """Lines match routes by suffix, every group holds at most `limit` rows."""
+    departures = [
+        _departure(f"de-DELFI_{i % 2}", f"trip-{i}", minute=i) for i in range(10)
+    ]
+    batch = DepartureBatch(departures)
+
+    groups = batch.group(np.arange(10), {("0", "0"), ("1", "1"), ("9", "0")}, 3)
+
+    assert batch.departures(groups[("0", "0")]) == departures[0:6:2]
+    assert list(groups[("1", "1")]) == []
+    assert list(groups[("9", "0")]) == []
+
+
+def test_has_flag():
+    """Rows are masked by their flags."""
+    batch = DepartureBatch(
+        [
+            _departure("route-1", "trip-1", realTime=True, cancelled=True),
+            _departure("route-1", "trip-2", realTime=True),
+            _departure("route-1", "trip-3"),
+        ]
+    )
+
+    rows = np.arange(3)
+
+    assert list(batch.has_flag(rows, DepartureFlag.REAL_TIME)) == [True, True, False]
+    assert list(
+        batch.has_flag(rows, DepartureFlag.REAL_TIME | DepartureFlag.CANCELLED)
+    ) == [True, False, False]
@@ -0,0 +1,63 @@
+"""Tests for the Motis API endpoints."""
+
+from custom_components.ha_departures.api.circuit_breaker import CircuitBreaker
+from custom_components.ha_departures.api.endpoint import Endpoint
+from custom_components.ha_departures.api.latency import LatencyTracker
+from custom_components.ha_departures.api.rate_limiter import TokenBucket
+
+
+def _endpoint(*latencies: float) -> Endpoint:
+    endpoint = Endpoint(
+        "http://test.api",
+        TokenBucket(rate=1, burst=1, min_rate=0.1),
+        CircuitBreaker(threshold=3, reset_timeout=60, max_reset_timeout=600),
+        LatencyTracker(samples=10, min_samples=2),
+        samples=4,
+    )
+
+    for latency in latencies:
+        endpoint.latency.record(latency)
+
+    return endpoint
+
+
+def test_score_unknown_latency():  # noqa: D103
+    assert _endpoint(0.5).score == 0
+
+
+def test_score_median_latency():  # noqa: D103
+    assert _endpoint(0.2, 0.4, 9.0).score == 0.4
+
+
+def test_score_penalizes_failures():  # noqa: D103
+    endpoint = _endpoint(0.2, 0.2)
+
+    endpoint.on_success()
+    endpoint.on_failure()
+
+    assert endpoint.error_rate == 0.5
+    assert endpoint.score == 0.4
+    assert endpoint.requests == 2
+    assert endpoint.failures == 1
+
+
+def test_error_rate_of_recent_requests():  # noqa: D103
+    endpoint = _endpoint()
+
+    for _ in range(2):
+        endpoint.on_failure()
+
+    for _ in range(4):
+        endpoint.on_success()
+
+    assert endpoint.error_rate == 0
+    assert endpoint.available
+
+
+def test_failures_open_circuit():  # noqa: D103
+    endpoint = _endpoint()
+
+    for _ in range(3):
+        endpoint.on_failure()
+
+    assert not endpoint.available
@@ -0,0 +1,36 @@
+"""Tests for the latency statistics."""
+
+from custom_components.ha_departures.api.latency import LatencyTracker
+
+
+def test_percentile_needs_min_samples():  # noqa: D103
+    tracker = LatencyTracker(samples=10, min_samples=3)
+    tracker.record(1.0)
+    tracker.record(2.0)
+
+    assert tracker.percentile(0.95) is None
+
+    tracker.record(3.0)
+
+    assert tracker.percentile(0.95) == 3.0
+
+
+def test_percentile():  # noqa: D103
+    tracker = LatencyTracker(samples=100, min_samples=1)
+
+    for i in range(100, 0, -1):
+        tracker.record(i / 100)
+
+    assert tracker.percentile(0.95) == 0.95
+    assert tracker.percentile(0.5) == 0.5
+    assert tracker.percentile(0) == 0.01
+
+
+def test_keeps_recent_samples():  # noqa: D103
+    tracker = LatencyTracker(samples=3, min_samples=1)
+
+    for latency in (9.0, 1.0, 1.0, 1.0):
+        tracker.record(latency)
+
+    assert len(tracker) == 3
+    assert tracker.percentile(1.0) == 1.0
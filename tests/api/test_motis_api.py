@@ -1,16 +1,45 @@
 """Tests for the Motis API client."""
 
+import asyncio
+import json
+import threading
+import time
+
 import pytest
-from aiohttp import ClientError, ClientResponseError
-from aioresponses import aioresponses
+import pytest_asyncio
+from aiohttp import ClientError, ClientResponseError, ClientSession
+from aioresponses import CallbackResult, aioresponses
+from yarl import URL
 
+from custom_components.ha_departures.api import motis_api
+from custom_components.ha_departures.api.circuit_breaker import (
+    CircuitOpenError,
+    CircuitState,
+)
 from custom_components.ha_departures.api.data_classes import ApiCommand
-from custom_components.ha_departures.api.motis_api import MotisApi
+from custom_components.ha_departures.api.decoder import StopTimesParser
+from custom_components.ha_departures.api.motis_api import (
+    DeadlineExceededError,
+    MotisApi,
+    _feed_in_executor,
+    _retry_wait,
+    request_key,
+)
+from custom_components.ha_departures.api.response_cache import UNCHANGED
+from custom_components.ha_departures.const import (
+    REQUEST_BACKOFF_BASE,
+    REQUEST_BACKOFF_MAX,
+)
 
 
-@pytest.fixture
-def mock_api():  # noqa: D103
-    return MotisApi(base_url="http://test.api")
+@pytest_asyncio.fixture
+async def mock_api():  # noqa: D103
+    # Every test starts with a closed circuit breaker and a full rate limiter
+    motis_api._ENDPOINTS.pop("http://test.api", None)
+    motis_api._LIMITERS.pop("http://test.api", None)
+    api = MotisApi(base_url="http://test.api")
+    yield api
+    await api.close()
 
 
 @pytest.mark.asyncio
@@ -110,3 +139,463 @@ async def test_get_max_retries_exceeded(mock_api, command):  # noqa: D103
 
         with pytest.raises(ClientResponseError):
             await mock_api.get(command, params, retry=1)  # Set retry to 1 for testing
+
+
+@pytest.mark.asyncio
+async def test_get_reuses_session(mock_api):  # noqa: D103
+    with aioresponses() as mocked:
+        mocked.get(
+            f"http://test.api/{ApiCommand.STOPS.value}",
+            payload={"data": "value"},
+            repeat=True,
+        )
+
+        await mock_api.get(ApiCommand.STOPS)
+        session = mock_api.session
+        await mock_api.get(ApiCommand.STOPS)
+
+    assert session is not None
+    assert mock_api.session is session
+
+
+@pytest.mark.asyncio
+async def test_close_keeps_external_session():  # noqa: D103
+    async with ClientSession() as session:
+        api = MotisApi(base_url="http://test.api", session=session)
+        await api.close()
+
+        assert not session.closed
+
+
+@pytest.mark.asyncio
+async def test_close_own_session(mock_api):  # noqa: D103
+    with aioresponses() as mocked:
+        mocked.get(f"http://test.api/{ApiCommand.STOPS.value}", payload={})
+        await mock_api.get(ApiCommand.STOPS)
+
+    session = mock_api.session
+    await mock_api.close()
+
+    assert session.closed
+    assert mock_api.session is None
+
+
+@pytest.mark.asyncio
+async def test_get_with_parser(mock_api):  # noqa: D103
+    with aioresponses() as mocked:
+        mocked.get(
+            f"http://test.api/{ApiCommand.STOP_TIMES.value}",
+            body=b'{"stopTimes": [{"routeId": "1"}, {"routeId": "2"}]}',
+        )
+
+        result = await mock_api.get(
+            ApiCommand.STOP_TIMES,
+            parser=lambda: StopTimesParser(lambda x: x["routeId"] == "2"),
+        )
+
+    assert [d.route_id for d in result.departures] == ["2"]
+    assert result.skipped == 1
+
+
+class _ThreadParser(StopTimesParser):
+    """Parser recording the threads it is called in."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.threads: set[int] = set()
+
+    def feed(self, chunk: bytes) -> None:
+        self.threads.add(threading.get_ident())
+        super().feed(chunk)
+
+    def close(self) -> StopTimesParser:
+        self.threads.add(threading.get_ident())
+        return super().close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("conditional", [False, True])
+async def test_get_parser_in_executor(mock_api, conditional):  # noqa: D103
+    with aioresponses() as mocked:
+        mocked.get(
+            f"http://test.api/{ApiCommand.STOP_TIMES.value}",
+            body=b'{"stopTimes": [{"routeId": "1"}, {"routeId": "2"}]}',
+        )
+
+        result = await mock_api.get(
+            ApiCommand.STOP_TIMES, parser=_ThreadParser, conditional=conditional
+        )
+
+    assert [d.route_id for d in result.departures] == ["1", "2"]
+    assert result.threads
+    assert threading.get_ident() not in result.threads
+
+
+@pytest.mark.asyncio
+async def test_feed_in_executor_keeps_order():  # noqa: D103
+    body = json.dumps({"stopTimes": [{"routeId": str(i)} for i in range(200)]}).encode()
+    received = []
+
+    async def chunks():
+        for i in range(0, len(body), 7):
+            yield body[i : i + 7]
+            await asyncio.sleep(0)
+
+    stream = StopTimesParser()
+    await _feed_in_executor(stream, chunks(), received.append)
+
+    assert b"".join(received) == body
+    assert [d.route_id for d in stream.close().departures] == [
+        str(i) for i in range(200)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_get_parser_error(mock_api):  # noqa: D103
+    with aioresponses() as mocked:
+        mocked.get(
+            f"http://test.api/{ApiCommand.STOP_TIMES.value}",
+            body=b'{"stopTimes": [1]}',
+        )
+
+        with pytest.raises(ValueError):
+            await mock_api.get(ApiCommand.STOP_TIMES, parser=StopTimesParser)
+
+
+@pytest.mark.asyncio
+async def test_get_conditional_unchanged_body(mock_api):  # noqa: D103
+    url = f"http://test.api/{ApiCommand.STOP_TIMES.value}"
+    parsed = []
+
+    def parser():
+        parsed.append(StopTimesParser())
+        return parsed[-1]
+
+    with aioresponses() as mocked:
+        for body in (
+            b'{"stopTimes": []}',
+            b'{"stopTimes": []}',
+            b'{"stopTimes": [{}]}',
+        ):
+            mocked.get(url, body=body)
+
+        first = await mock_api.get(
+            ApiCommand.STOP_TIMES, parser=parser, conditional=True
+        )
+        second = await mock_api.get(
+            ApiCommand.STOP_TIMES, parser=parser, conditional=True
+        )
+        third = await mock_api.get(
+            ApiCommand.STOP_TIMES, parser=parser, conditional=True
+        )
+
+    assert first.departures == []
+    assert second is UNCHANGED
+    assert len(third.departures) == 1
+    # The unchanged body is streamed into a parser, but its result discarded
+    assert len(parsed) == 3
+    assert mock_api.responses.requests == 3
+    assert mock_api.responses.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_get_conditional_etag(mock_api):  # noqa: D103
+    url = f"http://test.api/{ApiCommand.STOPS.value}?lat=1"
+
+    with aioresponses() as mocked:
+        mocked.get(url, payload={"data": 1}, headers={"ETag": '"v1"'})
+        mocked.get(url, status=304)
+
+        first = await mock_api.get(ApiCommand.STOPS, {"lat": "1"}, conditional=True)
+        second = await mock_api.get(ApiCommand.STOPS, {"lat": "1"}, conditional=True)
+
+        requests = mocked.requests[("GET", URL(url))]
+
+    assert first == {"data": 1}
+    assert second is UNCHANGED
+    assert "If-None-Match" not in requests[0].kwargs["headers"]
+    assert requests[1].kwargs["headers"]["If-None-Match"] == '"v1"'
+    assert mock_api.responses.not_modified == 1
+    assert mock_api.responses.hit_rate == 0.5
+
+
+@pytest.mark.asyncio
+async def test_get_conditional_forget(mock_api):  # noqa: D103
+    url = f"http://test.api/{ApiCommand.STOPS.value}"
+
+    with aioresponses() as mocked:
+        mocked.get(url, payload={"data": 1}, repeat=True)
+
+        await mock_api.get(ApiCommand.STOPS, conditional=True)
+        mock_api.responses.forget(request_key(ApiCommand.STOPS, None))
+
+        assert await mock_api.get(ApiCommand.STOPS, conditional=True) == {"data": 1}
+
+
+@pytest.mark.asyncio
+async def test_get_deadline_stops_retries(mock_api):  # noqa: D103
+    url = f"http://test.api/{ApiCommand.STOPS.value}"
+
+    with aioresponses() as mocked:
+        mocked.get(url, status=503, repeat=True)
+
+        started = time.monotonic()
+
+        # The backoff (>= 2.5s) would exceed the deadline, no retry is sent
+        with pytest.raises(ClientResponseError):
+            await mock_api.get(ApiCommand.STOPS, retry=3, deadline=started + 1)
+
+    assert time.monotonic() - started < 1
+    assert len(mocked.requests[("GET", URL(url))]) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_deadline_expired(mock_api):  # noqa: D103
+    with pytest.raises(DeadlineExceededError):
+        await mock_api.get(ApiCommand.STOPS, deadline=time.monotonic() - 1)
+
+    # Not sent, so not a failure of the endpoint
+    assert mock_api.endpoints[0].failures == 0
+
+
+@pytest.mark.asyncio
+async def test_get_deadline_expired_in_limiter(mock_api):  # noqa: D103
+    limiter = mock_api.endpoints[0].limiter
+
+    # No token left for the next second
+    limiter.on_throttled(1)
+
+    with pytest.raises(DeadlineExceededError):
+        await mock_api.get(ApiCommand.STOPS, deadline=time.monotonic() + 0.05)
+
+    assert mock_api.endpoints[0].failures == 0
+    assert mock_api.endpoints[0].breaker.state is CircuitState.CLOSED
+
+
+@pytest.mark.parametrize("attempt", [0, 1, 2, 5])
+def test_retry_wait_jitter(attempt):  # noqa: D103
+    backoff = min(REQUEST_BACKOFF_MAX, REQUEST_BACKOFF_BASE * 2**attempt)
+    waits = {_retry_wait(attempt, None, None) for _ in range(20)}
+
+    assert all(backoff / 2 <= wait <= backoff for wait in waits)
+    assert len(waits) > 1
+
+
+def test_retry_wait_retry_after():  # noqa: D103
+    assert _retry_wait(0, 30.0, None) == 30.0
+    assert _retry_wait(0, 30.0, time.monotonic() + 10) is None
+
+
+@pytest.mark.asyncio
+async def test_get_hedged(mock_api, monkeypatch):  # noqa: D103
+    monkeypatch.setattr(motis_api, "REQUEST_HEDGE_MIN_DELAY", 0.05)
+    url = f"http://test.api/{ApiCommand.STOPS.value}"
+
+    for _ in range(mock_api.endpoints[0].latency.min_samples):
+        mock_api.endpoints[0].latency.record(0.01)
+
+    calls = []
+
+    async def respond(url, **kwargs):
+        calls.append(url)
+
+        # Only the first request is slow
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+            return CallbackResult(payload={"response": "slow"})
+
+        return CallbackResult(payload={"response": "fast"})
+
+    with aioresponses() as mocked:
+        mocked.get(url, callback=respond, repeat=True)
+
+        started = time.monotonic()
+        result = await mock_api.get(ApiCommand.STOPS, hedge=True)
+
+    assert result == {"response": "fast"}
+    assert time.monotonic() - started < 1
+    assert mock_api.hedged == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("results", [[UNCHANGED, "changed"], ["changed", UNCHANGED]])
+async def test_send_hedged_prefers_changed(mock_api, results):  # noqa: D103
+    responded = asyncio.Event()
+    pending = iter(results)
+
+    async def send():
+        result = next(pending)
+        await responded.wait()
+        return result
+
+    # Both requests are answered at once after the hedged one was sent
+    asyncio.get_running_loop().call_later(0.05, responded.set)
+
+    assert await mock_api._MotisApi__send_hedged(send, 0.01) == "changed"
+
+
+@pytest.mark.asyncio
+async def test_get_hedged_fast_response(mock_api):  # noqa: D103
+    url = f"http://test.api/{ApiCommand.STOPS.value}"
+
+    for _ in range(mock_api.endpoints[0].latency.min_samples):
+        mock_api.endpoints[0].latency.record(0.01)
+
+    with aioresponses() as mocked:
+        mocked.get(url, payload={"response": "fast"})
+
+        assert await mock_api.get(ApiCommand.STOPS, hedge=True) == {"response": "fast"}
+
+    assert mock_api.hedged == 0
+
+
+@pytest.mark.asyncio
+async def test_get_circuit_breaker(mock_api):  # noqa: D103
+    url = f"http://test.api/{ApiCommand.STOPS.value}"
+
+    with aioresponses() as mocked:
+        mocked.get(url, status=503, repeat=True)
+
+        for _ in range(mock_api.endpoints[0].breaker.threshold):
+            with pytest.raises(ClientResponseError):
+                await mock_api.get(ApiCommand.STOPS)
+
+        # No request is sent while the circuit is open
+        with pytest.raises(CircuitOpenError):
+            await mock_api.get(ApiCommand.STOPS)
+
+    assert mock_api.endpoints[0].breaker.state is CircuitState.OPEN
+    assert (
+        len(mocked.requests[("GET", URL(url))])
+        == mock_api.endpoints[0].breaker.threshold
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_circuit_breaker_ignores_client_errors(mock_api):  # noqa: D103
+    url = f"http://test.api/{ApiCommand.STOPS.value}"
+
+    with aioresponses() as mocked:
+        mocked.get(url, status=404, repeat=True)
+
+        for _ in range(mock_api.endpoints[0].breaker.threshold):
+            with pytest.raises(ClientResponseError):
+                await mock_api.get(ApiCommand.STOPS)
+
+    assert mock_api.endpoints[0].breaker.state is CircuitState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_get_probe_invalid_body(mock_api):  # noqa: D103
+    breaker = mock_api.endpoints[0].breaker
+
+    for _ in range(breaker.threshold):
+        breaker.on_failure()
+
+    # Probe is due
+    breaker._opened_at -= breaker.reset_timeout
+
+    with aioresponses() as mocked:
+        mocked.get(
+            f"http://test.api/{ApiCommand.STOPS.value}",
+            body="<html>Bad gateway</html>",
+            status=200,
+        )
+
+        with pytest.raises(ValueError):
+            await mock_api.get(ApiCommand.STOPS)
+
+    # The failed probe opens the circuit again instead of blocking it
+    assert breaker.state is CircuitState.OPEN
+    assert breaker.opened == 2
+    assert mock_api.endpoints[0].failures == 1
+
+
+@pytest_asyncio.fixture
+async def mirrored_api():  # noqa: D103
+    for base_url in ("http://primary.api", "http://mirror.api"):
+        motis_api._ENDPOINTS.pop(base_url, None)
+
+    api = MotisApi(base_url=["http://primary.api", "http://mirror.api"])
+    yield api
+    await api.close()
+
+
+@pytest.mark.asyncio
+async def test_get_fails_over(mirrored_api):  # noqa: D103
+    primary = f"http://primary.api/{ApiCommand.STOPS.value}"
+    mirror = f"http://mirror.api/{ApiCommand.STOPS.value}"
+
+    with aioresponses() as mocked:
+        mocked.get(primary, status=503)
+        mocked.get(mirror, payload={"response": "mirror"})
+
+        # The primary endpoint is not retried while the mirror is available
+        result = await mirrored_api.get(ApiCommand.STOPS, retry=3)
+
+    assert result == {"response": "mirror"}
+    assert len(mocked.requests[("GET", URL(primary))]) == 1
+    assert [e.failures for e in mirrored_api.endpoints] == [1, 0]
+
+
+@pytest.mark.asyncio
+async def test_get_prefers_fastest_endpoint(mirrored_api):  # noqa: D103
+    primary, mirror = mirrored_api.endpoints
+
+    for _ in range(primary.latency.min_samples):
+        primary.latency.record(0.5)
+        mirror.latency.record(0.1)
+
+    with aioresponses() as mocked:
+        mocked.get(
+            f"http://mirror.api/{ApiCommand.STOPS.value}",
+            payload={"response": "mirror"},
+        )
+
+        assert await mirrored_api.get(ApiCommand.STOPS) == {"response": "mirror"}
+
+
+@pytest.mark.asyncio
+async def test_get_skips_open_circuit(mirrored_api):  # noqa: D103
+    primary, _ = mirrored_api.endpoints
+
+    for _ in range(primary.breaker.threshold):
+        primary.on_failure()
+
+    with aioresponses() as mocked:
+        mocked.get(
+            f"http://mirror.api/{ApiCommand.STOPS.value}",
+            payload={"response": "mirror"},
+        )
+
+        assert await mirrored_api.get(ApiCommand.STOPS) == {"response": "mirror"}
+
+    assert mirrored_api.available
+
+
+@pytest.mark.asyncio
+async def test_get_all_endpoints_failed(mirrored_api):  # noqa: D103
+    with aioresponses() as mocked:
+        mocked.get(f"http://primary.api/{ApiCommand.STOPS.value}", status=503)
+        mocked.get(f"http://mirror.api/{ApiCommand.STOPS.value}", status=502)
+
+        with pytest.raises(ClientResponseError) as e:
+            await mirrored_api.get(ApiCommand.STOPS)
+
+    assert e.value.status == 502
+
+
+def test_set_endpoints(mirrored_api):  # noqa: D103
+    mirrored_api.set_endpoints(
+        ["http://mirror.api", "http://primary.api", "http://mirror.api"]
+    )
+
+    assert mirrored_api.base_url == "http://mirror.api"
+    assert [e.base_url for e in mirrored_api.endpoints] == [
+        "http://mirror.api",
+        "http://primary.api",
+    ]
+    assert mirrored_api.endpoints[0] is motis_api.get_endpoint("http://mirror.api")
+
+    with pytest.raises(ValueError):
+        mirrored_api.set_endpoints([])
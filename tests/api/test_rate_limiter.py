@@ -0,0 +1,116 @@
+"""Tests for the Motis API rate limiter."""
+
+import time
+from email.utils import format_datetime
+
+import pytest
+from aioresponses import aioresponses
+from homeassistant.util import dt as dt_util
+
+from custom_components.ha_departures.api.data_classes import ApiCommand
+from custom_components.ha_departures.api.motis_api import MotisApi
+from custom_components.ha_departures.api.rate_limiter import (
+    TokenBucket,
+    parse_retry_after,
+)
+
+
+@pytest.mark.asyncio
+async def test_acquire_within_burst():  # noqa: D103
+    limiter = TokenBucket(rate=1, burst=5, min_rate=0.1)
+
+    start = time.monotonic()
+    for _ in range(5):
+        await limiter.acquire()
+
+    assert time.monotonic() - start < 0.1
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_refill():  # noqa: D103
+    limiter = TokenBucket(rate=20, burst=1, min_rate=0.1)
+
+    start = time.monotonic()
+    for _ in range(3):
+        await limiter.acquire()
+
+    assert time.monotonic() - start >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_retry_after():  # noqa: D103
+    limiter = TokenBucket(rate=10, burst=5, min_rate=0.1)
+    limiter.on_throttled(retry_after=0.1)
+
+    start = time.monotonic()
+    await limiter.acquire()
+
+    assert time.monotonic() - start >= 0.09
+
+
+def test_on_throttled_decreases_rate():  # noqa: D103
+    limiter = TokenBucket(rate=2, burst=5, min_rate=0.5)
+
+    limiter.on_throttled()
+    assert limiter.rate == 1
+
+    limiter.on_throttled()
+    limiter.on_throttled()
+    assert limiter.rate == 0.5
+    assert limiter.throttled == 3
+
+
+def test_on_success_increases_rate():  # noqa: D103
+    limiter = TokenBucket(rate=2, burst=5, min_rate=0.5)
+    limiter.on_throttled()
+
+    limiter.on_success()
+    assert limiter.rate == 1.5
+
+    for _ in range(5):
+        limiter.on_success()
+    assert limiter.rate == 2
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [(None, None), ("", None), ("120", 120), ("-5", 0), ("soon", None)],
+)
+def test_parse_retry_after(value, expected):  # noqa: D103
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():  # noqa: D103
+    date = format_datetime(dt_util.utcnow().replace(microsecond=0), usegmt=True)
+
+    assert parse_retry_after(date) == pytest.approx(0, abs=2)
+
+
+@pytest.mark.asyncio
+async def test_get_honors_retry_after():  # noqa: D103
+    api = MotisApi(base_url="http://throttled.api")
+    url = f"http://throttled.api/{ApiCommand.STOPS.value}"
+
+    with aioresponses() as mocked:
+        mocked.get(url, status=429, headers={"Retry-After": "0.1"})
+        mocked.get(url, payload={"data": "value"}, status=200)
+
+        start = time.monotonic()
+        result = await api.get(ApiCommand.STOPS, retry=1)
+
+    assert result == {"data": "value"}
+    assert time.monotonic() - start >= 0.09
+    assert api.endpoints[0].limiter.throttled == 1
+
+    await api.close()
+
+
+def test_limiter_shared_per_base_url():  # noqa: D103
+    assert (
+        MotisApi("http://a.api").endpoints[0].limiter
+        is MotisApi("http://a.api").endpoints[0].limiter
+    )
+    assert (
+        MotisApi("http://a.api").endpoints[0].limiter
+        is not MotisApi("http://b.api").endpoints[0].limiter
+    )
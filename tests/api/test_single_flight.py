@@ -0,0 +1,106 @@
+"""Tests for coalescing of identical in-flight requests."""
+
+import asyncio
+
+import pytest
+from aioresponses import aioresponses
+
+from custom_components.ha_departures.api.data_classes import ApiCommand
+from custom_components.ha_departures.api.motis_api import MotisApi, request_key
+from custom_components.ha_departures.api.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_do_coalesces_concurrent_calls():  # noqa: D103
+    group = SingleFlight()
+    started = 0
+
+    async def call():
+        nonlocal started
+        started += 1
+        await asyncio.sleep(0.01)
+        return {"data": "value"}
+
+    results = await asyncio.gather(*(group.do("key", call) for _ in range(5)))
+
+    assert started == 1
+    assert all(r is results[0] for r in results)
+    assert group.calls == 5
+    assert group.coalesced == 4
+    assert group.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_do_runs_again_after_completion():  # noqa: D103
+    group = SingleFlight()
+
+    async def call():
+        return object()
+
+    first = await group.do("key", call)
+    second = await group.do("key", call)
+
+    assert first is not second
+    assert group.coalesced == 0
+
+
+@pytest.mark.asyncio
+async def test_do_shares_exceptions():  # noqa: D103
+    group = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    results = await asyncio.gather(
+        group.do("key", call), group.do("key", call), return_exceptions=True
+    )
+
+    assert all(isinstance(r, ValueError) for r in results)
+    assert group.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_do_cancelled_caller_keeps_call_running():  # noqa: D103
+    group = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        return "value"
+
+    first = asyncio.ensure_future(group.do("key", call))
+    second = asyncio.ensure_future(group.do("key", call))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "value"
+
+
+def test_request_key_normalizes_params():  # noqa: D103
+    assert request_key(ApiCommand.STOP_TIMES, {"n": 10, "stopId": "a"}) == (
+        request_key(ApiCommand.STOP_TIMES, {"stopId": "a", "n": "10"})
+    )
+    assert request_key(ApiCommand.STOPS, None) == request_key(ApiCommand.STOPS, {})
+    assert request_key(ApiCommand.STOPS, {}) != request_key(ApiCommand.STOP_TIMES, {})
+
+
+@pytest.mark.asyncio
+async def test_get_coalesces_identical_requests():  # noqa: D103
+    flow_api = MotisApi(base_url="http://coalesce.api")
+    hub_api = MotisApi(base_url="http://coalesce.api")
+    url = f"http://coalesce.api/{ApiCommand.STOP_TIMES.value}?n=10&stopId=a"
+
+    with aioresponses() as mocked:
+        # Registered once, a second request would fail
+        mocked.get(url, payload={"stopTimes": []}, status=200)
+
+        results = await asyncio.gather(
+            flow_api.get(ApiCommand.STOP_TIMES, {"stopId": "a", "n": "10"}),
+            hub_api.get(ApiCommand.STOP_TIMES, {"n": "10", "stopId": "a"}),
+        )
+
+    assert results == [{"stopTimes": []}, {"stopTimes": []}]
+    assert flow_api.single_flight.coalesced == 1
+
+    await flow_api.close()
+    await hub_api.close()
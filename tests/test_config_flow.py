@@ -0,0 +1,94 @@
+"""Tests for the config flow."""
+
+import re
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+import pytest_asyncio
+from aioresponses import CallbackResult, aioresponses
+
+from custom_components.ha_departures.api import motis_api
+from custom_components.ha_departures.api.data_classes import ApiCommand, Stop
+from custom_components.ha_departures.api.motis_api import MotisApi
+from custom_components.ha_departures.config_flow import DeparturesFlowHandler
+from custom_components.ha_departures.const import CONF_LINES, CONF_STOP_NAME, DOMAIN
+from custom_components.ha_departures.hub import DomainData
+
+
+@pytest_asyncio.fixture
+async def api():
+    """Return a client of a test server with a closed circuit breaker."""
+    motis_api._ENDPOINTS.pop("http://test.api", None)
+    motis_api._LIMITERS.pop("http://test.api", None)
+    api = MotisApi(base_url="http://test.api")
+    yield api
+    await api.close()
+
+
+@pytest.fixture
+def flow(api):
+    """Return a config flow of a Home Assistant instance using `api`."""
+    flow = DeparturesFlowHandler()
+    flow.hass = SimpleNamespace(
+        data={DOMAIN: DomainData(client=api, store=MagicMock())}
+    )
+    flow.flow_id = "test"
+    flow.handler = DOMAIN
+
+    return flow
+
+
+@pytest.mark.asyncio
+async def test_step_stop_keeps_lines_of_other_stops(api, flow):
+    """A stop failing to return stop times drops only its own lines."""
+    flow._all_stops = [
+        Stop(id="s1", name="Hbf", latitude=49.4, longitude=11.0),
+        Stop(id="s2", name="Hbf", latitude=49.4, longitude=11.0),
+        Stop(id="s3", name="Hbf", latitude=49.4, longitude=11.0),
+    ]
+    stop_times = {
+        "s1": {
+            "stopTimes": [
+                {
+                    "routeId": "r1",
+                    "directionId": "0",
+                    "headsign": "Nord",
+                    "routeShortName": "1",
+                    "mode": "BUS",
+                }
+            ]
+        },
+        "s3": {
+            "stopTimes": [
+                {
+                    "routeId": "r3",
+                    "directionId": "1",
+                    "headsign": "Süd",
+                    "routeShortName": "3",
+                    "mode": "TRAM",
+                }
+            ]
+        },
+    }
+
+    def callback(url, **kwargs):
+        if (body := stop_times.get(url.query["stopId"])) is None:
+            return CallbackResult(status=404, reason="Not Found")
+
+        return CallbackResult(payload=body)
+
+    with aioresponses() as mocked:
+        mocked.get(
+            re.compile(rf"{api.base_url}/{ApiCommand.STOP_TIMES.value}\?.*"),
+            callback=callback,
+            repeat=True,
+        )
+
+        result = await flow.async_step_stop({CONF_STOP_NAME: "Hbf"})
+
+    assert result["step_id"] == "lines"
+    assert not result["errors"]
+
+    options = result["data_schema"].schema[CONF_LINES].config["options"]
+    assert sorted(x["value"] for x in options) == ["r1---0", "r3---1"]
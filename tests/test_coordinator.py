@@ -0,0 +1,451 @@
+"""Tests for the departures coordinator helpers."""
+
+import asyncio
+import dataclasses
+import logging
+import timeit
+from datetime import timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import pytest_asyncio
+from homeassistant.helpers.update_coordinator import UpdateFailed
+from homeassistant.util import dt as dt_util
+
+from custom_components.ha_departures import coordinator as coordinator_module
+from custom_components.ha_departures.api.circuit_breaker import CircuitOpenError
+from custom_components.ha_departures.api.data_classes import Departure
+from custom_components.ha_departures.api.departure_batch import DepartureBatch
+from custom_components.ha_departures.const import (
+    CONF_LINES,
+    CONF_STOP_IDS,
+    DEPARTURE_BATCH_MIN_SUBSCRIBERS,
+    DOMAIN,
+    UPDATE_INTERVAL,
+    UPDATE_INTERVAL_MAX,
+    UPDATE_INTERVAL_MIN,
+)
+from custom_components.ha_departures.coordinator import (
+    DeparturesDataUpdateCoordinator,
+    index_departures,
+    next_update_interval,
+    process_batch,
+    unique_departures,
+)
+from custom_components.ha_departures.hub import DomainData
+
+_LOGGER = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# Fixtures / helpers
+# ---------------------------------------------------------------------------
+
+NOW = dt_util.now()
+
+
+def _departures(count: int, stops: int = 3) -> list[Departure]:
+    """Return `count` departures, every second one duplicates its predecessor."""
+    return [
+        Departure.from_dict(
+            {
+                "routeId": f"route-{i // 2 % 15}",
+                "directionId": "0",
+                "tripId": f"trip-{i // 2}",
+                "headsign": "Hauptbahnhof",
+                "place": {
+                    "stopId": f"stop-{i // 2 % stops}",
+                    "departure": f"2024-06-01T10:{i // 2 % 60:02d}:00Z",
+                    "scheduledDeparture": f"2024-06-01T10:{i // 2 % 60:02d}:00Z",
+                },
+            }
+        )
+        for i in range(count)
+    ]
+
+
+def _departure_in(minutes: float, real_time: bool = False, **kwargs) -> Departure:
+    """Return a departure leaving `minutes` after NOW."""
+    return Departure(
+        route_id="r1",
+        direction_id="0",
+        trip_id="t1",
+        stop_id="s1",
+        departure=NOW + timedelta(minutes=minutes),
+        head_sign="Ziel",
+        scheduled_departure=NOW + timedelta(minutes=minutes),
+        real_time=real_time,
+        **kwargs,
+    )
+
+
+# ---------------------------------------------------------------------------
+# unique_departures
+# ---------------------------------------------------------------------------
+
+
+def test_unique_departures_removes_duplicates():
+    """Duplicates are removed, the first occurrence is kept."""
+    departures = _departures(10, stops=1)
+
+    result = unique_departures(departures, {"stop-0"})
+
+    assert len(result) == 5
+    assert all(a is b for a, b in zip(result, departures[::2], strict=True))
+
+
+def test_unique_departures_filters_stops():
+    """Only departures at the given stops are returned."""
+    result = unique_departures(_departures(60), {"stop-1"})
+
+    assert result
+    assert {d.stop_id for d in result} == {"stop-1"}
+
+
+def test_unique_departures_keeps_order():
+    """Order of the departures is preserved."""
+    departures = _departures(100, stops=1)
+
+    result = unique_departures(reversed(departures), {"stop-0"})
+
+    assert [d.trip_id for d in result] == [d.trip_id for d in departures[::-2]]
+
+
+def test_unique_departures_empty():
+    """Empty input returns an empty list."""
+    assert unique_departures([], {"stop-0"}) == []
+
+
+def test_unique_departures_compares_duplicates_only(monkeypatch):
+    """Departures are only compared to a previous one with the same hash.
+
+    A list scan compares every departure with all kept ones, ~12.5 million
+    comparisons for 10,000 rows instead of one per duplicate.
+    """
+    departures = _departures(10_000)
+    eq = Departure.__eq__
+    calls = 0
+
+    def counting_eq(self, other):
+        nonlocal calls
+        calls += 1
+        return eq(self, other)
+
+    monkeypatch.setattr(Departure, "__eq__", counting_eq)
+
+    result = unique_departures(departures, {"stop-0", "stop-1", "stop-2"})
+
+    assert len(result) == 5_000
+    assert calls == 5_000
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize(("small", "large"), [(100, 10_000)])
+def test_unique_departures_scales_linear(small, large):
+    """Benchmark: processing time grows linear with the count of stop times.
+
+    A quadratic implementation needs ~10,000 times longer for 100 times more
+    rows, a linear one ~100 times. The limit leaves room for timing noise.
+    """
+    departures_small = _departures(small)
+    departures_large = _departures(large)
+    stop_ids = {"stop-0", "stop-1", "stop-2"}
+
+    time_small = min(
+        timeit.repeat(
+            lambda: unique_departures(departures_small, stop_ids), number=10, repeat=5
+        )
+    )
+    time_large = min(
+        timeit.repeat(
+            lambda: unique_departures(departures_large, stop_ids), number=10, repeat=5
+        )
+    )
+
+    assert time_large / time_small < (large / small) * 10
+
+
+# ---------------------------------------------------------------------------
+# index_departures
+# ---------------------------------------------------------------------------
+
+
+def test_index_departures_groups_by_line():
+    """Departures are grouped by (route id, direction id)."""
+    departures = _departures(60, stops=1)[::2]
+
+    index = index_departures(departures, {("route-1", "0"), ("route-2", "0")}, 10)
+
+    assert set(index) == {("route-1", "0"), ("route-2", "0")}
+    assert [d.trip_id for d in index[("route-1", "0")]] == [
+        d.trip_id for d in departures if d.route_id == "route-1"
+    ]
+
+
+def test_index_departures_suffix_match():
+    """Route ids of old config entries match departures by suffix."""
+    departure = Departure.from_dict({"routeId": "de-DELFI_42", "directionId": "1"})
+
+    index = index_departures([departure], {("42", "1"), ("42", "0")}, 10)
+
+    assert index[("42", "1")] == [departure]
+    assert index[("42", "0")] == []
+
+
+def test_index_departures_limit():
+    """Every group holds at most `limit` departures."""
+    departures = _departures(200, stops=1)[::2]
+
+    index = index_departures(departures, {("route-0", "0")}, 3)
+
+    assert len(index[("route-0", "0")]) == 3
+
+
+def test_index_departures_without_lines():
+    """Departures of lines not configured are not indexed."""
+    assert index_departures(_departures(10), set(), 10) == {}
+
+
+# ---------------------------------------------------------------------------
+# process_batch
+# ---------------------------------------------------------------------------
+
+
+def test_process_batch_equals_list_path():
+    """The columnar path returns the same departures as the list path."""
+    departures = _departures(2_000)
+    stop_ids = {"stop-0", "stop-2"}
+    line_keys = {("route-1", "0"), ("route-12", "0"), ("route-99", "0")}
+
+    expected = unique_departures(departures, stop_ids)
+
+    assert process_batch(DepartureBatch(departures), stop_ids, line_keys, 10) == (
+        expected,
+        index_departures(expected, line_keys, 10),
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("count", [200, 2_000, 20_000])
+def test_process_batch_benchmark(count):
+    """Benchmark: columnar operations vs the list of departures.
+
+    Building the batch costs more than processing the list once, the
+    operations on a built batch are cheaper for many rows only (measured
+    20,000 rows: list ~12ms, building ~40ms, operations ~3ms; 400 rows:
+    list ~0.4ms, building ~1.1ms, operations ~0.6ms). So a batch is only
+    shared by hubs with `DEPARTURE_BATCH_MIN_SUBSCRIBERS` subscribers and
+    `DEPARTURE_BATCH_MIN_ROWS` stop times.
+    """
+    departures = _departures(count)
+    stop_ids = {"stop-0", "stop-1"}
+    line_keys = {(f"route-{i}", "0") for i in range(8)}
+    batch = DepartureBatch(departures)
+
+    def list_path():
+        return index_departures(unique_departures(departures, stop_ids), line_keys, 10)
+
+    time_list = min(timeit.repeat(list_path, number=3, repeat=3)) / 3
+    time_build = (
+        min(timeit.repeat(lambda: DepartureBatch(departures), number=3, repeat=3)) / 3
+    )
+    time_ops = (
+        min(
+            timeit.repeat(
+                lambda: process_batch(batch, stop_ids, line_keys, 10),
+                number=3,
+                repeat=3,
+            )
+        )
+        / 3
+    )
+
+    _LOGGER.info(
+        "%s departures: list %.2fms, batch build %.2fms, batch operations %.2fms",
+        count,
+        time_list * 1000,
+        time_build * 1000,
+        time_ops * 1000,
+    )
+
+    if count >= 20_000:
+        assert time_ops < time_list
+
+
+# ---------------------------------------------------------------------------
+# next_update_interval
+# ---------------------------------------------------------------------------
+
+
+def test_next_update_interval_no_departures():
+    """Without upcoming departures the maximum interval is used."""
+    assert next_update_interval([], NOW) == timedelta(seconds=UPDATE_INTERVAL_MAX)
+    assert next_update_interval([_departure_in(-5)], NOW) == timedelta(
+        seconds=UPDATE_INTERVAL_MAX
+    )
+
+
+def test_next_update_interval_imminent_real_time():
+    """Imminent real-time departures shorten the interval."""
+    departures = [_departure_in(2, real_time=True), _departure_in(30)]
+
+    assert next_update_interval(departures, NOW) == timedelta(
+        seconds=UPDATE_INTERVAL_MIN
+    )
+
+
+def test_next_update_interval_imminent_scheduled():
+    """Imminent scheduled departures use the default interval."""
+    departures = [_departure_in(2), _departure_in(30, real_time=True)]
+
+    assert next_update_interval(departures, NOW) == timedelta(seconds=UPDATE_INTERVAL)
+
+
+def test_next_update_interval_ignores_cancelled():
+    """Cancelled departures are not taken into account."""
+    departures = [_departure_in(2, real_time=True, cancelled=True)]
+
+    assert next_update_interval(departures, NOW) == timedelta(
+        seconds=UPDATE_INTERVAL_MAX
+    )
+
+
+@pytest.mark.parametrize(
+    ("minutes", "seconds"),
+    [(12, UPDATE_INTERVAL), (20, 300), (180, UPDATE_INTERVAL_MAX)],
+)
+def test_next_update_interval_far_out(minutes, seconds):
+    """Departures far out stretch the interval."""
+    assert next_update_interval([_departure_in(minutes)], NOW) == timedelta(
+        seconds=seconds
+    )
+
+
+# ---------------------------------------------------------------------------
+# DeparturesDataUpdateCoordinator
+# ---------------------------------------------------------------------------
+
+
+@pytest_asyncio.fixture
+async def coordinator():
+    """Return a coordinator of line route-1 at stop-0 with a mocked hub."""
+    hass = MagicMock(loop=asyncio.get_running_loop())
+    hass.data = {DOMAIN: DomainData(client=MagicMock(), store=MagicMock())}
+
+    async def executor_job(target, *args):
+        return target(*args)
+
+    hass.async_add_executor_job = executor_job
+    entry = MagicMock(
+        data={CONF_STOP_IDS: ["stop-0"]},
+        options={CONF_LINES: [{"route_id": "route-1", "direction_id": "0"}]},
+        title="Hbf",
+        entry_id="entry-1",
+    )
+
+    coordinator = DeparturesDataUpdateCoordinator(hass, entry)
+    coordinator._hub = MagicMock(subscribers=1)
+
+    return coordinator
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    ("subscribers", "count", "batched"),
+    [
+        (1, 200, False),
+        (DEPARTURE_BATCH_MIN_SUBSCRIBERS, 100, False),
+        (DEPARTURE_BATCH_MIN_SUBSCRIBERS, 200, True),
+    ],
+)
+async def test_process_data_batch(
+    coordinator, monkeypatch, subscribers, count, batched
+):
+    """A batch is used by hubs with many subscribers and stop times only."""
+    monkeypatch.setattr(coordinator_module, "DEPARTURE_BATCH_MIN_ROWS", 200)
+    departures = _departures(count)
+    coordinator._hub.subscribers = subscribers
+    coordinator._hub.batch.side_effect = DepartureBatch
+
+    result = coordinator._process_data(departures)
+
+    assert coordinator._hub.batch.called == batched
+    assert result[0] == unique_departures(departures, {"stop-0"})
+
+
+def _upcoming(minutes: float) -> Departure:
+    """Return a departure of line route-1 at stop-0 leaving in `minutes`."""
+    return dataclasses.replace(
+        _departure_in(minutes), route_id="route-1", stop_id="stop-0"
+    )
+
+
+@pytest.mark.asyncio
+async def test_update_serves_stale_departures(coordinator):
+    """Upcoming cached departures are served while the circuit is open."""
+    departures = [_upcoming(5), _upcoming(10)]
+    coordinator._hub.api_available = False
+    coordinator._hub.async_get_departures = AsyncMock(
+        side_effect=CircuitOpenError("http://test.api", 30)
+    )
+    coordinator._hub.stale_departures.return_value = departures
+    coordinator.async_update_listeners = MagicMock()
+
+    assert await coordinator._async_update_data() == departures
+    assert coordinator.stale
+    assert coordinator.departures_for("route-1", "0") == departures
+    coordinator.async_update_listeners.assert_called_once()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(("available", "stale"), [(True, [_upcoming(5)]), (False, [])])
+async def test_update_fails(coordinator, available, stale):
+    """The update fails if the circuit is closed or nothing is cached."""
+    coordinator._hub.api_available = available
+    coordinator._hub.async_get_departures = AsyncMock(side_effect=TimeoutError)
+    coordinator._hub.stale_departures.return_value = stale
+
+    with pytest.raises(UpdateFailed):
+        await coordinator._async_update_data()
+
+    assert not coordinator.stale
+
+
+@pytest.mark.asyncio
+async def test_update_recovers_from_stale(coordinator):
+    """A successful fetch clears the stale flag and notifies the listeners."""
+    departures = [_upcoming(5)]
+    coordinator._hub.api_available = False
+    coordinator._hub.async_get_departures = AsyncMock(
+        side_effect=[CircuitOpenError("http://test.api", 30), departures]
+    )
+    coordinator._hub.stale_departures.return_value = departures
+    coordinator.async_update_listeners = MagicMock()
+
+    await coordinator._async_update_data()
+    assert coordinator.stale
+
+    assert await coordinator._async_update_data() == departures
+    assert not coordinator.stale
+    assert coordinator.async_update_listeners.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_restore(coordinator):
+    """Departures of the last session are served until the first refresh."""
+    departures = [_upcoming(5)]
+    coordinator._hub.async_restore.return_value = departures
+    coordinator.async_set_updated_data = MagicMock()
+
+    assert await coordinator.async_restore()
+    assert coordinator.departures_for("route-1", "0") == departures
+    coordinator.async_set_updated_data.assert_called_once_with(departures)
+
+
+@pytest.mark.asyncio
+async def test_restore_nothing_stored(coordinator):
+    """Without departures of the last session nothing is served."""
+    coordinator._hub.async_restore.return_value = []
+    coordinator.async_set_updated_data = MagicMock()
+
+    assert not await coordinator.async_restore()
+    coordinator.async_set_updated_data.assert_not_called()
@@ -1,11 +1,18 @@
 """Tests for the helper functions in ha_departures."""
 
+import timeit
 from datetime import datetime
 
 import pytest
 from homeassistant.util import dt as dt_util
 
-from custom_components.ha_departures.helper import bounding_box, str_to_datetime
+from custom_components.ha_departures import helper
+from custom_components.ha_departures.helper import (
+    TTLCache,
+    bounding_box,
+    stagger_offset,
+    str_to_datetime,
+)
 
 
 def test_bounding_box_basic():
@@ -109,3 +116,126 @@ def test_str_to_datetime_invalid_date():
 def test_str_to_datetime_leap_second():
     """Test str_to_datetime with a leap second (should be invalid)."""
     assert str_to_datetime("2016-12-31T23:59:60Z") is None
+
+
+def test_str_to_datetime_fast_path():
+    """Test str_to_datetime with the UTC format sent by Motis."""
+    iso_str = "2024-06-01T12:34:56Z"
+    result = str_to_datetime(iso_str)
+
+    assert result == dt_util.as_local(dt_util.parse_datetime(iso_str))
+    assert result.tzinfo == dt_util.DEFAULT_TIME_ZONE
+
+
+def test_str_to_datetime_time_zone_change():
+    """Test str_to_datetime follows a change of the local time zone."""
+    iso_str = "2024-06-01T12:34:56Z"
+    time_zone = dt_util.DEFAULT_TIME_ZONE
+
+    try:
+        dt_util.set_default_time_zone(dt_util.get_time_zone("Europe/Berlin"))
+        berlin = str_to_datetime(iso_str)
+        dt_util.set_default_time_zone(dt_util.get_time_zone("America/New_York"))
+        new_york = str_to_datetime(iso_str)
+    finally:
+        dt_util.set_default_time_zone(time_zone)
+
+    assert berlin == new_york
+    assert (berlin.hour, new_york.hour) == (14, 8)
+
+
+def test_str_to_datetime_parses_distinct_timestamps_once():
+    """Test every distinct timestamp of a refresh is parsed only once."""
+    dates = [f"2024-06-01T10:{i % 60:02d}:00Z" for i in range(2000)]
+    helper._str_to_datetime.cache_clear()
+
+    for date in dates:
+        str_to_datetime(date)
+
+    info = helper._str_to_datetime.cache_info()
+    assert (info.misses, info.hits) == (60, 1940)
+
+
+@pytest.mark.benchmark
+def test_str_to_datetime_benchmark():
+    """Benchmark: 2,000 timestamps of a refresh, memoized vs. uncached."""
+    dates = [f"2024-06-01T{10 + i // 60 % 12}:{i % 60:02d}:00Z" for i in range(2000)]
+
+    def uncached():
+        for date in dates:
+            dt_util.as_local(dt_util.parse_datetime(date))
+
+    def memoized():
+        for date in dates:
+            str_to_datetime(date)
+
+    time_uncached = min(timeit.repeat(uncached, number=5, repeat=3))
+    time_memoized = min(timeit.repeat(memoized, number=5, repeat=3))
+
+    assert time_memoized < time_uncached
+
+
+def test_stagger_offset_deterministic():
+    """Test stagger_offset returns the same offset for the same key."""
+    assert stagger_offset("entry-1", 60) == stagger_offset("entry-1", 60)
+
+
+def test_stagger_offset_within_interval():
+    """Test stagger_offset stays within interval plus jitter."""
+    offsets = [stagger_offset(f"entry-{i}", 60, jitter=5) for i in range(100)]
+
+    assert all(0 <= offset < 65 for offset in offsets)
+
+
+def test_stagger_offset_spread():
+    """Test stagger_offset spreads keys over the interval."""
+    offsets = [stagger_offset(f"entry-{i}", 60) for i in range(100)]
+
+    assert len({int(offset // 10) for offset in offsets}) == 6
+
+
+def test_ttl_cache_get_set():
+    """Cached values are returned until they expire."""
+    cache = TTLCache(maxsize=2, ttl=60)
+
+    assert cache.get("a") is None
+    cache.set("a", [1])
+
+    assert cache.get("a") == [1]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ttl_cache_expiry(freezer):
+    """Expired values are removed on access."""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+
+    freezer.tick(61)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_pop():
+    """Popped entries are removed, missing keys are ignored."""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+
+    cache.pop("a")
+    cache.pop("b")
+
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    """The least recently used entry is evicted if the cache is full."""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
@@ -0,0 +1,543 @@
+"""Tests for the stop times hub and its helpers."""
+
+import asyncio
+import json
+import re
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import pytest_asyncio
+from aiohttp import ClientResponseError
+from aioresponses import CallbackResult, aioresponses
+from homeassistant.util import dt as dt_util
+
+from custom_components.ha_departures import hub as hub_module
+from custom_components.ha_departures.api import motis_api
+from custom_components.ha_departures.api.data_classes import ApiCommand, Departure
+from custom_components.ha_departures.api.motis_api import MotisApi
+from custom_components.ha_departures.const import (
+    CONF_API_URL,
+    DOMAIN,
+    REQUEST_API_URL,
+    STORAGE_SAVE_DELAY,
+)
+from custom_components.ha_departures.hub import (
+    DomainData,
+    StopTimesHub,
+    async_get_client,
+    async_get_hub,
+    async_load_cache,
+    entry_api_urls,
+    merge_departures,
+)
+
+NOW = dt_util.now()
+OWN_API = "http://own.api"
+
+
+def _departure(trip_id: str, minutes: float, stop_id: str = "s1") -> Departure:
+    """Return a departure of `trip_id` leaving `minutes` after NOW."""
+    return Departure(
+        route_id="r1",
+        direction_id="0",
+        trip_id=trip_id,
+        stop_id=stop_id,
+        departure=NOW + timedelta(minutes=minutes),
+        head_sign="Ziel",
+        scheduled_departure=NOW + timedelta(minutes=minutes),
+        real_time=True,
+    )
+
+
+def test_merge_departures_replaces_by_trip_and_stop():
+    """Fresh departures replace cached ones of the same trip and stop."""
+    cached = [_departure("t1", 1), _departure("t1", 1, "s2"), _departure("t2", 5)]
+    fresh = [_departure("t1", 2, "s2"), _departure("t1", 3)]
+
+    result = merge_departures(cached, fresh, NOW)
+
+    assert result == [*fresh, cached[2]]
+
+
+def test_merge_departures_keeps_tail():
+    """Cached departures beyond the fresh window are kept, earlier dropped."""
+    cached = [_departure(f"t{i}", i) for i in range(1, 10)]
+    fresh = [_departure("t1", 1), _departure("t3", 3)]
+
+    result = merge_departures(cached, fresh, NOW)
+
+    # t2 is missing in the fresh window (e.g. removed by the server)
+    assert [d.trip_id for d in result] == ["t1", "t3", *(f"t{i}" for i in range(4, 10))]
+
+
+def test_merge_departures_keeps_boundary():
+    """Cached departures at the time of the last fresh one are kept."""
+    cached = [_departure("t1", 1), _departure("t2", 3), _departure("t3", 3)]
+    fresh = [_departure("t1", 1), _departure("t2", 3)]
+
+    result = merge_departures(cached, fresh, NOW)
+
+    # t3 leaves with t2, but was cut off by the size of the window
+    assert [d.trip_id for d in result] == ["t1", "t2", "t3"]
+
+
+def test_merge_departures_drops_departed():
+    """Departed departures are dropped from both lists."""
+    cached = [_departure("t0", -1), _departure("t9", 9)]
+    fresh = [_departure("t1", -2), _departure("t2", 2)]
+
+    result = merge_departures(cached, fresh, NOW)
+
+    assert [d.trip_id for d in result] == ["t2", "t9"]
+
+
+def test_merge_departures_without_fresh():
+    """Without fresh departures the upcoming cached ones are returned."""
+    cached = [_departure("t0", -1), _departure("t1", 1)]
+
+    assert merge_departures(cached, [], NOW) == [cached[1]]
+
+
+# ---------------------------------------------------------------------------
+# Departures of the last session
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.asyncio
+async def test_load_cache():
+    """Departures stored by the last session are restored per hub."""
+    hass = _hass(MagicMock())
+    departures = [_departure("t1", 5), _departure("t2", 10)]
+    store = hass.data[DOMAIN].store
+    store.async_load = AsyncMock(
+        return_value={"s1_0": [d.to_dict() for d in departures]}
+    )
+
+    await async_load_cache(hass)
+
+    assert hass.data[DOMAIN].cache == {"s1_0": departures}
+
+
+@pytest.mark.asyncio
+async def test_load_cache_empty():
+    """Nothing is restored without stored departures."""
+    hass = _hass(MagicMock())
+    hass.data[DOMAIN].store.async_load = AsyncMock(return_value=None)
+
+    await async_load_cache(hass)
+
+    assert hass.data[DOMAIN].cache == {}
+
+
+def test_save_cache_drops_departed():
+    """Departed departures and stops without upcoming ones are not saved."""
+    domain_data = DomainData(client=MagicMock(), store=MagicMock())
+    domain_data.cache = {
+        "s1_0": [_departure("t0", -1), _departure("t1", 5)],
+        "s2_0": [_departure("t2", -5, "s2")],
+    }
+
+    domain_data.async_save_cache()
+
+    save, delay = domain_data.store.async_delay_save.call_args.args
+    assert delay == STORAGE_SAVE_DELAY
+    assert save() == {"s1_0": [_departure("t1", 5).to_dict()]}
+
+
+def test_hub_restore_drops_departed():
+    """Only upcoming departures of the last session are restored."""
+    hass = _hass(MagicMock())
+    hass.data[DOMAIN].cache["s1_0"] = [_departure("t0", -1), _departure("t1", 5)]
+    hub = StopTimesHub(hass, MagicMock(), "s1", 0)
+
+    assert [d.trip_id for d in hub.async_restore()] == ["t1"]
+    assert [d.trip_id for d in hub.stale_departures()] == ["t1"]
+    assert StopTimesHub(hass, MagicMock(), "s2", 0).async_restore() == []
+
+
+def test_entry_api_urls():
+    """An entry uses its URLs in configured order, the public API if none."""
+    assert entry_api_urls(SimpleNamespace(options={})) == (REQUEST_API_URL,)
+    assert entry_api_urls(SimpleNamespace(options={CONF_API_URL: []})) == (
+        REQUEST_API_URL,
+    )
+    assert entry_api_urls(
+        SimpleNamespace(options={CONF_API_URL: [OWN_API, REQUEST_API_URL, OWN_API]})
+    ) == (OWN_API, REQUEST_API_URL)
+
+
+@pytest.fixture
+def hass(monkeypatch):
+    """Return a Home Assistant instance with the public API as client."""
+    monkeypatch.setattr(hub_module, "async_get_clientsession", lambda hass: None)
+
+    return _hass(MotisApi(REQUEST_API_URL))
+
+
+def test_get_client(hass):
+    """Entries with the same URLs share a client, the public API is the default."""
+    own = async_get_client(hass, (OWN_API,))
+
+    assert async_get_client(hass, (REQUEST_API_URL,)) is hass.data[DOMAIN].client
+    assert async_get_client(hass, (OWN_API,)) is own
+    assert [e.base_url for e in own.endpoints] == [OWN_API]
+    assert async_get_client(hass, (OWN_API, REQUEST_API_URL)) is not own
+
+
+def test_get_hub_per_endpoints(hass):
+    """Only entries with the same API endpoints share the hub of a stop."""
+    public = async_get_hub(hass, "s1_G", 0)
+    own = async_get_hub(hass, "s1", 0, (OWN_API,))
+
+    assert async_get_hub(hass, "s1", 0) is public
+    assert async_get_hub(hass, "s1", 0, (OWN_API,)) is own
+    assert own is not public
+    assert public.client is hass.data[DOMAIN].client
+    assert [e.base_url for e in own.client.endpoints] == [OWN_API]
+
+
+def test_hub_removed_with_client(hass):
+    """The client of own endpoints is dropped with the last hub using it."""
+    domain_data = hass.data[DOMAIN]
+    first = async_get_hub(hass, "s1", 0, (OWN_API,))
+    second = async_get_hub(hass, "s2", 0, (OWN_API,))
+    unsubscribe = [hub.async_subscribe(_coordinator()) for hub in (first, second)]
+
+    unsubscribe[0]()
+    assert domain_data.clients == {(OWN_API,): second.client}
+
+    unsubscribe[1]()
+    assert domain_data.hubs == {}
+    assert domain_data.clients == {}
+
+
+# ---------------------------------------------------------------------------
+# StopTimesHub
+# ---------------------------------------------------------------------------
+
+
+def _stop_time(trip_id: str, minutes: float, route_id: str = "r1") -> dict:
+    """Return a stop time at stop s1 leaving `minutes` from now."""
+    when = (dt_util.utcnow() + timedelta(minutes=minutes)).strftime(
+        "%Y-%m-%dT%H:%M:%SZ"
+    )
+
+    return {
+        "routeId": route_id,
+        "directionId": "0",
+        "tripId": trip_id,
+        "headsign": "Ziel",
+        "place": {"stopId": "s1", "departure": when, "scheduledDeparture": when},
+    }
+
+
+def _hass(client) -> SimpleNamespace:
+    """Return a minimal Home Assistant instance holding the domain data."""
+    return SimpleNamespace(
+        data={DOMAIN: DomainData(client=client, store=MagicMock())},
+        async_create_task=lambda target, name=None: asyncio.ensure_future(target),
+    )
+
+
+def _coordinator(*line_keys: tuple[str, str]) -> MagicMock:
+    """Return a subscriber of stop s1 tracking `line_keys` (line r1 if none)."""
+    return MagicMock(
+        stop_ids=["s1"],
+        line_keys=set(line_keys) or {("r1", "0")},
+        async_set_hub_data=AsyncMock(),
+    )
+
+
+@pytest_asyncio.fixture
+async def api():
+    """Return a client of a test server with a closed circuit breaker."""
+    motis_api._ENDPOINTS.pop("http://test.api", None)
+    motis_api._LIMITERS.pop("http://test.api", None)
+    api = MotisApi(base_url="http://test.api")
+    yield api
+    await api.close()
+
+
+def test_hub_batch_built_once_per_fetch():
+    """Subscribers share the batch of the same departures."""
+    hub = StopTimesHub(_hass(MagicMock()), MagicMock(), "s1", 0)
+    departures = [_departure("t1", 1), _departure("t2", 2)]
+
+    batch = hub.batch(departures)
+
+    assert batch is not None
+    assert hub.batch(departures) is batch
+    assert hub.batch(list(departures)) is not batch
+
+
+@pytest.mark.asyncio
+async def test_hub_refetches_first_page_after_failed_refresh(api):
+    """A first page received by a failed refresh is not skipped as unchanged."""
+    hub = StopTimesHub(_hass(api), api, "s1", 0)
+    coordinator = _coordinator()
+    hub.async_subscribe(coordinator)
+
+    first = {"stopTimes": [_stop_time("t1", 5)]}
+    second = {"stopTimes": [_stop_time("t2", 6)], "nextPageCursor": "p2"}
+    responses = [
+        # Two full fetches until the window size is learned
+        CallbackResult(payload=first),
+        CallbackResult(payload=first),
+        # Changed first page, the next page fails
+        CallbackResult(payload=second),
+        CallbackResult(status=404, reason="Not Found"),
+        # Same first page again
+        CallbackResult(payload=second),
+        CallbackResult(payload={"stopTimes": []}),
+    ]
+
+    with aioresponses() as mocked:
+        mocked.get(
+            re.compile(rf"{api.base_url}/{ApiCommand.STOP_TIMES.value}\?.*"),
+            callback=lambda url, **kwargs: responses.pop(0),
+            repeat=True,
+        )
+
+        for _ in range(2):
+            await hub.async_get_departures(coordinator, timedelta(0))
+
+        with pytest.raises(ClientResponseError):
+            await hub.async_get_departures(coordinator, timedelta(0))
+
+        departures = await hub.async_get_departures(coordinator, timedelta(0))
+
+    assert [d.trip_id for d in departures] == ["t2"]
+    assert not responses
+
+
+@pytest.mark.asyncio
+async def test_hub_incremental_refresh_keeps_frequent_line(api):
+    """The near-term window of a frequent line is not cut at the sensor limit."""
+    hub = StopTimesHub(_hass(api), api, "s1", 0)
+    coordinator = _coordinator(("r1", "0"), ("r2", "0"))
+    hub.async_subscribe(coordinator)
+
+    # r1 leaves every 5 minutes, r2 every 30 minutes
+    full = [_stop_time(f"a{i}", 5 * i) for i in range(1, 21)]
+    full += [_stop_time(f"b{i}", 30 * i, "r2") for i in range(1, 11)]
+    near_term = [_stop_time(f"a{i}", 5 * i) for i in range(1, 13)]
+    near_term += [_stop_time(f"b{i}", 30 * i, "r2") for i in range(1, 3)]
+    responses = [
+        CallbackResult(payload={"stopTimes": full}),
+        CallbackResult(payload={"stopTimes": near_term}),
+    ]
+
+    with aioresponses() as mocked:
+        mocked.get(
+            re.compile(rf"{api.base_url}/{ApiCommand.STOP_TIMES.value}\?.*"),
+            callback=lambda url, **kwargs: responses.pop(0),
+            repeat=True,
+        )
+
+        await hub.async_get_departures(coordinator, timedelta(0))
+        departures = await hub.async_get_departures(coordinator, timedelta(0))
+
+    assert not responses
+    assert [d.trip_id for d in departures if d.route_id == "r1"] == [
+        f"a{i}" for i in range(1, 21)
+    ]
+    assert len(departures) == 30
+
+
+@pytest.mark.asyncio
+async def test_hub_learns_from_attempt_used(api):
+    """Stop times of a failed attempt are not counted by the one used."""
+    motis_api._ENDPOINTS.pop("http://other.api", None)
+    motis_api._LIMITERS.pop("http://other.api", None)
+    api.set_endpoints([api.base_url, "http://other.api"])
+    hub = StopTimesHub(_hass(api), api, "s1", 0)
+    coordinator = _coordinator()
+    hub.async_subscribe(coordinator)
+
+    stop_times = [_stop_time("t1", 5), _stop_time("t2", 6)]
+    others = [_stop_time(f"o{i}", i, "r2") for i in range(8)]
+    truncated = json.dumps({"stopTimes": others + stop_times}).encode()[:-10]
+
+    with aioresponses() as mocked:
+        mocked.get(
+            re.compile(rf"{api.base_url}/{ApiCommand.STOP_TIMES.value}\?.*"),
+            body=truncated,
+        )
+        mocked.get(
+            re.compile(rf"http://other.api/{ApiCommand.STOP_TIMES.value}\?.*"),
+            payload={"stopTimes": stop_times},
+        )
+
+        departures = await hub.async_get_departures(coordinator, timedelta(0))
+
+    assert [d.trip_id for d in departures] == ["t1", "t2"]
+    assert hub._rows_per_departure == {("r1", "0"): 1.0}
+
+
+def _mock_stop_times(mocked: aioresponses, api: MotisApi, stop_times: list) -> list:
+    """Answer every stop times request with `stop_times`, return requested URLs."""
+    requested = []
+
+    def callback(url, **kwargs):
+        requested.append(url)
+        return CallbackResult(payload={"stopTimes": stop_times})
+
+    mocked.get(
+        re.compile(rf"{api.base_url}/{ApiCommand.STOP_TIMES.value}\?.*"),
+        callback=callback,
+        repeat=True,
+    )
+
+    return requested
+
+
+@pytest.mark.asyncio
+async def test_hub_reuses_fresh_departures(api):
+    """Departures fetched less than half of `max_age` ago are not fetched again."""
+    hub = StopTimesHub(_hass(api), api, "s1", 0)
+    coordinator = _coordinator()
+    hub.async_subscribe(coordinator)
+
+    with aioresponses() as mocked:
+        requested = _mock_stop_times(mocked, api, [_stop_time("t1", 5)])
+
+        first = await hub.async_get_departures(coordinator, timedelta(hours=1))
+        second = await hub.async_get_departures(coordinator, timedelta(hours=1))
+
+    assert len(requested) == 1
+    assert second is first
+    assert [d.trip_id for d in second] == ["t1"]
+
+
+@pytest.mark.asyncio
+async def test_hub_joins_fetch_in_flight(api):
+    """Callers arriving while a request is in flight wait for its result."""
+    hub = StopTimesHub(_hass(api), api, "s1", 0)
+    coordinators = [_coordinator(), _coordinator()]
+    for coordinator in coordinators:
+        hub.async_subscribe(coordinator)
+
+    with aioresponses() as mocked:
+        requested = _mock_stop_times(mocked, api, [_stop_time("t1", 5)])
+
+        first, second = await asyncio.gather(
+            *(hub.async_get_departures(c, timedelta(0)) for c in coordinators)
+        )
+
+    assert len(requested) == 1
+    assert second is first
+    # Both received the result as callers, none is notified separately
+    for coordinator in coordinators:
+        coordinator.async_set_hub_data.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_hub_fans_out_to_other_subscribers(api):
+    """Subscribers not waiting for the fetch receive its departures."""
+    hub = StopTimesHub(_hass(api), api, "s1", 0)
+    caller, other = _coordinator(), _coordinator()
+    hub.async_subscribe(caller)
+    hub.async_subscribe(other)
+
+    with aioresponses() as mocked:
+        _mock_stop_times(mocked, api, [_stop_time("t1", 5)])
+
+        departures = await hub.async_get_departures(caller, timedelta(0))
+        await asyncio.sleep(0)
+
+    caller.async_set_hub_data.assert_not_called()
+    other.async_set_hub_data.assert_called_once_with(departures)
+
+
+@pytest.mark.asyncio
+async def test_hub_refetches_for_new_lines(api):
+    """Fresh departures are fetched again for a subscriber with new lines."""
+    hub = StopTimesHub(_hass(api), api, "s1", 0)
+    first = _coordinator()
+    hub.async_subscribe(first)
+    stop_times = [_stop_time("t1", 5), _stop_time("t2", 6, "r2")]
+
+    with aioresponses() as mocked:
+        requested = _mock_stop_times(mocked, api, stop_times)
+
+        departures = await hub.async_get_departures(first, timedelta(hours=1))
+        assert [d.trip_id for d in departures] == ["t1"]
+
+        second = _coordinator(("r2", "0"))
+        hub.async_subscribe(second)
+        departures = await hub.async_get_departures(second, timedelta(hours=1))
+        assert len(requested) == 2
+
+        # Both are covered by the new fetch
+        await hub.async_get_departures(first, timedelta(hours=1))
+        await hub.async_get_departures(second, timedelta(hours=1))
+
+    assert len(requested) == 2
+    assert [d.trip_id for d in departures] == ["t1", "t2"]
+
+
+def test_hub_window_size():
+    """Lines without departures do not enlarge the request."""
+    hub = StopTimesHub(_hass(MagicMock()), MagicMock(), "s1", 0)
+    lines = {("r1", "0"), ("r9", "0")}
+
+    # Not learned yet
+    assert hub._window_size(lines, 10) == 200
+
+    hub._rows_per_departure = {("r1", "0"): 2.0, ("r9", "0"): None}
+    assert hub._window_size(lines, 10) == 30
+
+    hub._rows_per_departure = {("r1", "0"): None, ("r9", "0"): None}
+    assert hub._window_size(lines, 10) == 100
+
+
+@pytest.mark.asyncio
+async def test_hub_does_not_page_for_line_without_departures(api):
+    """A line not running does not request more pages or a full window."""
+    hub = StopTimesHub(_hass(api), api, "s1", 0)
+    coordinator = _coordinator(("r1", "0"), ("r9", "0"))
+    hub.async_subscribe(coordinator)
+    requested = []
+
+    def callback(url, **kwargs):
+        requested.append(url)
+        # Every body differs, none is skipped as unchanged
+        return CallbackResult(
+            payload={
+                "stopTimes": [_stop_time(f"t{i}", 2 * i) for i in range(1, 26)],
+                "nextPageCursor": "next",
+                "previousPageCursor": str(len(requested)),
+            }
+        )
+
+    with aioresponses() as mocked:
+        mocked.get(
+            re.compile(rf"{api.base_url}/{ApiCommand.STOP_TIMES.value}\?.*"),
+            callback=callback,
+            repeat=True,
+        )
+
+        for _ in range(3):
+            departures = await hub.async_get_departures(coordinator, timedelta(0))
+
+    assert [url.query["n"] for url in requested] == ["200", "5", "5"]
+    assert "pageCursor" not in requested[0].query
+    assert len(departures) == 25
+
+
+def test_hub_removed_with_last_subscriber():
+    """The hub is removed from the domain data when the last one unsubscribes."""
+    hass = _hass(MagicMock())
+    hubs = hass.data[DOMAIN].hubs
+    hub = StopTimesHub(hass, MagicMock(), "s1", 0)
+    hubs[hub.key] = hub
+    unsubscribe = [hub.async_subscribe(_coordinator()) for _ in range(2)]
+
+    unsubscribe[0]()
+    assert hubs == {("s1", 0, (REQUEST_API_URL,)): hub}
+    assert hub.subscribers == 1
+
+    unsubscribe[1]()
+    assert hubs == {}
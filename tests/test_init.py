@@ -0,0 +1,64 @@
+"""Tests for setting up the integration."""
+
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from homeassistant.exceptions import ConfigEntryNotReady
+
+import custom_components.ha_departures as integration
+
+
+@pytest.fixture
+def coordinator(monkeypatch):
+    """Return the coordinator created by the set up of a config entry."""
+    coordinator = MagicMock(
+        async_restore=AsyncMock(return_value=False),
+        async_config_entry_first_refresh=AsyncMock(),
+        last_update_success=True,
+    )
+    monkeypatch.setattr(
+        integration, "DeparturesDataUpdateCoordinator", lambda hass, entry: coordinator
+    )
+
+    return coordinator
+
+
+@pytest.fixture
+def hass():
+    """Return a Home Assistant instance forwarding the set up to the platforms."""
+    hass = MagicMock()
+    hass.config_entries.async_forward_entry_setups = AsyncMock()
+
+    return hass
+
+
+@pytest.mark.asyncio
+async def test_setup_entry_restores_departures(hass, coordinator):
+    """With departures of the last session the first refresh is not awaited."""
+    coordinator.async_restore.return_value = True
+    coordinator.last_update_success = False
+
+    assert await integration.async_setup_entry(hass, MagicMock())
+
+    coordinator.async_config_entry_first_refresh.assert_not_awaited()
+    coordinator.async_stagger_refresh.assert_called_once()
+    hass.config_entries.async_forward_entry_setups.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_setup_entry_first_refresh(hass, coordinator):
+    """Without departures of the last session the first refresh is awaited."""
+    assert await integration.async_setup_entry(hass, MagicMock())
+
+    coordinator.async_config_entry_first_refresh.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_setup_entry_not_ready(hass, coordinator):
+    """Without departures of the last session a failed refresh is retried."""
+    coordinator.last_update_success = False
+
+    with pytest.raises(ConfigEntryNotReady):
+        await integration.async_setup_entry(hass, MagicMock())
+
+    hass.config_entries.async_forward_entry_setups.assert_not_awaited()
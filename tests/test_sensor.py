@@ -0,0 +1,185 @@
+"""Tests for the departures sensors."""
+
+import dataclasses
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+import pytest
+from homeassistant.util import dt as dt_util
+
+from custom_components.ha_departures.api.data_classes import Departure
+from custom_components.ha_departures.const import ATTR_TIMES, ATTR_TRIP_ID
+from custom_components.ha_departures.sensor import (
+    DeparturesCountdownSensor,
+    DeparturesSensor,
+)
+
+NOW = dt_util.now()
+
+DEPARTURE = Departure(
+    route_id="r1",
+    direction_id="0",
+    trip_id="t1",
+    stop_id="s1",
+    departure=NOW + timedelta(minutes=5),
+    head_sign="Ziel",
+    scheduled_departure=NOW + timedelta(minutes=5),
+    real_time=True,
+)
+
+
+def _sensor(sensor_class: type[DeparturesSensor], departures: list[Departure]):
+    """Return a sensor of line r1 writing its state to `sensor.writes`."""
+    coordinator = MagicMock(
+        hub_name="Hbf", stop_coord=None, stale=False, suppressed_writes=0
+    )
+    coordinator.departures_for.return_value = departures
+
+    sensor = sensor_class(
+        MagicMock(),
+        coordinator,
+        {
+            "route_id": "r1",
+            "direction_id": "0",
+            "head_sign": "Ziel",
+            "route_short_name": "1",
+            "transport_mode": "BUS",
+        },
+    )
+    sensor.writes = 0
+
+    def write() -> None:
+        sensor.writes += 1
+
+    sensor.async_write_ha_state = write
+
+    return sensor
+
+
+@pytest.fixture
+def sensor():
+    """Return a sensor of line r1 with one departure."""
+    return _sensor(DeparturesSensor, [DEPARTURE])
+
+
+def test_unchanged_departures_not_written(sensor):
+    """The state is not written again for the same departures."""
+    sensor._handle_coordinator_update()
+    sensor._handle_coordinator_update()
+
+    assert sensor.writes == 1
+    assert sensor.coordinator.suppressed_writes == 1
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        {"head_sign": "Umleitung"},
+        {"alerts": True},
+        {"scheduled_track": "2"},
+        {"scheduled_departure": NOW + timedelta(minutes=4)},
+    ],
+)
+def test_changed_attribute_written(sensor, changes):
+    """A change of any rendered field is written."""
+    sensor._handle_coordinator_update()
+    sensor.coordinator.departures_for.return_value = [
+        dataclasses.replace(DEPARTURE, **changes)
+    ]
+
+    sensor._handle_coordinator_update()
+
+    assert sensor.writes == 2
+    assert len(sensor.extra_state_attributes[ATTR_TIMES]) == 1
+
+
+# ---------------------------------------------------------------------------
+# DeparturesCountdownSensor
+# ---------------------------------------------------------------------------
+
+
+def _departure_at(trip_id: str, departure: datetime, **kwargs) -> Departure:
+    """Return a departure of line r1 leaving at `departure`."""
+    return dataclasses.replace(
+        DEPARTURE,
+        trip_id=trip_id,
+        departure=departure,
+        scheduled_departure=departure,
+        **kwargs,
+    )
+
+
+def test_countdown_ticks_locally():
+    """The minutes left are advanced without an update of the coordinator."""
+    now = dt_util.now()
+    sensor = _sensor(
+        DeparturesCountdownSensor, [_departure_at("t1", now + timedelta(minutes=5))]
+    )
+
+    sensor._handle_coordinator_update()
+    sensor._async_countdown(now + timedelta(minutes=2, seconds=30))
+
+    assert sensor.native_value == 2
+    assert sensor.writes == 2
+    sensor.coordinator.departures_for.assert_called_once()
+
+
+def test_countdown_same_minute_not_written():
+    """The state is written only if the shown minute changed."""
+    now = dt_util.now()
+    sensor = _sensor(
+        DeparturesCountdownSensor, [_departure_at("t1", now + timedelta(minutes=5))]
+    )
+    sensor._handle_coordinator_update()
+    sensor._async_countdown(now + timedelta(seconds=30))
+    writes = sensor.writes
+
+    sensor._async_countdown(now + timedelta(seconds=40))
+    sensor._async_countdown(now + timedelta(seconds=50))
+
+    assert sensor.writes == writes
+    assert sensor.native_value == 4
+
+
+def test_countdown_promotes_next_departure():
+    """A departed entry is dropped and the next one is shown."""
+    now = dt_util.now()
+    sensor = _sensor(
+        DeparturesCountdownSensor,
+        [
+            _departure_at("t1", now + timedelta(minutes=1)),
+            _departure_at("t2", now + timedelta(minutes=6), cancelled=True),
+            _departure_at("t3", now + timedelta(minutes=8)),
+        ],
+    )
+    sensor._handle_coordinator_update()
+
+    sensor._async_countdown(now + timedelta(minutes=1, seconds=1))
+
+    assert sensor.extra_state_attributes[ATTR_TRIP_ID] == "t3"
+    assert sensor.native_value == 6
+
+    sensor._async_countdown(now + timedelta(minutes=9))
+
+    assert sensor.extra_state_attributes[ATTR_TRIP_ID] is None
+    assert sensor.native_value is None
+
+
+def test_countdown_sorts_by_expected_departure():
+    """A delayed departure listed first does not hide an earlier one."""
+    now = dt_util.now()
+    sensor = _sensor(
+        DeparturesCountdownSensor,
+        [
+            _departure_at("delayed", now + timedelta(minutes=9)),
+            _departure_at("t2", now + timedelta(minutes=3)),
+        ],
+    )
+    sensor._handle_coordinator_update()
+
+    assert sensor.extra_state_attributes[ATTR_TRIP_ID] == "t2"
+
+    sensor._async_countdown(now + timedelta(minutes=4))
+
+    assert sensor.extra_state_attributes[ATTR_TRIP_ID] == "delayed"
+    assert sensor.native_value == 5